@@ -1,3 +1,6 @@
+import time
+from abc import ABC, abstractmethod
+
 import numpy as np
 
 from pan_tompkins_plus_plus.algos.pan_tompkins_plus_plus import (
@@ -5,6 +8,19 @@ from pan_tompkins_plus_plus.algos.pan_tompkins_plus_plus import (
 )
 
 
+def compute_nec(rr_sec: np.ndarray, grid_ms: float) -> int | None:
+    rr_ms = np.asarray(rr_sec, dtype=float) * 1000.0
+    if rr_ms.size < 2:
+        return None
+
+    drr_ms = np.diff(rr_ms)
+    rr_points_ms = rr_ms[1:]
+    rr_bins = np.floor(rr_points_ms / grid_ms).astype(np.int64)
+    drr_bins = np.floor(drr_ms / grid_ms).astype(np.int64)
+    cells = np.column_stack((rr_bins, drr_bins))
+    return int(np.unique(cells, axis=0).shape[0])
+
+
 class AFRdRDetector:
     def __init__(
         self,
@@ -25,23 +41,41 @@ class AFRdRDetector:
         self._det = RpeakDetection()
         self._rr_intervals: list[float] = []
         self._new_rr_since_eval = 0
-        self._last_result = {
+        self._last_result = self._empty_result()
+        self.last_detection_s = 0.0
+
+    def _empty_result(self) -> dict:
+        return {
             "af_detected": False,
             "nec": None,
             "beats_used": 0,
             "threshold": self.nec_threshold,
         }
 
+    @property
+    def last_result(self) -> dict:
+        return self._last_result
+
     def reset(self) -> None:
         self._rr_intervals.clear()
         self._new_rr_since_eval = 0
-        self._last_result = {
-            "af_detected": False,
-            "nec": None,
-            "beats_used": 0,
-            "threshold": self.nec_threshold,
+        self._last_result = self._empty_result()
+
+    def get_state(self) -> dict:
+        # RR intervals are whole sample counts / fs, so storing the counts is exact and compact
+        rr = np.asarray(self._rr_intervals, dtype=float)
+        return {
+            "rr_samples": np.rint(rr * self.fs_hz).astype(np.uint16),
+            "new_rr_since_eval": int(self._new_rr_since_eval),
+            "last_result": dict(self._last_result),
         }
 
+    def load_state(self, state: dict) -> None:
+        rr_samples = np.asarray(state["rr_samples"], dtype=float)
+        self._rr_intervals = (rr_samples / float(self.fs_hz)).tolist()[-self.window_beats :]
+        self._new_rr_since_eval = int(state["new_rr_since_eval"])
+        self._last_result = dict(state["last_result"])
+
     def _apply_refractory(self, peaks: np.ndarray) -> np.ndarray:
         peaks = np.asarray(peaks, dtype=int)
         if peaks.size == 0:
@@ -56,34 +90,32 @@ class AFRdRDetector:
         return np.asarray(keep, dtype=int)
 
     def _compute_nec(self, rr_sec: np.ndarray) -> int | None:
-        rr_ms = np.asarray(rr_sec, dtype=float) * 1000.0
-        if rr_ms.size < 2:
-            return None
-
-        drr_ms = np.diff(rr_ms)
-        rr_points_ms = rr_ms[1:]
-        rr_bins = np.floor(rr_points_ms / self.grid_ms).astype(np.int64)
-        drr_bins = np.floor(drr_ms / self.grid_ms).astype(np.int64)
-        cells = np.column_stack((rr_bins, drr_bins))
-        return int(np.unique(cells, axis=0).shape[0])
+        return compute_nec(rr_sec, self.grid_ms)
 
-    def update(self, ecg: np.ndarray) -> dict:
+    def extract_rr(self, ecg: np.ndarray) -> np.ndarray:
         ecg = np.asarray(ecg, dtype=float)
 
         peaks = np.asarray(self._det.rpeak_detection(ecg, self.fs_hz), dtype=int)
         peaks = self._apply_refractory(peaks)
+        if peaks.size < 2:
+            return np.empty(0, dtype=float)
+
+        rr = np.diff(peaks) / float(self.fs_hz)
+        return rr[(rr >= 0.3) & (rr < 3.0)]
 
-        if peaks.size >= 2:
-            rr = np.diff(peaks) / float(self.fs_hz)
-            rr = rr[(rr >= 0.3) & (rr < 3.0)]
-            if rr.size:
-                self._rr_intervals.extend(rr.tolist())
-                self._new_rr_since_eval += int(rr.size)
+    def _ingest(self, ecg: np.ndarray) -> None:
+        start = time.perf_counter()
+        rr = self.extract_rr(ecg)
+        self.last_detection_s = time.perf_counter() - start
+        if rr.size:
+            self._rr_intervals.extend(rr.tolist())
+            self._new_rr_since_eval += int(rr.size)
 
         if len(self._rr_intervals) > self.window_beats:
             self._rr_intervals = self._rr_intervals[-self.window_beats :]
 
-        should_eval = (
+    def _should_eval(self) -> bool:
+        return (
             len(self._rr_intervals) >= self.window_beats
             and (
                 self._last_result["beats_used"] == 0
@@ -91,17 +123,298 @@ class AFRdRDetector:
             )
         )
 
-        if should_eval:
+    def _evaluate(self, rr_window: np.ndarray) -> dict:
+        nec = self._compute_nec(rr_window)
+        af_detected = bool(nec is not None and nec > self.nec_threshold)
+        return {
+            "af_detected": af_detected,
+            "nec": nec,
+            "beats_used": int(self.window_beats),
+            "threshold": self.nec_threshold,
+        }
+
+    def update(self, ecg: np.ndarray) -> dict:
+        self._ingest(ecg)
+
+        if self._should_eval():
             rr_window = np.asarray(self._rr_intervals[-self.window_beats :], dtype=float)
-            nec = self._compute_nec(rr_window)
-            af_detected = bool(nec is not None and nec > self.nec_threshold)
-
-            self._last_result = {
-                "af_detected": af_detected,
-                "nec": nec,
-                "beats_used": int(self.window_beats),
-                "threshold": self.nec_threshold,
-            }
+            self._last_result = self._evaluate(rr_window)
             self._new_rr_since_eval = 0
 
         return self._last_result
+
+
+# ==================== Detector Plugins ====================
+# Each plugin sees the same RR window (seconds) that AFEnsembleDetector keeps,
+# so R-peak detection runs once per chunk no matter how many plugins are active.
+
+class AFPlugin(ABC):
+    name = "base"
+
+    def __init__(self, threshold: float):
+        self.threshold = float(threshold)
+        self.value: float | None = None
+
+    def reset(self) -> None:
+        self.value = None
+
+    @abstractmethod
+    def compute(self, rr_window: np.ndarray, n_new: int | None = None) -> float | None:
+        """Feature value for the RR window (seconds), or None if there are too few intervals."""
+
+    def vote(self, value: float) -> bool:
+        return value > self.threshold
+
+    def update(self, rr_window: np.ndarray, n_new: int | None = None) -> bool | None:
+        self.value = self.compute(rr_window, n_new)
+        if self.value is None:
+            return None
+        return bool(self.vote(self.value))
+
+
+class NECPlugin(AFPlugin):
+    """Number of occupied (RR, dRR) grid cells, the original AFRdRDetector rule."""
+    name = "nec"
+
+    def __init__(self, threshold: float = 65, grid_ms: float = 25.0):
+        super().__init__(threshold)
+        self.grid_ms = float(grid_ms)
+
+    def compute(self, rr_window: np.ndarray, n_new: int | None = None) -> float | None:
+        return compute_nec(rr_window, self.grid_ms)
+
+
+class COSEnPlugin(AFPlugin):
+    """Coefficient of sample entropy (Lake & Moorman) with m=1 and tolerance r in seconds."""
+    name = "cosen"
+
+    def __init__(self, threshold: float = -1.4, r_sec: float = 0.03):
+        super().__init__(threshold)
+        self.r_sec = float(r_sec)
+
+    def compute(self, rr_window: np.ndarray, n_new: int | None = None) -> float | None:
+        rr = np.asarray(rr_window, dtype=float)
+        if rr.size < 3:
+            return None
+
+        # Template pairs (rr[i], rr[i + 1]); length-1 matches only use the first element
+        head = rr[:-1]
+        tail = rr[1:]
+        upper = np.triu_indices(head.size, 1)
+        match_1 = np.abs(head[:, None] - head[None, :])[upper] <= self.r_sec
+        match_2 = match_1 & (np.abs(tail[:, None] - tail[None, :])[upper] <= self.r_sec)
+        b_count = int(np.count_nonzero(match_1))
+        a_count = int(np.count_nonzero(match_2))
+        if a_count == 0 or b_count == 0:
+            return None
+
+        sampen = -np.log(a_count / b_count)
+        return float(sampen + np.log(2.0 * self.r_sec) - np.log(np.mean(rr)))
+
+
+class RMSSDPlugin(AFPlugin):
+    """RMSSD normalised by mean RR; successive differences are kept as running sums."""
+    name = "rmssd"
+    # Periodically recompute from scratch so floating-point drift cannot accumulate
+    REBUILD_EVERY = 64
+
+    def __init__(self, threshold: float = 0.1):
+        super().__init__(threshold)
+        self._window_size = 0
+        self._sum_rr = 0.0
+        self._sum_sq_diff = 0.0
+        self._last_window: np.ndarray | None = None
+        self._updates_since_rebuild = 0
+
+    def reset(self) -> None:
+        super().reset()
+        self._window_size = 0
+        self._sum_rr = 0.0
+        self._sum_sq_diff = 0.0
+        self._last_window = None
+        self._updates_since_rebuild = 0
+
+    def _rebuild(self, rr: np.ndarray) -> None:
+        self._window_size = rr.size
+        self._sum_rr = float(np.sum(rr))
+        self._sum_sq_diff = float(np.sum(np.diff(rr) ** 2))
+
+    def compute(self, rr_window: np.ndarray, n_new: int | None = None) -> float | None:
+        rr = np.asarray(rr_window, dtype=float)
+        if rr.size < 2:
+            return None
+
+        prev = self._last_window
+        if (
+            prev is None
+            or prev.size != rr.size
+            or n_new is None
+            or not 0 < n_new < rr.size - 1
+            or self._updates_since_rebuild >= self.REBUILD_EVERY
+        ):
+            self._rebuild(rr)
+            self._updates_since_rebuild = 0
+        else:
+            # Only touch the beats that left and entered the window
+            left = prev[: n_new + 1]
+            entered = rr[-(n_new + 1) :]
+            self._sum_rr += float(np.sum(entered[1:]) - np.sum(left[:-1]))
+            self._sum_sq_diff += float(np.sum(np.diff(entered) ** 2) - np.sum(np.diff(left) ** 2))
+            self._updates_since_rebuild += 1
+        self._last_window = rr.copy()
+
+        mean_rr = self._sum_rr / self._window_size
+        if mean_rr <= 0:
+            return None
+        rmssd = np.sqrt(max(self._sum_sq_diff, 0.0) / (self._window_size - 1))
+        return float(rmssd / mean_rr)
+
+
+class ShannonEntropyPlugin(AFPlugin):
+    """Normalised Shannon entropy of a 16-bin RR histogram after trimming outliers (Dash et al.)."""
+    name = "shannon"
+
+    def __init__(self, threshold: float = 0.7, n_bins: int = 16, trim: int = 8):
+        super().__init__(threshold)
+        self.n_bins = int(n_bins)
+        self.trim = int(trim)
+
+    def compute(self, rr_window: np.ndarray, n_new: int | None = None) -> float | None:
+        rr = np.sort(np.asarray(rr_window, dtype=float))
+        if rr.size > 2 * self.trim + 1:
+            rr = rr[self.trim : rr.size - self.trim]
+        if rr.size < 2 or rr[-1] <= rr[0]:
+            return 0.0 if rr.size >= 2 else None
+
+        counts, _ = np.histogram(rr, bins=self.n_bins, range=(rr[0], rr[-1]))
+        probs = counts[counts > 0] / float(rr.size)
+        return float(-np.sum(probs * np.log(probs)) / np.log(self.n_bins))
+
+
+def default_af_plugins(nec_threshold: int = 65, grid_ms: float = 25.0) -> list[AFPlugin]:
+    return [
+        NECPlugin(threshold=nec_threshold, grid_ms=grid_ms),
+        COSEnPlugin(),
+        RMSSDPlugin(),
+        ShannonEntropyPlugin(),
+    ]
+
+
+class AFEnsembleDetector(AFRdRDetector):
+    """Runs several AF plugins over one shared RR buffer and combines their votes.
+
+    `decision` is either "majority" (ensemble vote decides `af_detected`) or the
+    name of a plugin whose vote is reported as `af_detected`; the ensemble vote
+    is always reported alongside so the methods can be compared on live data.
+    """
+
+    def __init__(
+        self,
+        fs_hz: float = 160.0,
+        window_beats: int = 128,
+        grid_ms: float = 25.0,
+        nec_threshold: int = 65,
+        hr_max: float = 200.0,
+        min_new_rr_for_update: int = 10,
+        plugins: list[AFPlugin] | None = None,
+        decision: str = "majority",
+        min_votes: int | None = None,
+    ):
+        self.plugins = plugins if plugins is not None else default_af_plugins(nec_threshold, grid_ms)
+        names = [plugin.name for plugin in self.plugins]
+        if len(set(names)) != len(names):
+            raise ValueError(f"duplicate AF plugin names: {names}")
+        if decision != "majority" and decision not in names:
+            raise ValueError(f"unknown AF decision plugin: {decision}")
+        self.decision = decision
+        self.min_votes = min_votes
+        super().__init__(fs_hz, window_beats, grid_ms, nec_threshold, hr_max, min_new_rr_for_update)
+        self.reset_stats()
+
+    def _empty_result(self) -> dict:
+        result = super()._empty_result()
+        result["ensemble_af"] = False
+        result["votes"] = 0
+        result["plugins"] = {}
+        return result
+
+    def reset(self) -> None:
+        super().reset()
+        for plugin in self.plugins:
+            plugin.reset()
+
+    def load_state(self, state: dict) -> None:
+        super().load_state(state)
+        # Plugins rebuild their running state from the restored window on the next evaluation
+        for plugin in self.plugins:
+            plugin.reset()
+
+    def reset_stats(self) -> None:
+        self.evaluations = 0
+        self.plugin_time_s = {plugin.name: 0.0 for plugin in self.plugins}
+        self.plugin_agreements = {plugin.name: 0 for plugin in self.plugins}
+        self.plugin_evaluations = {plugin.name: 0 for plugin in self.plugins}
+
+    def _evaluate(self, rr_window: np.ndarray) -> dict:
+        # Beats that entered since the previous evaluation (None on the first one)
+        n_new = self._new_rr_since_eval if self._last_result["beats_used"] else None
+        votes = {}
+        values = {}
+        for plugin in self.plugins:
+            start = time.perf_counter()
+            vote = plugin.update(rr_window, n_new)
+            self.plugin_time_s[plugin.name] += time.perf_counter() - start
+            values[plugin.name] = plugin.value
+            if vote is not None:
+                votes[plugin.name] = vote
+                self.plugin_evaluations[plugin.name] += 1
+
+        positive = sum(1 for vote in votes.values() if vote)
+        needed = self.min_votes if self.min_votes is not None else len(votes) // 2 + 1
+        ensemble_af = bool(votes) and positive >= needed
+        for name, vote in votes.items():
+            if vote == ensemble_af:
+                self.plugin_agreements[name] += 1
+        self.evaluations += 1
+
+        if self.decision == "majority":
+            af_detected = ensemble_af
+        else:
+            af_detected = bool(votes.get(self.decision, False))
+
+        return {
+            "af_detected": af_detected,
+            "nec": values.get("nec"),
+            "beats_used": int(self.window_beats),
+            "threshold": self.nec_threshold,
+            "ensemble_af": ensemble_af,
+            "votes": positive,
+            "plugins": {
+                plugin.name: {
+                    "value": values[plugin.name],
+                    "af": votes.get(plugin.name),
+                    "threshold": plugin.threshold,
+                }
+                for plugin in self.plugins
+            },
+        }
+
+    def stats(self) -> dict:
+        return {
+            "evaluations": self.evaluations,
+            "plugins": {
+                name: {
+                    "evaluations": self.plugin_evaluations[name],
+                    "total_time_ms": self.plugin_time_s[name] * 1000.0,
+                    "mean_time_ms": (
+                        self.plugin_time_s[name] * 1000.0 / self.plugin_evaluations[name]
+                        if self.plugin_evaluations[name] else 0.0
+                    ),
+                    "agreement_rate": (
+                        self.plugin_agreements[name] / self.plugin_evaluations[name]
+                        if self.plugin_evaluations[name] else None
+                    ),
+                }
+                for name in self.plugin_time_s
+            },
+        }
@@ -0,0 +1,279 @@
+"""Offline parameter sweep for AFRdRDetector's NEC rule.
+
+RR intervals are extracted once per recording with the same chunking and
+R-peak pipeline as the live stream (10 s chunks at 160 Hz) and cached as
+.npz. The sweep then evaluates every (grid_ms, window_beats, nec_threshold,
+min_new_rr_for_update) combination:
+
+- RR/dRR grid codes are computed once per grid_ms,
+- NEC is computed once per (grid_ms, window_beats) at every chunk end,
+- min_new_rr_for_update only selects which chunk ends are evaluated,
+- all thresholds are compared in one broadcast.
+
+Usage:
+    python af_sweep.py ../ESP32/ECG_DATA/*.csv --out sweep.csv
+    python af_sweep.py /data/afdb/*.hea --jobs 8 --grid-ms 15 20 25 30 40
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from AF_detection import AFRdRDetector
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_CACHE_DIR = BASE_DIR / "data" / "rr_cache"
+DEFAULT_OUT = BASE_DIR / "pan_tompkins_plus_plus" / "results_csv" / "af_sweep.csv"
+
+FS_HZ = 160
+CHUNK_SECONDS = 10  # Matches ecg_wifi.WINDOW_SECONDS
+HR_MAX = 200.0
+
+
+# ==================== Recording Loading ====================
+
+def _read_csv_ecg(path: str) -> tuple[np.ndarray, float]:
+    values = []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            try:
+                values.append(float(row["ecg_value"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+    return np.asarray(values, dtype=float), float(FS_HZ)
+
+
+def _read_wfdb_ecg(path: str) -> tuple[np.ndarray, float]:
+    import wfdb
+
+    record = wfdb.rdrecord(os.path.splitext(path)[0], channels=[0])
+    return np.asarray(record.p_signal[:, 0], dtype=float), float(record.fs)
+
+
+def load_recording(path: str) -> np.ndarray:
+    if path.endswith(".hea"):
+        ecg, fs = _read_wfdb_ecg(path)
+    else:
+        ecg, fs = _read_csv_ecg(path)
+
+    ecg = ecg[np.isfinite(ecg)]
+    if int(round(fs)) != FS_HZ:
+        from math import gcd
+        from scipy.signal import resample_poly
+
+        fs_int = int(round(fs))
+        common = gcd(FS_HZ, fs_int)
+        ecg = resample_poly(ecg, FS_HZ // common, fs_int // common)
+    return ecg
+
+
+# ==================== RR Extraction + Cache ====================
+
+def _cache_path(path: str, cache_dir: Path) -> Path:
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{FS_HZ}|{CHUNK_SECONDS}|{HR_MAX}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return cache_dir / f"{Path(path).stem}_{digest}.npz"
+
+
+def extract_rr_chunks(path: str) -> tuple[np.ndarray, np.ndarray]:
+    """Return (rr_sec, rr_count_per_chunk) exactly as the streaming detector would see them."""
+    detector = AFRdRDetector(fs_hz=FS_HZ, hr_max=HR_MAX)
+    ecg = load_recording(path)
+    chunk_len = FS_HZ * CHUNK_SECONDS
+
+    rr_parts = []
+    counts = []
+    for start in range(0, ecg.size - chunk_len + 1, chunk_len):
+        try:
+            rr = detector.extract_rr(ecg[start : start + chunk_len])
+        except Exception:
+            # Flat or clipped chunks make the band-pass normalisation fail; the live
+            # stream would log and move on, so count it as a chunk with no beats.
+            rr = np.empty(0, dtype=float)
+        rr_parts.append(rr)
+        counts.append(rr.size)
+
+    rr_all = np.concatenate(rr_parts) if rr_parts else np.empty(0, dtype=float)
+    return rr_all, np.asarray(counts, dtype=np.int64)
+
+
+def _load_or_extract(args: tuple[str, str]) -> tuple[str, np.ndarray, np.ndarray, bool]:
+    path, cache_dir = args
+    cache_file = _cache_path(path, Path(cache_dir))
+    if cache_file.exists():
+        with np.load(cache_file) as cached:
+            return path, cached["rr"], cached["chunk_counts"], True
+
+    rr, chunk_counts = extract_rr_chunks(path)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_name(cache_file.name + ".tmp")
+    with open(tmp_file, "wb") as f:
+        np.savez(f, rr=rr, chunk_counts=chunk_counts)
+    os.replace(tmp_file, cache_file)
+    return path, rr, chunk_counts, False
+
+
+def load_rr_series(paths: list[str], cache_dir: Path, jobs: int = 1) -> list[tuple[str, np.ndarray, np.ndarray]]:
+    tasks = [(path, str(cache_dir)) for path in paths]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            loaded = list(pool.map(_load_or_extract, tasks))
+    else:
+        loaded = [_load_or_extract(task) for task in tasks]
+
+    hits = sum(1 for item in loaded if item[3])
+    print(f"[INFO] RR series: {len(loaded)} recordings ({hits} from cache)")
+    return [(path, rr, counts) for path, rr, counts, _ in loaded]
+
+
+# ==================== Vectorized NEC ====================
+
+def grid_codes(rr_sec: np.ndarray, grid_ms: float) -> np.ndarray:
+    """Integer cell id of every (RR, dRR) point; codes[j - 1] belongs to the pair (rr[j - 1], rr[j])."""
+    rr_ms = rr_sec * 1000.0
+    rr_bins = np.floor(rr_ms[1:] / grid_ms).astype(np.int64)
+    drr_bins = np.floor(np.diff(rr_ms) / grid_ms).astype(np.int64)
+    if drr_bins.size == 0:
+        return drr_bins
+    drr_min = int(drr_bins.min())
+    width = int(drr_bins.max()) - drr_min + 1
+    return rr_bins * width + (drr_bins - drr_min)
+
+
+def nec_at_ends(codes: np.ndarray, ends: np.ndarray, window_beats: int) -> np.ndarray:
+    """NEC of the last `window_beats` RR intervals before each end index (exclusive)."""
+    if ends.size == 0:
+        return np.empty(0, dtype=np.int64)
+    # A window rr[e - W : e] contributes the W - 1 pairs ending at rr[e - W + 1 .. e - 1]
+    starts = ends - window_beats
+    idx = starts[:, None] + np.arange(window_beats - 1)[None, :]
+    cells = np.sort(codes[idx], axis=1)
+    return 1 + np.count_nonzero(np.diff(cells, axis=1), axis=1)
+
+
+def eval_ends(chunk_counts: np.ndarray, window_beats: int, min_new_rr: int) -> np.ndarray:
+    """Cumulative RR counts at which AFRdRDetector.update() would re-evaluate."""
+    ends = []
+    total = 0
+    new_since_eval = 0
+    evaluated = False
+    for count in chunk_counts.tolist():
+        total += count
+        new_since_eval += count
+        if total >= window_beats and (not evaluated or new_since_eval >= min_new_rr):
+            ends.append(total)
+            new_since_eval = 0
+            evaluated = True
+    return np.asarray(ends, dtype=np.int64)
+
+
+# ==================== Sweep ====================
+
+def run_sweep(
+    series: list[tuple[str, np.ndarray, np.ndarray]],
+    grid_values: list[float],
+    window_values: list[int],
+    thresholds: np.ndarray,
+    min_new_values: list[int],
+) -> list[dict]:
+    n_configs = len(grid_values) * len(window_values) * len(min_new_values) * thresholds.size
+    print(f"[INFO] Sweeping {n_configs} configurations over {len(series)} recordings")
+
+    # Accumulators indexed [grid, window, min_new, threshold]
+    shape = (len(grid_values), len(window_values), len(min_new_values), thresholds.size)
+    af_evals = np.zeros(shape, dtype=np.int64)
+    af_recordings = np.zeros(shape, dtype=np.int64)
+    n_evals = np.zeros(shape[:3], dtype=np.int64)
+    elapsed = np.zeros(shape[:3], dtype=float)
+
+    for _, rr, chunk_counts in series:
+        rr_total = np.cumsum(chunk_counts)
+        for g, grid_ms in enumerate(grid_values):
+            grid_start = time.perf_counter()
+            codes = grid_codes(rr, grid_ms)
+            grid_share = (time.perf_counter() - grid_start) / (len(window_values) * len(min_new_values))
+
+            for w, window_beats in enumerate(window_values):
+                window_start = time.perf_counter()
+                candidate_ends = np.unique(rr_total[rr_total >= window_beats])
+                nec_all = nec_at_ends(codes, candidate_ends, window_beats)
+                window_share = (time.perf_counter() - window_start) / len(min_new_values)
+
+                for m, min_new_rr in enumerate(min_new_values):
+                    config_start = time.perf_counter()
+                    ends = eval_ends(chunk_counts, window_beats, min_new_rr)
+                    nec = nec_all[np.searchsorted(candidate_ends, ends)]
+                    flagged = nec[:, None] > thresholds[None, :]
+                    af_evals[g, w, m] += flagged.sum(axis=0)
+                    af_recordings[g, w, m] += flagged.any(axis=0)
+                    n_evals[g, w, m] += ends.size
+                    elapsed[g, w, m] += grid_share + window_share + time.perf_counter() - config_start
+
+    rows = []
+    for g, grid_ms in enumerate(grid_values):
+        for w, window_beats in enumerate(window_values):
+            for m, min_new_rr in enumerate(min_new_values):
+                evals = int(n_evals[g, w, m])
+                runtime_ms = elapsed[g, w, m] * 1000.0 / thresholds.size
+                for t, threshold in enumerate(thresholds.tolist()):
+                    rows.append({
+                        "grid_ms": grid_ms,
+                        "window_beats": window_beats,
+                        "nec_threshold": threshold,
+                        "min_new_rr_for_update": min_new_rr,
+                        "recordings": len(series),
+                        "evaluations": evals,
+                        "af_decision_rate": af_evals[g, w, m, t] / evals if evals else 0.0,
+                        "recordings_with_af": af_recordings[g, w, m, t] / len(series) if series else 0.0,
+                        "runtime_ms": round(runtime_ms, 4),
+                    })
+    return rows
+
+
+def write_table(rows: list[dict], out_path: Path) -> None:
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sweep AFRdRDetector NEC parameters across recordings")
+    parser.add_argument("recordings", nargs="+", help="ECG CSV files (ecg_value column, 160 Hz) or WFDB .hea files; globs allowed")
+    parser.add_argument("--grid-ms", type=float, nargs="+", default=[15.0, 20.0, 25.0, 30.0, 40.0])
+    parser.add_argument("--window-beats", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--threshold-range", type=int, nargs=3, default=[20, 120, 1], metavar=("START", "STOP", "STEP"))
+    parser.add_argument("--min-new-rr", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Processes used for RR extraction")
+    parser.add_argument("--out", type=Path, default=DEFAULT_OUT)
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.recordings for p in (glob.glob(pattern) or [pattern])})
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        raise FileNotFoundError(f"missing recordings: {missing}")
+
+    extract_start = time.perf_counter()
+    series = load_rr_series(paths, args.cache_dir, args.jobs)
+    print(f"[INFO] RR extraction: {time.perf_counter() - extract_start:.1f} s")
+
+    thresholds = np.arange(*args.threshold_range, dtype=np.int64)
+    sweep_start = time.perf_counter()
+    rows = run_sweep(series, args.grid_ms, args.window_beats, thresholds, [max(1, m) for m in args.min_new_rr])
+    print(f"[INFO] Sweep: {time.perf_counter() - sweep_start:.1f} s")
+
+    write_table(rows, args.out)
+    print(f"[Done] {len(rows)} rows saved: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,24 +3,39 @@ import eventlet
 import eventlet.wsgi
 eventlet.monkey_patch()
 
-import json
 import os
 import signal
 import sys
+import tempfile
 import threading
 import time
+import zipfile
 
-from flask import Flask, request, jsonify, abort, send_from_directory
+import numpy as np
+from flask import Flask, Response, request, jsonify, abort, stream_with_context
 from flask_cors import CORS
 from flask_sock import Sock
 from simple_websocket import Server
 
+import batch_writer
 import database
+import downsample
+import ecg_broker
+import ecg_frames
 import ecg_wifi
 import gemini
 import login
+import metrics
 import pseudo_data
+import response_cache
 import result_data
+import retention
+import risk_batch
+import risk_cache
+import risk_timeline
+import static_assets
+import user_export
+import pan_tompkins_plus_plus.predict as predict
 
 app = Flask(__name__)
 CORS(app)
@@ -30,10 +45,14 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 data_dir = os.path.join(basedir, 'data')
 os.makedirs(data_dir, exist_ok=True)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(data_dir, 'data.db')
+# Optional: per-user SQLite files for the streamed time-series tables (see shards.py)
+app.config['SQLITE_SHARD_DIR'] = os.environ.get('SQLITE_SHARD_DIR')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 database.init_db(app)
 
 ecg_wifi.flask_app = app
+db_writer = batch_writer.BatchWriter(app)
+ecg_wifi.db_writer = db_writer
 
 # --- Security Headers for Google Sign-In ---
 @app.after_request
@@ -44,20 +63,20 @@ def add_security_headers(response):
     return response
 
 # --- Frontend Server ---
+# Fingerprinted and precompressed once at startup (see static_assets.py)
+static_assets.build(os.path.join(basedir, '..', 'frontend'))
+
 @app.route('/', methods=['GET'])
 def serve_index():
-    frontend_dir = os.path.abspath(os.path.join(basedir, '..', 'frontend'))
-    return send_from_directory(frontend_dir, 'index.html')
-
-@app.route('/style.css', methods=['GET'])
-def serve_frontend():
-    frontend_dir = os.path.abspath(os.path.join(basedir, '..', 'frontend'))
-    return send_from_directory(frontend_dir, 'style.css')
+    return serve_frontend(static_assets.INDEX)
 
-@app.route('/script.js', methods=['GET'])
-def serve_script():
-    frontend_dir = os.path.abspath(os.path.join(basedir, '..', 'frontend'))
-    return send_from_directory(frontend_dir, 'script.js')
+@app.route('/<path:filename>', methods=['GET'])
+def serve_frontend(filename):
+    # Only files found under frontend/ at startup; the API and WebSocket routes match first
+    response = static_assets.serve(filename)
+    if response is None:
+        abort(404)
+    return response
 
 # --- Authentication Endpoints ---
 @app.route('/api/auth/google', methods=['POST'])
@@ -131,7 +150,41 @@ def health_data():
         return jsonify(result)
     
     # GET request
-    return jsonify(database.get_health_data(user_data["id"]))
+    return response_cache.respond(user_data["id"], 'health-data', (), ('health',),
+                                  lambda: database.get_health_data(user_data["id"]))
+
+@app.route('/api/v1/user/export', methods=['GET'])
+def export_user_data():
+    user_data = login.check_auth(request)
+    if "error" in user_data:
+        status_code, message = user_data["error"]
+        abort(status_code, message)
+    # Streamed page by page; see user_export.py for the file layout
+    return Response(
+        stream_with_context(user_export.stream_export(user_data["id"])),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=user{user_data["id"]}.npz'},
+    )
+
+@app.route('/api/v1/user/import', methods=['POST'])
+def import_user_data():
+    user_data = login.check_auth(request)
+    if "error" in user_data:
+        status_code, message = user_data["error"]
+        abort(status_code, message)
+    upload = request.files.get('file')
+    if upload is None:
+        abort(400, 'Missing file')
+    # np.load needs a seekable file, so the upload is spooled to disk first
+    with tempfile.NamedTemporaryFile(suffix='.npz', dir=data_dir) as tmp:
+        upload.save(tmp)
+        tmp.flush()
+        try:
+            imported = user_export.import_user(tmp.name, user_data["id"])
+        except (ValueError, KeyError, zipfile.BadZipFile) as e:
+            database.db.session.rollback()
+            abort(400, f'Invalid export file: {e}')
+    return jsonify({"imported": imported})
 
 # --- Health Data API ---
 @app.route('/api/v1/health/summary', methods=['GET'])
@@ -140,7 +193,12 @@ def get_health_summary():
     if "error" in user_data:
         status_code, message = user_data["error"]
         abort(status_code, message)
-    return jsonify(database.get_health_summary(user_data["id"]))
+    user_id = user_data["id"]
+    # The summary also makes this user the one streamed HR is recorded for (and hands them
+    # the orphan rows); that is only a no-op, and the cached body usable, if they already are
+    return response_cache.respond(user_id, 'summary', (), response_cache.TABLES,
+                                  lambda: database.get_health_summary(user_id),
+                                  use_cache=database.now_user_id == user_id)
 
 @app.route('/api/v1/health/risk', methods=['GET'])
 def get_health_risk():
@@ -148,10 +206,60 @@ def get_health_risk():
     if "error" in user_data:
         status_code, message = user_data["error"]
         abort(status_code, message)
-    return jsonify(result_data.get_health_risk(
-        database.get_window_features(user_data["id"]),
-        database.get_model_user_info(user_data["id"]),
-    ))
+    cached = result_data.get_cached_health_risk(user_data["id"])
+    if cached is not None:
+        return jsonify(cached)
+    # Read the generation before the DB so a concurrent write keeps the new entry stale
+    seen_generation = risk_cache.generation(user_data["id"])
+    return jsonify(result_data.get_health_risk(user_data["id"], seen_generation))
+
+@app.route('/api/v1/health/risk/history', methods=['GET'])
+def get_health_risk_history():
+    user_data = login.check_auth(request)
+    if "error" in user_data:
+        status_code, message = user_data["error"]
+        abort(status_code, message)
+    days = min(max(request.args.get('days', 30, type=int), 1), 365)
+    return jsonify(database.get_risk_history(user_data["id"], days))
+
+# --- Admin ---
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+@app.route('/api/v1/admin/risk/recompute', methods=['POST'])
+def recompute_all_risk():
+    # Disabled unless ADMIN_TOKEN is configured; user API tokens are not accepted here
+    if not ADMIN_TOKEN or request.headers.get('Authorization') != f'Bearer {ADMIN_TOKEN}':
+        abort(403, 'Admin token required')
+    return jsonify(risk_batch.score_all_users(source='manual'))
+
+def _model_set_info(model_set):
+    if model_set is None:
+        return None
+    return {"version": model_set.version, "models": sorted(model_set.bundles), "loaded_at": model_set.loaded_at}
+
+@app.route('/api/v1/admin/models', methods=['GET', 'POST'])
+def model_registry_status():
+    # POST checks the export directory immediately instead of waiting for the next poll
+    if not ADMIN_TOKEN or request.headers.get('Authorization') != f'Bearer {ADMIN_TOKEN}':
+        abort(403, 'Admin token required')
+    reloaded = predict.REGISTRY.reload_if_changed(wait_for_stable=False) if request.method == 'POST' else False
+    return jsonify({
+        "active": _model_set_info(predict.REGISTRY.active),
+        "shadow": _model_set_info(predict.REGISTRY.shadow),
+        "reloaded": reloaded,
+    })
+
+# Charts return at most `width` points (the client's plot width in pixels);
+# `algo` picks the downsampling algorithm (lttb, minmax or m4)
+DEFAULT_CHART_WIDTH = 400
+MAX_CHART_WIDTH = 4000
+
+def chart_options(default_width: int = DEFAULT_CHART_WIDTH, default_algorithm: str = 'lttb') -> tuple[int, str]:
+    width = request.args.get('width', default_width, type=int)
+    algorithm = request.args.get('algo', default_algorithm)
+    if algorithm not in downsample.ALGORITHMS:
+        abort(400, f"Unknown algo '{algorithm}'")
+    return min(max(width, 3), MAX_CHART_WIDTH), algorithm
 
 @app.route('/api/v1/charts/bp', methods=['GET'])
 def get_chart_bp():
@@ -162,11 +270,9 @@ def get_chart_bp():
     period = request.args.get('period', '7d')
     
     # To prevent others play our API
-    if period == '7d':
-        data = database.get_chart_data(user_data["id"], 7, 'bp') #database
-    else: # 30d
-        data = database.get_chart_data(user_data["id"], 30, 'bp') #database
-    return jsonify(data)
+    days = 7 if period == '7d' else 30
+    return response_cache.respond(user_data["id"], 'chart-bp', (days,), ('health',),
+                                  lambda: database.get_chart_data(user_data["id"], days, 'bp')) #database
 
 @app.route('/api/v1/charts/hr', methods=['GET'])
 def get_chart_hr():
@@ -177,46 +283,117 @@ def get_chart_hr():
     interval = request.args.get('interval')
     period = request.args.get('period')
     
-    if period == '1h':
-        data = database.get_chart_data(user_data["id"], 60, 'hr') #database
-    elif period == '6h':
-        data = database.get_chart_data(user_data["id"], 360, 'hr', max_points=100) #database
-    elif period == '24h':
-        data = database.get_chart_data(user_data["id"], 1440, 'hr') #database
-    else: # 7d
-        data = database.get_chart_data(user_data["id"], 10080, 'hr', max_points=100) #database
-    return jsonify(data)
+    # period -> (range in minutes, default width); get_chart_data picks the rollup resolution
+    # (1h/6h: 1-minute buckets, 24h/7d: 30-minute buckets, 30d: daily buckets); `algo` applies to
+    # the 1-minute ranges, the longer ones are a fixed time axis merged down to `width` slots
+    periods = {'1h': (60, DEFAULT_CHART_WIDTH), '6h': (360, 100), '24h': (1440, DEFAULT_CHART_WIDTH),
+               '7d': (10080, 100), '30d': (43200, DEFAULT_CHART_WIDTH)}
+    points, default_width = periods.get(period, periods['7d'])
+    width, algorithm = chart_options(default_width)
+    return response_cache.respond(
+        user_data["id"], 'chart-hr', (points, width, algorithm), ('hr',),
+        lambda: database.get_chart_data(user_data["id"], points, 'hr', max_points=width, algorithm=algorithm)) #database
+
+@app.route('/api/v1/charts/risk', methods=['GET'])
+def get_chart_risk():
+    user_data = login.check_auth(request)
+    if "error" in user_data:
+        status_code, message = user_data["error"]
+        abort(status_code, message)
+    # period -> (range in seconds, bucket size in seconds); keeps every range at <= 360 points
+    periods = {'24h': (86400, 300), '7d': (604800, 1800), '30d': (2592000, 7200)}
+    span, step = periods.get(request.args.get('period'), periods['24h'])
+    width, algorithm = chart_options()
+    return jsonify(database.get_risk_timeline(user_data["id"], int(time.time()) - span, step, width, algorithm))
+
+@app.route('/api/v1/ecg/range', methods=['GET'])
+def get_ecg_range():
+    user_data = login.check_auth(request)
+    if "error" in user_data:
+        status_code, message = user_data["error"]
+        abort(status_code, message)
+    seconds = min(max(request.args.get('seconds', 60, type=int), 1), ecg_wifi.ECG_HISTORY_SECONDS)
+    width, algorithm = chart_options(default_algorithm='m4')
+    times, values, last_sample_id = ecg_wifi.get_ecg_range(seconds)
+    if not len(times):
+        return jsonify({"times": [], "values": []})
+
+    def compute():
+        keep = downsample.downsample(times, values, width, algorithm)
+        return {
+            "times": np.round(times[keep], 3).tolist(),
+            "values": np.round(values[keep].astype(np.float64), 4).tolist(),
+        }
+
+    # Raw samples have no resolution of their own; 0 marks the native sample rate
+    key = (user_data["id"], 'ecg', seconds, 0, last_sample_id, algorithm, width)
+    return jsonify(downsample.cached(key, compute))
+
+# --- Metrics ---
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Headers cloudflared (and other proxies) add; the tunnel connects from localhost, so the
+# peer address alone does not tell a local scraper from a request through the tunnel
+PROXY_HEADERS = ('Cf-Connecting-Ip', 'X-Forwarded-For', 'Forwarded')
+
+def is_local_request() -> bool:
+    return request.remote_addr in ('127.0.0.1', '::1') and not any(h in request.headers for h in PROXY_HEADERS)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # With METRICS_TOKEN set, scrapers need the bearer token; without it only direct local requests
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            abort(401, 'Invalid metrics token')
+    elif not is_local_request():
+        abort(403, 'Metrics are only served locally unless METRICS_TOKEN is set')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # --- Real-time ECG WebSocket ---
-active_websockets = []
-def send_ecg_data(ws: Server):
+active_websockets = set()
+_ws_frames_total = metrics.counter("ws_frames_sent_total", "ECG WebSocket frames sent")
+_ws_bytes_total = metrics.counter("ws_bytes_sent_total", "ECG WebSocket payload bytes sent")
+_ws_send_seconds = metrics.histogram("ws_send_seconds", "Time to send one ECG frame")
+_ws_send_cpu_seconds = metrics.histogram("ws_send_cpu_seconds", "CPU time to send one ECG frame",
+                                         buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01))
+_ws_latency_seconds = metrics.histogram("ws_frame_latency_seconds",
+                                        "From the oldest sample of a frame arriving to the frame being sent")
+_ws_connections = metrics.gauge("ws_active_connections", "Open ECG WebSocket connections")
+WS_IDLE_CHECK_SECONDS = 5  # how often an idle stream checks that its client is still connected
+
+def send_ecg_data(ws: Server, sub: ecg_broker.Subscription):
+    """Send this viewer's frames as soon as they are published (the broker serializes them once)."""
+    frames = 0
+    cpu_seconds = 0.0
     try:
-        while True:
-            chunk = ecg_wifi.get_points_chunk()
-            heart_rate = ecg_wifi.get_heart_rate()
-            current_mode = ecg_wifi.get_mode()
-            af_result = ecg_wifi.get_af_result()
-            ws.send(json.dumps({
-                "times": chunk["times"],
-                "points": chunk["values"],
-                "heart_rate": heart_rate,
-                "mode": current_mode,
-                "af": af_result,
-            }))
-            time.sleep(0.16)
+        while ws.connected:
+            for frame, sampled_at in sub.wait(WS_IDLE_CHECK_SECONDS):
+                start = time.perf_counter()
+                cpu_start = time.thread_time()
+                ws.send(frame)
+                cpu = time.thread_time() - cpu_start
+                _ws_send_seconds.observe(time.perf_counter() - start)
+                _ws_send_cpu_seconds.observe(cpu)
+                if sampled_at is not None:
+                    _ws_latency_seconds.observe(time.time() - sampled_at)
+                _ws_frames_total.inc()
+                _ws_bytes_total.inc(len(frame))
+                frames += 1
+                cpu_seconds += cpu
     except Exception as e:
         print(f"WebSocket send error or client disconnected: {e}")
     finally:
-        print("ECG stream thread stopped.")
+        print(f"ECG stream stopped after {frames} frames ({cpu_seconds * 1000:.1f} ms CPU).")
 
 def signal_handler(sig, frame):
     print("\n\n[CTRL+C] Shutting down server...")
     print(f"Closing {len(active_websockets)} active WebSocket connection(s)...")
-    for ws in active_websockets[:]:
+    for ws in list(active_websockets):
         try:
             ws.close()
         except Exception as e:
             print(f"Error closing WebSocket: {e}")
+    print("Flushing queued database writes...")
+    db_writer.stop()
     print("Server stopped.")
     sys.exit(0)
 
@@ -227,19 +404,24 @@ def ecg_stream(ws: Server):
         print(f"WebSocket connection rejected: Invalid token '{token}'")
         ws.close()
         return
-    print(f"WebSocket connection accepted for token: {token}")
+    # ?format=bin: compact binary frames (see ecg_frames.py); JSON otherwise
+    frame_format = request.args.get('format', 'json')
+    if frame_format not in ecg_frames.FORMATS:
+        print(f"WebSocket connection rejected: Unknown frame format '{frame_format}'")
+        ws.close(message=f"Unknown frame format '{frame_format}'")
+        return
+    print(f"WebSocket connection accepted for token: {token} ({frame_format} frames)")
     
-    active_websockets.append(ws)
-    thread = threading.Thread(target=send_ecg_data, args=(ws,))
-    thread.daemon = True
-    thread.start()
-
+    active_websockets.add(ws)
+    _ws_connections.inc()
+    sub = ecg_broker.broker.subscribe(frame_format)
     try:
-        thread.join()
-        print("ECG stream function exiting after thread join.")
-    except Exception as e:
-        print(f"Exception while waiting for send_ecg_data thread: {e}")
+        # Runs in this connection's green thread; it sleeps in sub.wait() until a frame is published
+        send_ecg_data(ws, sub)
     finally:
+        ecg_broker.broker.unsubscribe(sub)
+        active_websockets.discard(ws)
+        _ws_connections.dec()
         print("Client disconnected.")
 
 # --- Health Advice by Gemini ---
@@ -269,7 +451,12 @@ def post_health_advice():
 # --- Main ---
 if __name__ == '__main__':
     signal.signal(signal.SIGINT, signal_handler)
+    db_writer.start()
     threading.Thread(target=ecg_wifi.main, daemon=True).start()
+    threading.Thread(target=risk_batch.nightly_loop, args=(app,), daemon=True).start()
+    threading.Thread(target=risk_timeline.timeline_loop, args=(app,), daemon=True).start()
+    threading.Thread(target=retention.retention_loop, args=(app,), daemon=True).start()
+    predict.REGISTRY.start_watching()
     print("Starting server with eventlet on http://localhost:39244") # dec(39244) = oct(114514)
     try:
         eventlet.wsgi.server(eventlet.listen(('0.0.0.0', 39244)), app)
@@ -0,0 +1,118 @@
+"""Write-behind batching for streamed rows (minute HR records and window features).
+
+Producers (the ecg_wifi feature callbacks) only enqueue a row stamped with its
+own timestamp. One background thread drains the queue and writes everything
+collected within FLUSH_MS, or as soon as MAX_ROWS rows are waiting, with
+database.write_stream_batch in a single transaction.
+
+Durability bounds:
+- Process crash / kill -9: rows still queued are lost, i.e. at most FLUSH_MS of
+  stream data (or MAX_ROWS rows). stop() flushes the queue on a clean shutdown.
+- Power loss / OS crash: with WAL and synchronous=NORMAL, transactions committed
+  since the last WAL checkpoint may also be rolled back; the database file
+  itself stays consistent. Set SQLITE_SYNCHRONOUS=FULL to fsync every commit.
+- When the queue is full (the database is stalled), producers fall back to a
+  direct synchronous write instead of dropping rows.
+"""
+import queue
+import threading
+import time
+from datetime import datetime
+
+import database
+import metrics
+
+FLUSH_MS = 250
+MAX_ROWS = 256
+MAX_QUEUE = 10000
+
+_queue_depth = metrics.gauge("db_writer_queue_depth", "Rows waiting in the write-behind queue")
+_batch_rows = metrics.histogram("db_writer_batch_rows", "Rows per write-behind transaction",
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+_flush_seconds = metrics.histogram("db_writer_flush_seconds", "Write-behind transaction latency")
+_errors = metrics.counter("db_writer_errors_total", "Write-behind batches that failed")
+_sync_fallbacks = metrics.counter("db_writer_sync_fallbacks_total", "Rows written directly because the queue was full")
+
+
+class BatchWriter:
+    def __init__(self, app, flush_ms: int = FLUSH_MS, max_rows: int = MAX_ROWS, max_queue: int = MAX_QUEUE):
+        self.app = app
+        self.flush_s = flush_ms / 1000.0
+        self.max_rows = max_rows
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+
+    # ---------- producers ----------
+
+    def add_hr_record(self, user_id: int, heart_rate: float) -> None:
+        self._put(("hr", {"user_id": user_id, "heart_rate": heart_rate, "timestamp": datetime.now()}))
+
+    def add_window_feature(self, user_id: int, data: dict) -> None:
+        self._put(("window", database.window_feature_row(user_id, data)))
+
+    def _put(self, item: tuple) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            _sync_fallbacks.inc()
+            self._write([item])
+
+    # ---------- writer thread ----------
+
+    def start(self) -> "BatchWriter":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Flush everything queued so far and stop the writer thread."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _collect(self) -> list[tuple]:
+        try:
+            batch = [self._queue.get(timeout=self.flush_s)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_s
+        while len(batch) < self.max_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._collect()
+            _queue_depth.set(self._queue.qsize())
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch: list[tuple]) -> None:
+        hr_rows = [row for kind, row in batch if kind == "hr"]
+        window_rows = [row for kind, row in batch if kind == "window"]
+        start = time.perf_counter()
+        with self.app.app_context():
+            try:
+                database.write_stream_batch(hr_rows, window_rows)
+            except Exception as e:
+                _errors.inc()
+                database.db.session.rollback()
+                print(f"Error writing {len(batch)} streamed rows: {e}")
+                return
+        _flush_seconds.observe(time.perf_counter() - start)
+        _batch_rows.observe(len(batch))
+
+    def flush(self) -> None:
+        """Block until every row queued so far has been written."""
+        self._queue.join()
@@ -1,18 +1,41 @@
 import argparse
+import json
 import os
+import threading
+from contextlib import ExitStack, contextmanager
 import pandas as pd
 import numpy as np
-import lttbc
 
-from bisect import bisect_left
 from datetime import datetime, timedelta
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_
+from flask_sqlalchemy.session import Session
+from sqlalchemy import String, and_, delete, event, func, insert, inspect, select, text, type_coerce, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
+import downsample
+import metrics
+import pan_tompkins_plus_plus.collect_features as cf
+import response_cache
 import result_data
+import risk_cache
+import risk_timeline
+import shards
+import user_cache
 
-db = SQLAlchemy()
+
+class ShardedSession(Session):
+    """Sends statements on the time-series tables to the current user's shard (see shards.py)."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and shards.enabled():
+            user_id = shards.current_user()
+            if user_id is not None and shards.is_sharded(mapper, clause):
+                return shards.engine_for(user_id)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 now_user_id = -1
 
 # ==================== Database Models ====================
@@ -32,7 +55,11 @@ class User(db.Model):
     profile = db.relationship('UserProfile', backref='user', uselist=False, cascade='all, delete-orphan')
     health_records = db.relationship('HealthRecord', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     hr_records = db.relationship('HRRecord', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    hr_rollups = db.relationship('HRRollup', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     window_features = db.relationship('WindowFeature', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    window_aggregate = db.relationship('WindowAggregateState', backref='user', uselist=False, cascade='all, delete-orphan')
+    risk_history = db.relationship('RiskHistory', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    risk_timeline = db.relationship('RiskTimelinePoint', backref='user', lazy='dynamic', cascade='all, delete-orphan')
 
 
 class UserProfile(db.Model):
@@ -51,6 +78,7 @@ class UserProfile(db.Model):
 
 class HealthRecord(db.Model):
     __tablename__ = 'health_records'
+    __table_args__ = (db.Index('ix_health_records_user_ts', 'user_id', 'timestamp'),)
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -62,6 +90,7 @@ class HealthRecord(db.Model):
 
 class HRRecord(db.Model):
     __tablename__ = 'hr_records'
+    __table_args__ = (db.Index('ix_hr_records_user_ts', 'user_id', 'timestamp'),)
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -69,8 +98,23 @@ class HRRecord(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.now)
 
 
+class HRRollup(db.Model):
+    __tablename__ = 'hr_rollups'
+    # One row per user per bucket and resolution, clustered for (user_id, resolution, bucket) range reads
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    resolution = db.Column(db.Integer, primary_key=True)  # bucket width in seconds (HR_ROLLUP_RESOLUTIONS)
+    bucket = db.Column(db.Integer, primary_key=True)  # bucket start, unix seconds
+    min_hr = db.Column(db.Float, nullable=False)
+    max_hr = db.Column(db.Float, nullable=False)
+    sum_hr = db.Column(db.Float, nullable=False)  # avg = sum_hr / count, kept as a sum so buckets can be merged
+    count = db.Column(db.Integer, nullable=False)
+
+
 class WindowFeature(db.Model):
     __tablename__ = 'window_features'
+    __table_args__ = (db.Index('ix_window_features_user_ts', 'user_id', 'timestamp'),)
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -85,12 +129,117 @@ class WindowFeature(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.now)
 
 
+class WindowAggregateState(db.Model):
+    __tablename__ = 'window_aggregates'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    state = db.Column(db.Text, nullable=False)  # JSON of collect_features.WindowAggregate
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class RiskHistory(db.Model):
+    __tablename__ = 'risk_history'
+    __table_args__ = (db.Index('ix_risk_history_user_ts', 'user_id', 'timestamp'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    risk_score = db.Column(db.Float, nullable=False)  # 0-100
+    level = db.Column(db.String(50), nullable=False)
+    model_name = db.Column(db.String(50), nullable=False)
+    source = db.Column(db.String(20), nullable=False, default='batch')  # 'batch' or 'manual'
+    timestamp = db.Column(db.DateTime, default=datetime.now)
+
+
+class RiskTimelinePoint(db.Model):
+    __tablename__ = 'risk_timeline'
+    # One small row per user per scoring interval, clustered by (user_id, ts) for range reads
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    ts = db.Column(db.Integer, primary_key=True)  # interval start, unix seconds
+    score = db.Column(db.SmallInteger, nullable=False)  # risk probability in basis points (0-10000)
+
+
 # ==================== Database Initialization ====================
 
-def init_db(app):
+# Applied to every new SQLite connection. WAL lets request reads run while the stream writer
+# commits; synchronous=NORMAL only fsyncs at checkpoints, so a power cut (not a process crash)
+# can lose the last few commits. See batch_writer.py for the full durability bound.
+SQLITE_PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL",  # only takes effect on new files (see retention.py)
+    "PRAGMA journal_mode=WAL",
+    f"PRAGMA synchronous={os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16384",     # 16 MiB page cache per connection
+    "PRAGMA mmap_size=268435456",   # 256 MiB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def apply_sqlite_pragmas(engine, pragmas: tuple) -> None:
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def init_db(app, pragmas: tuple = SQLITE_PRAGMAS):
     db.init_app(app)
+    # Opt-in: per-user shard files for the time-series tables (see shards.py)
+    shards.configure(app.config.get('SQLITE_SHARD_DIR'), pragmas)
     with app.app_context():
+        apply_sqlite_pragmas(db.engine, pragmas)
         db.create_all()
+        ensure_hr_rollups()
+        # create_all only adds indexes together with new tables
+        missing = missing_indexes()
+        if missing:
+            print(f"[WARN] {len(missing)} database indexes missing ({', '.join(ix.name for ix in missing)}), "
+                  f"run: python database.py migrate")
+
+
+# ==================== Schema Migration ====================
+
+# Indexes replaced by a composite (user_id, timestamp) index on the same table
+OBSOLETE_INDEXES = {'ix_risk_history_user_id': 'risk_history'}
+
+
+def missing_indexes() -> list:
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        names = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        missing += [ix for ix in table.indexes if ix.name not in names]
+    return missing
+
+
+def migrate() -> list[str]:
+    """Bring an existing database file up to the current schema in place; safe to re-run."""
+    steps = []
+    db.create_all()
+    if ensure_hr_rollups():
+        steps.append("built hr_rollups from hr_records")
+    for index in missing_indexes():
+        start = datetime.now()
+        index.create(bind=db.engine)
+        steps.append(f"created index {index.name} ({(datetime.now() - start).total_seconds():.1f}s)")
+    inspector = inspect(db.engine)
+    for name, table in OBSOLETE_INDEXES.items():
+        if table in inspector.get_table_names() and name in {ix['name'] for ix in inspector.get_indexes(table)}:
+            db.session.execute(text(f'DROP INDEX {name}'))
+            steps.append(f"dropped index {name}")
+    # Refresh planner statistics so the new indexes are picked for the user_id/timestamp queries
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+    return steps
 
 
 # ==================== User Functions ====================
@@ -111,12 +260,14 @@ def create_user(google_id: str, email: str, name: str, api_token: str) -> User:
 def get_user_by_google_id(google_id: str) -> User:
     return User.query.filter_by(google_id=google_id).first()
 
+@metrics.timed("db_query_seconds", "Database call latency", op="get_user_by_token")
 def get_user_by_token(api_token: str) -> User:
     return User.query.filter_by(api_token=api_token).first()
 
 
 # ==================== Profile Functions ====================
 
+@metrics.timed("db_query_seconds", "Database call latency", op="update_userdata")
 def update_userdata(user_id: int, data: dict) -> dict:
     user = User.query.get(user_id)
     if not user:
@@ -143,26 +294,41 @@ def update_userdata(user_id: int, data: dict) -> dict:
     
     user.profile_completed = True
     db.session.commit()
+    risk_cache.invalidate(user_id)
+    user_cache.forget_user(user_id)
+    response_cache.touch(user_id, "profile")
     
     return {"message": "Profile updated successfully"}
 
 
 # ==================== Health Record Functions ====================
 
+def _core(stmt):
+    """Execute a column-projected select on the session's connection, skipping the ORM result layer."""
+    # The statement picks the connection, so time-series reads go to the user's shard
+    return db.session.connection(bind_arguments={'clause': stmt}).execute(stmt)
+
+
+def _iso_timestamp(column):
+    """ISO 8601 text for a DateTime column, formatted by SQLite instead of per row in Python.
+
+    SQLite stores DateTime as 'YYYY-MM-DD HH:MM:SS.ffffff'; unlike datetime.isoformat()
+    the microseconds are always present.
+    """
+    return func.replace(type_coerce(column, String), ' ', 'T').label(column.key)
+
+
+@metrics.timed("db_query_seconds", "Database call latency", op="add_health_record")
 def add_health_record(user_id: int, data: dict) -> dict:
     user = User.query.get(user_id)
     if not user:
         return {"error": "User not found"}
     
-    # Delete too old records OR records from today (keep only latest per day)
-    cutoff_time = datetime.now() - timedelta(days=30)
+    # Keep only the latest record per day (records older than 30 days are removed by retention.py)
     today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     HealthRecord.query.filter(
         HealthRecord.user_id == user_id,
-        or_(
-            HealthRecord.timestamp < cutoff_time,
-            HealthRecord.timestamp >= today_start  # Delete today's old records
-        )
+        HealthRecord.timestamp >= today_start
     ).delete()
     
     # Convert fasting_bs to boolean (True if > 120 mg/dl)
@@ -180,173 +346,497 @@ def add_health_record(user_id: int, data: dict) -> dict:
     )
     db.session.add(record)
     db.session.commit()
+    risk_cache.invalidate(user_id)
+    user_cache.forget_user(user_id)
+    response_cache.touch(user_id, "health")
     
     return {"message": "Health record added successfully"}
 
 
+@metrics.timed("db_query_seconds", "Database call latency", op="get_health_data")
 def get_health_data(user_id: int) -> dict:
-    user = User.query.get(user_id)
-    if not user:
+    if _core(select(User.id).where(User.id == user_id)).first() is None:
         return {"error": "User not found"}
     
-    records = user.health_records.order_by(HealthRecord.timestamp.desc()).all()
+    records = _core(
+        select(HealthRecord.resting_bp, HealthRecord.cholesterol, HealthRecord.fasting_bs,
+               _iso_timestamp(HealthRecord.timestamp))
+        .where(HealthRecord.user_id == user_id)
+        .order_by(HealthRecord.timestamp.desc())
+    ).all()
     health_data = [{
-        "resting_bp": r.resting_bp,
-        "cholesterol": r.cholesterol,
-        "fasting_bs": r.fasting_bs,
-        "timestamp": r.timestamp.isoformat()
-    } for r in records]
+        "resting_bp": resting_bp,
+        "cholesterol": cholesterol,
+        "fasting_bs": fasting_bs,
+        "timestamp": timestamp
+    } for resting_bp, cholesterol, fasting_bs, timestamp in records]
     return {"health_data": health_data}
 
 
-# ==================== Chart Data Functions ====================
+# ==================== HR Rollup Functions ====================
 
-def add_hr_record(user_id: int = now_user_id, heart_rate: float = 0.0) -> dict:
-    # Delete too old records
-    cutoff_time = datetime.now() - timedelta(days=7)
+# Bucket widths kept in hr_rollups: 1 minute, 30 minutes, 1 day
+HR_ROLLUP_RESOLUTIONS = (60, 1800, 86400)
 
-    if user_id == -1:
-        user_id = now_user_id
-    HRRecord.query.filter(
-        HRRecord.user_id == user_id,
-        HRRecord.timestamp < cutoff_time
-    ).delete()
 
-    record = HRRecord(
-        user_id=user_id,
-        heart_rate=heart_rate
+def hr_bucket(ts: datetime, resolution: int) -> int:
+    """Start (unix seconds) of the bucket holding local timestamp `ts`."""
+    if resolution >= 86400:
+        # Days start at local midnight so daily labels match the calendar
+        return int(datetime(ts.year, ts.month, ts.day).timestamp())
+    return int(ts.timestamp()) // resolution * resolution
+
+
+def _fold_hr_rows(rows) -> list[dict]:
+    """Aggregate {user_id, heart_rate, timestamp} rows into one rollup row per bucket."""
+    buckets = {}
+    for row in rows:
+        hr = row["heart_rate"]
+        for resolution in HR_ROLLUP_RESOLUTIONS:
+            key = (row["user_id"], resolution, hr_bucket(row["timestamp"], resolution))
+            acc = buckets.get(key)
+            if acc is None:
+                buckets[key] = [hr, hr, hr, 1]
+            else:
+                acc[0] = min(acc[0], hr)
+                acc[1] = max(acc[1], hr)
+                acc[2] += hr
+                acc[3] += 1
+    return [{"user_id": uid, "resolution": resolution, "bucket": bucket,
+             "min_hr": acc[0], "max_hr": acc[1], "sum_hr": acc[2], "count": acc[3]}
+            for (uid, resolution, bucket), acc in buckets.items()]
+
+
+def _merge_hr_rollups(rows: list[dict]) -> None:
+    """Add rollup rows into the stored buckets (caller commits)."""
+    if not rows:
+        return
+    rollups = HRRollup.__table__
+    stmt = sqlite_insert(rollups)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'resolution', 'bucket'],
+        set_={
+            'min_hr': func.min(rollups.c.min_hr, stmt.excluded.min_hr),
+            'max_hr': func.max(rollups.c.max_hr, stmt.excluded.max_hr),
+            'sum_hr': rollups.c.sum_hr + stmt.excluded.sum_hr,
+            'count': rollups.c.count + stmt.excluded.count,
+        },
+    ), rows)
+
+
+def rebuild_hr_rollups(chunk_rows: int = 50000) -> int:
+    """Recompute hr_rollups from hr_records; returns rollup rows written.
+
+    Buckets whose raw rows were already removed by retention are lost, so this is
+    only meant for building the table once (see ensure_hr_rollups).
+    """
+    db.session.query(HRRollup).delete()
+    result = db.session.execute(
+        select(HRRecord.user_id, HRRecord.heart_rate, HRRecord.timestamp).execution_options(yield_per=chunk_rows)
     )
-    db.session.add(record)
+    rows = _fold_hr_rows(r._mapping for r in result)
+    for i in range(0, len(rows), chunk_rows):
+        db.session.execute(insert(HRRollup), rows[i : i + chunk_rows])
     db.session.commit()
+    return len(rows)
+
+
+def ensure_hr_rollups() -> bool:
+    """Fold existing raw HR rows into hr_rollups the first time the table is used.
+
+    New rows are folded by write_stream_batch, so the rollups can only be empty while
+    hr_records is not on a database created before the rollups existed. Returns True
+    if the rollups were built.
+    """
+    if db.session.execute(select(HRRollup.user_id).limit(1)).first() is not None:
+        return False
+    if db.session.execute(select(HRRecord.id).limit(1)).first() is None:
+        return False
+    rebuild_hr_rollups()
+    return True
+
+
+@metrics.timed("db_query_seconds", "Database call latency", op="get_hr_rollups")
+def get_hr_rollups(user_id: int, resolution: int, since_bucket: int) -> list:
+    with shards.use(user_id):
+        return _core(
+            select(HRRollup.bucket, HRRollup.min_hr, HRRollup.max_hr, HRRollup.sum_hr, HRRollup.count)
+            .where(HRRollup.user_id == user_id, HRRollup.resolution == resolution, HRRollup.bucket >= since_bucket)
+            .order_by(HRRollup.bucket)
+        ).all()
+
+
+def _hr_bucket_axis(start: datetime, end: datetime, resolution: int) -> list[int]:
+    if resolution >= 86400:
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        days = (end.date() - day.date()).days
+        return [hr_bucket(day + timedelta(days=i), resolution) for i in range(days + 1)]
+    return list(range(hr_bucket(start, resolution), hr_bucket(end, resolution) + 1, resolution))
+
+
+# ==================== Chart Data Functions ====================
+
+@metrics.timed("db_query_seconds", "Database call latency", op="add_hr_record")
+def add_hr_record(user_id: int = now_user_id, heart_rate: float = 0.0) -> dict:
+    if user_id == -1:
+        user_id = now_user_id
+    write_stream_batch(hr_rows=[{"user_id": user_id, "heart_rate": heart_rate, "timestamp": datetime.now()}])
     return {"message": "HR record added successfully"}
 
 
 def update_hr_record() -> None:
-    records = HRRecord.query.filter_by(user_id=-1).all()
-    for record in records:
-        record.user_id = now_user_id
+    """Give HR records streamed before anyone logged in (user -1) to the current user."""
+    if now_user_id == -1:
+        return
+    if shards.enabled():
+        _move_orphan_hr_shard(now_user_id)
+        return
+    # Check first so the common case (nothing to move) stays a read and does not open a write transaction
+    if db.session.execute(select(HRRecord.id).where(HRRecord.user_id == -1).limit(1)).first() is None:
+        return
+    moved = db.session.execute(update(HRRecord).where(HRRecord.user_id == -1).values(user_id=now_user_id)).rowcount
+    if moved:
+        orphan_rows = db.session.execute(select(HRRollup).where(HRRollup.user_id == -1)).scalars().all()
+        _merge_hr_rollups([{"user_id": now_user_id, "resolution": r.resolution, "bucket": r.bucket,
+                            "min_hr": r.min_hr, "max_hr": r.max_hr, "sum_hr": r.sum_hr, "count": r.count}
+                           for r in orphan_rows])
+        db.session.execute(delete(HRRollup).where(HRRollup.user_id == -1))
     db.session.commit()
+    if moved:
+        downsample.forget(now_user_id)
+        response_cache.touch(now_user_id, "hr")
 
-def get_chart_data(user_id: int, points: int, data_type: str = 'hr', max_points: int = 0) -> dict:
-    user = User.query.get(user_id)
-    
+
+def _move_orphan_hr_shard(user_id: int) -> None:
+    """Shard mode of update_hr_record: re-write user -1's shard rows into user_id's shard.
+
+    The two files cannot share a transaction; the copy commits before the delete, so a
+    crash in between leaves the rows in both shards rather than in neither.
+    """
+    if not shards.exists(-1):
+        return
+    with shards.use(-1):
+        rows = _core(select(HRRecord.id, HRRecord.heart_rate, HRRecord.timestamp)
+                     .where(HRRecord.user_id == -1).order_by(HRRecord.id)).all()
+    if not rows:
+        return
+    write_stream_batch(hr_rows=[{"user_id": user_id, "heart_rate": hr, "timestamp": ts} for _, hr, ts in rows])
+    with shards.use(-1):
+        # Rows streamed since the read stay for the next call; the rollups are re-folded from raw rows
+        db.session.execute(delete(HRRecord).where(HRRecord.user_id == -1, HRRecord.id <= rows[-1].id))
+        db.session.execute(delete(HRRollup).where(HRRollup.user_id == -1))
+        db.session.commit()
+    downsample.forget(user_id)
+
+
+def _hr_chart(user_id: int, points: int, resolution: int, start: datetime, now: datetime,
+              max_points: int, algorithm: str) -> dict:
+    rows = get_hr_rollups(user_id, resolution, hr_bucket(start, resolution))
+    if not rows:
+        return {"labels": [], "values": []}
+
+    fmt = '%Y-%m-%d' if resolution >= 86400 else '%m-%d %H:%M' if points >= 1440 else '%H:%M'
+    if resolution >= 1800:
+        # Fixed axis: every bucket in the range, None where nothing was recorded. An axis wider
+        # than max_points merges runs of consecutive buckets (weighted by count, as a coarser
+        # rollup would), so sparse and dense ranges give the same slots and never exceed the width
+        totals = {r.bucket: (r.sum_hr, r.count) for r in rows}
+        axis = _hr_bucket_axis(start, now, resolution)
+        group = -(-len(axis) // max_points) if max_points > 0 else 1
+        labels, values = [], []
+        for i in range(0, len(axis), group):
+            slot = [totals[t] for t in axis[i:i + group] if t in totals]
+            count = sum(c for _, c in slot)
+            labels.append(datetime.fromtimestamp(axis[i]).strftime(fmt))
+            values.append(sum(s for s, _ in slot) / count if count else None)
+        return {"labels": labels, "values": values}
+
+    buckets = np.fromiter((r.bucket for r in rows), dtype=np.float64, count=len(rows))
+    averages = np.fromiter((r.sum_hr / r.count for r in rows), dtype=np.float64, count=len(rows))
+    if max_points > 0 and len(rows) > max_points:
+        keep = downsample.downsample(buckets, averages, max_points, algorithm)
+        buckets, averages = buckets[keep], averages[keep]
+    return {
+        "labels": [datetime.fromtimestamp(t).strftime(fmt) for t in buckets],
+        "values": averages.tolist(),
+    }
+
+
+@metrics.timed("db_query_seconds", "Database call latency", op="get_chart_data")
+def get_chart_data(user_id: int, points: int, data_type: str = 'hr', max_points: int = 0,
+                   algorithm: str = 'lttb') -> dict:
     if data_type == 'hr':
-        records = HRRecord.query.filter_by(user_id=user_id)\
-            .order_by(HRRecord.timestamp.desc())\
-            .limit(points * 6).all()
-        
-        if records:
-            earliest_time = (datetime.now() - timedelta(minutes=points)).timestamp()
-            while records and records[-1].timestamp.timestamp() < earliest_time:
-                records.pop()
-            records.reverse()
-
-            # Apply LTTBC downsampling if requested and data is large enough
-            if max_points > 0 and len(records) > max_points:
-                ts_arr = np.array([r.timestamp.timestamp() for r in records], dtype=np.float64)
-                val_arr = np.array([r.heart_rate for r in records], dtype=np.float64)
-                ds_x, ds_y = lttbc.downsample(ts_arr, val_arr, max_points)
-
-                fmt = '%m-%d %H:%M' if points >= 1440 else '%H:%M'
-                labels = [datetime.fromtimestamp(t).strftime(fmt) for t in ds_x]
-                values = ds_y.tolist()
-            elif points >= 1440:
-                labels = [datetime.now() - timedelta(minutes=i) for i in range(0, points, 30)][::-1]
-                new_values = [[] for _ in range(len(labels))]
-                for i in records:
-                    idx = bisect_left(labels, i.timestamp)
-                    new_values[idx].append(i.heart_rate)
-
-                for i in range(len(new_values)):
-                    labels[i] = labels[i].strftime('%m-%d %H:%M')
-                    if new_values[i]:
-                        new_values[i] = sum(new_values[i]) / len(new_values[i])
-                    else:
-                        new_values[i] = None
-                values = new_values
-            else:
-                labels = [r.timestamp.strftime('%H:%M') for r in records]
-                values = [r.heart_rate for r in records]
-        else:
+        # Read pre-aggregated buckets: 1-minute for up to 6h, 30-minute for up to 7d, daily beyond
+        resolution = 60 if points <= 360 else 1800 if points <= 10080 else 86400
+        now = datetime.now()
+        start = now - timedelta(minutes=points)
+        with shards.use(user_id):
+            last_record_id = _core(
+                select(HRRecord.id).where(HRRecord.user_id == user_id)
+                .order_by(HRRecord.timestamp.desc(), HRRecord.id.desc()).limit(1)
+            ).scalar()
+        if last_record_id is None:
             return {"labels": [], "values": []}
+        # The range start bucket is part of the key so the axis moves on even without new records
+        key = (user_id, 'hr', points, resolution, last_record_id, hr_bucket(start, resolution), algorithm, max_points)
+        return downsample.cached(key, lambda: _hr_chart(user_id, points, resolution, start, now, max_points, algorithm))
     else:  # bp
-        records = HealthRecord.query.filter_by(user_id=user_id)\
-            .order_by(HealthRecord.timestamp.desc())\
-            .limit(points).all()
-        
-        if records:
-            earliest_time = (datetime.now() - timedelta(days=points)).timestamp()
-            while records and records[-1].timestamp.timestamp() < earliest_time:
-                records.pop()
-            records.reverse()
-
-            labels = [r.timestamp.strftime('%Y-%m-%d') for r in records]
-            values = [r.resting_bp for r in records]
-            for t in [(datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(points)][::-1]:
-                if t not in labels:
-                    idx = bisect_left(labels, t)
-                    labels.insert(idx, t)
-                    values.insert(idx, None)
-        else:
+        # One label per day for the last `points` days, None where no record was taken
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        days = [today - timedelta(days=i) for i in range(points)][::-1]
+        day = func.strftime('%Y-%m-%d', HealthRecord.timestamp)
+        records = _core(
+            select(day, HealthRecord.resting_bp)
+            .where(HealthRecord.user_id == user_id, HealthRecord.timestamp >= days[0])
+            .order_by(HealthRecord.timestamp.desc()).limit(points)
+        ).all()
+        if not records:
             return {"labels": [], "values": []}
+        by_day = dict(reversed(records))
+        labels = [d.strftime('%Y-%m-%d') for d in days]
+        values = [by_day.get(label) for label in labels]
     return {"labels": labels, "values": values}
 
 
 # ==================== Window Feature Functions ====================
 
+# Serialize the read-modify-write of a user's aggregate row between stream callbacks. One lock
+# per user, so writers of different users (different shards in shard mode) do not wait on each other.
+_aggregate_locks: dict[int, threading.Lock] = {}
+_aggregate_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _aggregate_lock(*user_ids: int):
+    with _aggregate_locks_guard:
+        # Always taken in user id order, so two multi-user writers cannot deadlock
+        locks = [_aggregate_locks.setdefault(uid, threading.Lock()) for uid in sorted(set(user_ids))]
+    with ExitStack() as stack:
+        for lock in locks:
+            stack.enter_context(lock)
+        yield
+
+
+def _rebuild_window_aggregate(user_id: int) -> cf.WindowAggregate:
+    agg = cf.WindowAggregate()
+    for r in get_window_features_since(user_id):
+        agg.add(r.file, r.max_hr, r.oldpeak, r.resting_ecg, r.st_label)
+    return agg
+
+
+def _load_window_aggregate(user_id: int) -> tuple[WindowAggregateState | None, cf.WindowAggregate]:
+    row = db.session.get(WindowAggregateState, user_id)
+    if row is not None:
+        return row, cf.WindowAggregate.from_dict(json.loads(row.state))
+    # First use after upgrading: fold the stored windows once
+    return None, _rebuild_window_aggregate(user_id)
+
+
+def _save_window_aggregate(user_id: int, row: WindowAggregateState | None, agg: cf.WindowAggregate) -> None:
+    if row is None:
+        row = WindowAggregateState(user_id=user_id)
+        db.session.add(row)
+    row.state = json.dumps(agg.to_dict())
+
+
+@metrics.timed("db_query_seconds", "Database call latency", op="add_window_feature")
 def add_window_feature(user_id: int, data: dict) -> dict:
     if user_id == -1:
         user_id = now_user_id
-    
-    # Keep only the latest 8192 records, delete older ones
-    current_count = WindowFeature.query.filter_by(user_id=user_id).count()
-    if current_count >= 8192:
-        records_to_delete = current_count - 8192 + 1
-        old_records = WindowFeature.query.filter_by(user_id=user_id)\
-            .order_by(WindowFeature.timestamp.asc())\
-            .limit(records_to_delete).all()
-        for record in old_records:
-            db.session.delete(record)
-    
-    feature = WindowFeature(
-        user_id=user_id,
-        file=data.get('file', ''),
-        fs_hz=data.get('fs_hz', 0.0),
-        max_hr=data.get('max_hr', 0.0),
-        avg_hr=data.get('avg_hr', 0.0),
-        st_label=data.get('st_label'),
-        oldpeak=data.get('oldpeak', 0.0),
-        resting_ecg=data.get('resting_ecg', ''),
-        calc_time=data.get('calc_time', 0.0)
-    )
-    db.session.add(feature)
-    db.session.commit()
+    write_stream_batch(window_rows=[window_feature_row(user_id, data)])
     return {"message": "Window feature added successfully"}
 
 
-def get_window_features(user_id: int = now_user_id) -> pd.DataFrame:
-    records = WindowFeature.query.filter_by(user_id=user_id)\
-        .order_by(WindowFeature.timestamp.desc()).all()
-    
-    return pd.DataFrame([{
-        'file': r.file,
-        'fs_hz': r.fs_hz,
-        'max_hr': r.max_hr,
-        'avg_hr': r.avg_hr,
-        'st_label': r.st_label,
-        'oldpeak': r.oldpeak,
-        'resting_ecg': r.resting_ecg,
-        'calc_time': r.calc_time,
-        'timestamp': r.timestamp.isoformat()
-    } for r in records])
+def window_feature_row(user_id: int, data: dict, timestamp: datetime | None = None) -> dict:
+    return {
+        "user_id": user_id,
+        "file": data.get('file', ''),
+        "fs_hz": data.get('fs_hz', 0.0),
+        "max_hr": data.get('max_hr', 0.0),
+        "avg_hr": data.get('avg_hr', 0.0),
+        "st_label": data.get('st_label'),
+        "oldpeak": data.get('oldpeak', 0.0),
+        "resting_ecg": data.get('resting_ecg', ''),
+        "calc_time": data.get('calc_time', 0.0),
+        "timestamp": timestamp or datetime.now(),
+    }
 
 
-def get_model_user_info(user_id: int) -> dict:
-    profile = UserProfile.query.filter_by(user_id=user_id).first()
-    latest_health = HealthRecord.query.filter_by(user_id=user_id)\
-        .order_by(HealthRecord.timestamp.desc()).first()
+def _delete_oldest_windows(user_id: int, agg: cf.WindowAggregate, n: int) -> int:
+    """Delete a user's n oldest windows in one statement and take them out of the aggregate."""
+    old_rows = db.session.execute(
+        select(
+            WindowFeature.id,
+            WindowFeature.file,
+            WindowFeature.max_hr,
+            WindowFeature.oldpeak,
+            WindowFeature.resting_ecg,
+            WindowFeature.st_label,
+        ).where(WindowFeature.user_id == user_id)
+        .order_by(WindowFeature.timestamp.asc(), WindowFeature.id.asc())
+        .limit(n)
+    ).all()
+    if not old_rows:
+        return 0
+    db.session.execute(delete(WindowFeature).where(WindowFeature.id.in_([r.id for r in old_rows])))
+    stale_max = set()
+    for r in old_rows:
+        prefix = agg.remove(r.file, r.max_hr, r.oldpeak, r.resting_ecg, r.st_label)
+        if prefix is not None:
+            stale_max.add(prefix)
+    # Max is the one statistic that cannot be un-applied; only re-read it when the max left
+    for prefix in stale_max:
+        agg.set_max_hr(prefix, db.session.scalar(
+            select(func.max(WindowFeature.max_hr)).where(
+                WindowFeature.user_id == user_id,
+                func.substr(WindowFeature.file, 1, len(prefix)) == prefix,
+            )
+        ))
+    return len(old_rows)
+
+
+def prune_window_features(user_id: int, keep: int, limit: int) -> int:
+    """Delete up to `limit` of the user's windows beyond the newest `keep`; returns rows deleted."""
+    with _aggregate_lock(user_id), shards.use(user_id):
+        count = db.session.scalar(select(func.count()).where(WindowFeature.user_id == user_id))
+        if count <= keep:
+            return 0
+        row_state, agg = _load_window_aggregate(user_id)
+        deleted = _delete_oldest_windows(user_id, agg, min(count - keep, limit))
+        _save_window_aggregate(user_id, row_state, agg)
+        db.session.commit()
+    risk_cache.invalidate(user_id)
+    response_cache.touch(user_id, "windows")
+    return deleted
+
+
+@metrics.timed("db_query_seconds", "Database call latency", op="write_stream_batch")
+def write_stream_batch(hr_rows: list[dict] = (), window_rows: list[dict] = ()) -> None:
+    """Append streamed HR records and window features in one transaction.
+
+    Rows carry their own timestamps (taken when they were produced, not when they are
+    written). HR rows are also folded into hr_rollups. Nothing is deleted here; old
+    rows are removed by retention.py. In shard mode there is one transaction per user.
+    """
+    if not shards.enabled():
+        _write_stream_rows(hr_rows, window_rows)
+        return
+    by_user = {}
+    for row in hr_rows:
+        by_user.setdefault(row["user_id"], ([], []))[0].append(row)
+    for row in window_rows:
+        by_user.setdefault(row["user_id"], ([], []))[1].append(row)
+    for uid, (user_hr_rows, user_window_rows) in by_user.items():
+        with shards.use(uid):
+            _write_stream_rows(user_hr_rows, user_window_rows)
+
+
+def _write_stream_rows(hr_rows: list[dict], window_rows: list[dict]) -> None:
+    if hr_rows:
+        # Table-level inserts are plain executemany, without the ORM bulk-insert bookkeeping
+        db.session.execute(insert(HRRecord.__table__), list(hr_rows))
+        # Rollups are updated in the same transaction, so every raw row is counted exactly once
+        _merge_hr_rollups(_fold_hr_rows(hr_rows))
+
+    window_users = []
+    if window_rows:
+        by_user = {}
+        for row in window_rows:
+            by_user.setdefault(row["user_id"], []).append(row)
+        window_users = list(by_user)
+        with _aggregate_lock(*window_users):
+            for uid, rows in by_user.items():
+                row_state, agg = _load_window_aggregate(uid)
+                for row in rows:
+                    agg.add(row["file"], row["max_hr"], row["oldpeak"], row["resting_ecg"], row["st_label"])
+                db.session.execute(insert(WindowFeature.__table__), rows)
+                _save_window_aggregate(uid, row_state, agg)
+            db.session.commit()
+    else:
+        db.session.commit()
+
+    for uid in {row["user_id"] for row in hr_rows}:
+        response_cache.touch(uid, "hr")
+    for uid in window_users:
+        risk_cache.invalidate(uid)
+        risk_timeline.on_window(uid)
+        response_cache.touch(uid, "windows")
+
+
+@metrics.timed("db_query_seconds", "Database call latency", op="get_window_aggregate")
+def get_window_aggregate(user_id: int) -> cf.WindowAggregate:
+    return get_window_aggregates([user_id])[user_id]
+
+
+def get_window_aggregates(user_ids: list[int]) -> dict[int, cf.WindowAggregate]:
+    if shards.enabled():
+        aggregates = {}
+        for uid in user_ids:
+            with shards.use(uid):
+                aggregates.update(_get_window_aggregates([uid]))
+        return aggregates
+    return _get_window_aggregates(user_ids)
+
+
+def _get_window_aggregates(user_ids: list[int]) -> dict[int, cf.WindowAggregate]:
+    rows = db.session.execute(
+        select(WindowAggregateState.user_id, WindowAggregateState.state)
+        .where(WindowAggregateState.user_id.in_(user_ids))
+    ).all()
+    aggregates = {r.user_id: cf.WindowAggregate.from_dict(json.loads(r.state)) for r in rows}
+    missing = [uid for uid in user_ids if uid not in aggregates]
+    if missing:
+        with _aggregate_lock(*missing):
+            for uid in missing:
+                row, agg = _load_window_aggregate(uid)
+                _save_window_aggregate(uid, row, agg)
+                aggregates[uid] = agg
+            db.session.commit()
+    return aggregates
+
+
+def rebuild_window_aggregates() -> int:
+    """Recompute every stored aggregate from the window_features table in one ordered scan.
+
+    Works on the main database, or on one shard inside shards.use() (see shards.rebuild_all).
+    """
+    rows = db.session.execute(
+        select(
+            WindowFeature.user_id,
+            WindowFeature.file,
+            WindowFeature.max_hr,
+            WindowFeature.oldpeak,
+            WindowFeature.resting_ecg,
+            WindowFeature.st_label,
+        ).order_by(WindowFeature.user_id, WindowFeature.timestamp.asc(), WindowFeature.id.asc())
+    ).all()
+    aggregates = {}
+    for r in rows:
+        aggregates.setdefault(r.user_id, cf.WindowAggregate()).add(r.file, r.max_hr, r.oldpeak, r.resting_ecg, r.st_label)
+    with _aggregate_lock(*aggregates):
+        db.session.query(WindowAggregateState).delete()
+        if aggregates:
+            db.session.execute(insert(WindowAggregateState), [
+                {"user_id": uid, "state": json.dumps(agg.to_dict())} for uid, agg in aggregates.items()
+            ])
+        db.session.commit()
+    return len(aggregates)
+
+
+@metrics.timed("db_query_seconds", "Database call latency", op="get_window_features")
+def get_window_features(user_id: int = now_user_id) -> pd.DataFrame:
+    columns = ['file', 'fs_hz', 'max_hr', 'avg_hr', 'st_label', 'oldpeak', 'resting_ecg', 'calc_time']
+    with shards.use(user_id):
+        records = _core(
+            select(*[getattr(WindowFeature, c) for c in columns], _iso_timestamp(WindowFeature.timestamp))
+            .where(WindowFeature.user_id == user_id)
+            .order_by(WindowFeature.timestamp.desc())
+        ).all()
+    return pd.DataFrame.from_records(records, columns=columns + ['timestamp'])
+
 
-    user_info = {
+def _model_user_info(profile, latest_health) -> dict:
+    return {
         "Age": profile.age if profile else 0,
         "Sex": profile.sex if profile else "M",
         "ChestPainType": profile.chest_pain_type if profile else "ASY",
@@ -356,33 +846,168 @@ def get_model_user_info(user_id: int) -> dict:
         "Cholesterol": latest_health.cholesterol if latest_health else None,
         "FastingBS": int(latest_health.fasting_bs) if latest_health is not None else None,
     }
-    return user_info
+
+
+@metrics.timed("db_query_seconds", "Database call latency", op="get_model_user_info")
+def get_model_user_info(user_id: int) -> dict:
+    info = user_cache.profiles.get(user_id)
+    if info is None:
+        profile = _core(
+            select(
+                UserProfile.age,
+                UserProfile.sex,
+                UserProfile.chest_pain_type,
+                UserProfile.exercise_angina,
+                UserProfile.resting_ecg,
+            ).where(UserProfile.user_id == user_id).limit(1)
+        ).first()
+        latest_health = _core(
+            select(HealthRecord.resting_bp, HealthRecord.cholesterol, HealthRecord.fasting_bs)
+            .where(HealthRecord.user_id == user_id)
+            .order_by(HealthRecord.timestamp.desc()).limit(1)
+        ).first()
+        info = _model_user_info(profile, latest_health)
+        user_cache.profiles.put(user_id, info)
+    return dict(info)
+
+
+# ==================== Bulk Functions (batch risk scoring) ====================
+
+def get_all_user_ids() -> list[int]:
+    return [row[0] for row in db.session.execute(select(User.id).order_by(User.id)).all()]
+
+
+@metrics.timed("db_query_seconds", "Database call latency", op="get_model_user_infos")
+def get_model_user_infos(user_ids: list[int]) -> dict[int, dict]:
+    profiles = {
+        row.user_id: row
+        for row in db.session.execute(
+            select(
+                UserProfile.user_id,
+                UserProfile.age,
+                UserProfile.sex,
+                UserProfile.chest_pain_type,
+                UserProfile.exercise_angina,
+                UserProfile.resting_ecg,
+            ).where(UserProfile.user_id.in_(user_ids))
+        ).all()
+    }
+
+    latest_ts = select(
+        HealthRecord.user_id,
+        func.max(HealthRecord.timestamp).label('timestamp'),
+    ).where(HealthRecord.user_id.in_(user_ids)).group_by(HealthRecord.user_id).subquery()
+    latest_health = {
+        row.user_id: row
+        for row in db.session.execute(
+            select(
+                HealthRecord.user_id,
+                HealthRecord.resting_bp,
+                HealthRecord.cholesterol,
+                HealthRecord.fasting_bs,
+            ).join(latest_ts, and_(
+                HealthRecord.user_id == latest_ts.c.user_id,
+                HealthRecord.timestamp == latest_ts.c.timestamp,
+            ))
+        ).all()
+    }
+    return {uid: _model_user_info(profiles.get(uid), latest_health.get(uid)) for uid in user_ids}
+
+
+# ==================== Risk History Functions ====================
+
+def add_risk_history(rows: list[dict]) -> None:
+    if not rows:
+        return
+    db.session.execute(insert(RiskHistory), rows)
+    db.session.commit()
+
+
+def get_risk_history(user_id: int, days: int = 30) -> dict:
+    since = datetime.now() - timedelta(days=days)
+    rows = db.session.execute(
+        select(RiskHistory.timestamp, RiskHistory.risk_score, RiskHistory.level, RiskHistory.model_name)
+        .where(RiskHistory.user_id == user_id, RiskHistory.timestamp >= since)
+        .order_by(RiskHistory.timestamp.asc())
+    ).all()
+    return {"history": [{
+        "timestamp": r.timestamp.isoformat(),
+        "risk_score": r.risk_score,
+        "level": r.level,
+        "model_name": r.model_name,
+    } for r in rows]}
+
+
+# ==================== Risk Timeline Functions ====================
+
+def get_window_features_since(user_id: int, since: datetime | None = None) -> list:
+    """Window rows oldest first, with the columns the timeline aggregates need."""
+    query = select(
+        WindowFeature.file,
+        WindowFeature.max_hr,
+        WindowFeature.oldpeak,
+        WindowFeature.resting_ecg,
+        WindowFeature.st_label,
+        WindowFeature.timestamp,
+        WindowFeature.id,
+    ).where(WindowFeature.user_id == user_id)
+    if since is not None:
+        query = query.where(WindowFeature.timestamp >= since)
+    with shards.use(user_id):
+        return db.session.execute(query.order_by(WindowFeature.timestamp.asc(), WindowFeature.id.asc())).all()
+
+
+def add_risk_points(rows: list[dict]) -> None:
+    """Upsert {user_id, ts, score} rows; rescoring an interval overwrites its point."""
+    if not rows:
+        return
+    stmt = sqlite_insert(RiskTimelinePoint)
+    db.session.execute(
+        stmt.on_conflict_do_update(index_elements=['user_id', 'ts'], set_={'score': stmt.excluded.score}),
+        rows,
+    )
+    db.session.commit()
+
+
+@metrics.timed("db_query_seconds", "Database call latency", op="get_risk_timeline")
+def get_risk_timeline(user_id: int, since_ts: int, step: int, max_points: int = 0, algorithm: str = 'lttb') -> dict:
+    # Average into `step`-second buckets in SQL so long ranges stay a few hundred points
+    bucket = (RiskTimelinePoint.ts // step) * step
+    rows = db.session.execute(
+        select(bucket.label('bucket'), func.avg(RiskTimelinePoint.score).label('score'))
+        .where(RiskTimelinePoint.user_id == user_id, RiskTimelinePoint.ts >= since_ts)
+        .group_by('bucket').order_by('bucket')
+    ).all()
+    if max_points > 0 and len(rows) > max_points:
+        keep = downsample.downsample([r.bucket for r in rows], [r.score for r in rows], max_points, algorithm)
+        rows = [rows[i] for i in keep]
+    fmt = '%m-%d %H:%M' if step >= 1800 else '%H:%M'
+    return {
+        "labels": [datetime.fromtimestamp(r.bucket).strftime(fmt) for r in rows],
+        "values": [round(r.score / 100, 2) for r in rows],
+    }
 
 
 # ==================== Health Summary Functions ====================
 
+@metrics.timed("db_query_seconds", "Database call latency", op="get_health_summary")
 def get_health_summary(user_id: int) -> dict:
-    user = User.query.get(user_id)
-    
     # Get latest health record
-    latest_health = HealthRecord.query.filter_by(user_id=user_id)\
-        .order_by(HealthRecord.timestamp.desc()).first()
+    resting_bp = _core(
+        select(HealthRecord.resting_bp).where(HealthRecord.user_id == user_id)
+        .order_by(HealthRecord.timestamp.desc()).limit(1)
+    ).scalar() or 0
     
-    # Get latest HR records for avg/max calculation
-    hr_records = HRRecord.query.filter_by(user_id=user_id)\
-        .order_by(HRRecord.timestamp.desc()).limit(100).all()
-    
-    if hr_records:
-        avg_hr = sum(r.heart_rate for r in hr_records) // len(hr_records)
-    else:
-        avg_hr = 0
-    
-    resting_bp = latest_health.resting_bp if latest_health else 0
+    # Average of the latest 100 HR records, summed in SQL
+    latest_hr = select(HRRecord.heart_rate).where(HRRecord.user_id == user_id)\
+        .order_by(HRRecord.timestamp.desc()).limit(100).subquery()
+    with shards.use(user_id):
+        hr_sum, hr_count = _core(select(func.sum(latest_hr.c.heart_rate), func.count())).one()
+    avg_hr = hr_sum // hr_count if hr_count else 0
     
     global now_user_id
     now_user_id = user_id
-    user_info = get_model_user_info(user_id)
-    user_other_info = result_data.parse_user_info(user_info, get_window_features())
+    user_other_info = result_data.get_model_input(user_id)
 
     update_hr_record()
     
@@ -404,20 +1029,49 @@ def clear_database():
     db.session.query(UserProfile).delete()
     db.session.query(HealthRecord).delete()
     db.session.query(HRRecord).delete()
+    db.session.query(HRRollup).delete()
+    db.session.query(RiskHistory).delete()
+    db.session.query(RiskTimelinePoint).delete()
+    db.session.query(WindowAggregateState).delete()
     db.session.query(User).delete()
     db.session.commit()
+    shards.drop_all()
+    risk_cache.clear()
+    risk_timeline.clear()
+    user_cache.clear()
+    response_cache.touch_all()
+
+def _in_every_database(fn) -> None:
+    """Run fn() on the main database and then inside every user shard."""
+    fn()
+    for uid in shards.user_ids():
+        with shards.use(uid):
+            fn()
 
 def clear_hr_records():
-    db.session.query(HRRecord).delete()
-    db.session.commit()
+    def clear():
+        db.session.query(HRRecord).delete()
+        db.session.query(HRRollup).delete()
+        db.session.commit()
+    _in_every_database(clear)
+    response_cache.touch_all()
 
 def clear_health_records():
     db.session.query(HealthRecord).delete()
     db.session.commit()
+    risk_cache.clear()
+    user_cache.profiles.clear()
+    response_cache.touch_all()
 
 def clear_window_features():
-    WindowFeature.query.delete()
-    db.session.commit()
+    def clear():
+        WindowFeature.query.delete()
+        WindowAggregateState.query.delete()
+        db.session.commit()
+    _in_every_database(clear)
+    risk_cache.clear()
+    risk_timeline.clear()
+    response_cache.touch_all()
 
 def show_all_tables():
     print("\n" + "="*80)
@@ -485,6 +1139,9 @@ def show_all_tables():
             print(f"{record.id:<5} {record.user_id:<3} {record.max_hr:<8.1f} {record.avg_hr:<8.1f} {record.st_label or 'N/A':<10} {record.oldpeak:<8.1f} {record.resting_ecg:<10} {record.timestamp.strftime('%Y-%m-%d %H:%M:%S'):<19}")
     else:
         print("(No window features found)")
+    if shards.enabled():
+        print(f"\n(HR records and window features of {len(shards.user_ids())} users are in their shards, "
+              f"see: python shards.py list)")
     
     print("\n" + "="*80)
 
@@ -493,6 +1150,12 @@ def delete_user_by_id(user_id: int):
     if user:
         db.session.delete(user)
         db.session.commit()
+        shards.drop(user_id)
+        risk_cache.remove(user_id)
+        risk_timeline.forget(user_id)
+        downsample.forget(user_id)
+        user_cache.forget_user(user_id)
+        response_cache.touch_user(user_id)
         return {"message": f"User {user_id} and related data deleted successfully"}
     else:
         return {"error": "User not found"}
@@ -505,6 +1168,7 @@ if __name__ == '__main__':
     
     app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(data_dir, "data.db")}'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLITE_SHARD_DIR'] = os.environ.get('SQLITE_SHARD_DIR')
     
     parser = argparse.ArgumentParser(description='Database operations')
     parser.add_argument('command', choices=['show_all_tables',
@@ -512,7 +1176,10 @@ if __name__ == '__main__':
                                             'delete_user',
                                             'clear_hr_records',
                                             'clear_health_records',
-                                            'clear_window_features'], 
+                                            'clear_window_features',
+                                            'rebuild_aggregates',
+                                            'rebuild_hr_rollups',
+                                            'migrate'], 
                        help='Database command to execute')
     parser.add_argument('--user_id', type=int, help='User ID to delete (required for delete_user command)')
     
@@ -543,3 +1210,10 @@ if __name__ == '__main__':
             clear_window_features()
             print("Window features cleared successfully!")
             print("Health records cleared successfully!")
+        elif args.command == 'rebuild_aggregates':
+            print(f"Rebuilt window aggregates for {rebuild_window_aggregates()} users")
+        elif args.command == 'rebuild_hr_rollups':
+            print(f"Rebuilt {rebuild_hr_rollups()} HR rollup rows")
+        elif args.command == 'migrate':
+            steps = migrate()
+            print("\n".join(steps) if steps else "Schema already up to date")
@@ -0,0 +1,393 @@
+"""Storage benchmarks on a throwaway SQLite file.
+
+    python db_bench.py indexes --rows 1000000   # query latency before/after `database.py migrate`
+    python db_bench.py writer --rows 5000       # streamed-row insert throughput per storage profile
+    python db_bench.py reads --rows 1000000     # dashboard reads: ORM objects vs projected Core selects
+    python db_bench.py shards --rows 2000       # concurrent devices: one data.db vs per-user shards
+    python db_bench.py charts                   # check: every HR chart period fits its width
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from flask import Flask
+from sqlalchemy import func, insert, select, text
+
+import result_data
+import user_cache
+
+import batch_writer
+import database
+import downsample
+import shards
+
+SEED_CHUNK = 50000
+
+
+def _make_app(path: str, pragmas: tuple = database.SQLITE_PRAGMAS, shard_dir: str | None = None) -> Flask:
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLITE_SHARD_DIR'] = shard_dir
+    database.init_db(app, pragmas)
+    return app
+
+
+def _insert_chunked(model, rows) -> None:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= SEED_CHUNK:
+            database.db.session.execute(insert(model), chunk)
+            chunk = []
+    if chunk:
+        database.db.session.execute(insert(model), chunk)
+    database.db.session.commit()
+
+
+def seed(n_users: int, rows_per_table: int, seed_value: int = 0) -> None:
+    """n_users users with rows_per_table rows in each time-series table, interleaved by time."""
+    rng = random.Random(seed_value)
+    now = datetime.now()
+    per_user = rows_per_table // n_users
+    session = database.db.session
+    session.execute(insert(database.User), [
+        {"id": uid, "google_id": f"g{uid}", "email": f"u{uid}@example.com", "name": f"user {uid}",
+         "api_token": f"token-{uid}", "profile_completed": True} for uid in range(1, n_users + 1)
+    ])
+    session.execute(insert(database.UserProfile), [
+        {"user_id": uid, "sex": rng.choice("MF"), "age": rng.randint(20, 85), "chest_pain_type": "ASY",
+         "exercise_angina": False, "resting_ecg": False} for uid in range(1, n_users + 1)
+    ])
+    session.commit()
+
+    # Rows arrive round-robin across users, like several devices streaming at once
+    def timeline(step_s: float):
+        for i in range(per_user):
+            ts = now - timedelta(seconds=step_s * (per_user - i))
+            for uid in range(1, n_users + 1):
+                yield uid, ts
+
+    _insert_chunked(database.HRRecord, (
+        {"user_id": uid, "heart_rate": rng.uniform(50, 180), "timestamp": ts} for uid, ts in timeline(60)
+    ))
+    database.rebuild_hr_rollups()
+    _insert_chunked(database.WindowFeature, (
+        {"user_id": uid, "file": "rest_ecg_data_", "fs_hz": 160.0, "max_hr": rng.uniform(60, 190),
+         "avg_hr": 80.0, "st_label": "Up", "oldpeak": rng.uniform(-0.5, 2.5), "resting_ecg": "Normal",
+         "calc_time": 0.01, "timestamp": ts} for uid, ts in timeline(10)
+    ))
+    _insert_chunked(database.HealthRecord, (
+        {"user_id": uid, "resting_bp": rng.randint(100, 170), "cholesterol": rng.randint(150, 320),
+         "fasting_bs": False, "timestamp": ts} for uid, ts in timeline(3600)
+    ))
+
+
+def _time_ms(fn, repeat: int) -> float:
+    fn()  # warm the page cache and per-user state
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return round(statistics.median(samples), 3)
+
+
+def _index_queries(user_id: int) -> dict:
+    WindowFeature = database.WindowFeature
+    return {
+        "get_chart_data hr 24h": lambda: database.get_chart_data(user_id, 1440, 'hr'),
+        "get_chart_data bp 30d": lambda: database.get_chart_data(user_id, 30, 'bp'),
+        "get_window_features": lambda: database.get_window_features(user_id),
+        "window eviction (oldest rows)": lambda: WindowFeature.query.filter_by(user_id=user_id)
+            .order_by(WindowFeature.timestamp.asc(), WindowFeature.id.asc()).limit(1).all(),
+        "get_model_user_info": lambda: database.get_model_user_info(user_id),
+        "get_health_summary": lambda: database.get_health_summary(user_id),
+    }
+
+
+def bench_indexes(rows: int, n_users: int = 1000, repeat: int = 20) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = _make_app(os.path.join(tmp_dir, 'bench.db'))
+        with app.app_context():
+            # Start from the pre-migration schema: primary keys only
+            for table in database.db.metadata.sorted_tables:
+                for index in table.indexes:
+                    database.db.session.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+            database.db.session.commit()
+
+            start = time.perf_counter()
+            seed(n_users, rows)
+            seed_s = time.perf_counter() - start
+
+            user_id = n_users // 2
+            before = {name: _time_ms(fn, repeat) for name, fn in _index_queries(user_id).items()}
+            start = time.perf_counter()
+            steps = database.migrate()
+            migrate_s = time.perf_counter() - start
+            after = {name: _time_ms(fn, repeat) for name, fn in _index_queries(user_id).items()}
+    return {
+        "rows_per_table": rows,
+        "users": n_users,
+        "seed_s": round(seed_s, 1),
+        "migrate_s": round(migrate_s, 1),
+        "migrate_steps": steps,
+        "median_ms": {name: {"before": before[name], "after": after[name]} for name in before},
+    }
+
+
+def _stream_rows(n_rows: int) -> list[tuple]:
+    # One HR record per six windows, as ecg_wifi produces per minute of 10 s windows
+    rng = random.Random(0)
+    rows = []
+    for i in range(n_rows):
+        rows.append(("window", {"file": "rest_ecg_data_", "fs_hz": 160.0, "max_hr": rng.uniform(60, 190),
+                                "avg_hr": 80.0, "st_label": "Up", "oldpeak": rng.uniform(-0.5, 2.5),
+                                "resting_ecg": "Normal", "calc_time": 0.01}))
+        if i % 6 == 5:
+            rows.append(("hr", rng.uniform(50, 180)))
+    return rows
+
+
+def bench_writer(n_rows: int) -> dict:
+    rows = _stream_rows(n_rows)
+    results = {}
+    for profile, pragmas in (("default journal", ()), ("wal profile", database.SQLITE_PRAGMAS)):
+        for mode in ("commit per row", "batch writer"):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                app = _make_app(os.path.join(tmp_dir, 'bench.db'), pragmas)
+                with app.app_context():
+                    seed(1, 1)
+                    seeded = database.WindowFeature.query.count() + database.HRRecord.query.count()
+                start = time.perf_counter()
+                if mode == "batch writer":
+                    writer = batch_writer.BatchWriter(app).start()
+                    for kind, data in rows:
+                        if kind == "hr":
+                            writer.add_hr_record(1, data)
+                        else:
+                            writer.add_window_feature(1, data)
+                    writer.flush()
+                    writer.stop()
+                else:
+                    with app.app_context():
+                        for kind, data in rows:
+                            if kind == "hr":
+                                database.add_hr_record(1, data)
+                            else:
+                                database.add_window_feature(1, data)
+                elapsed = time.perf_counter() - start
+                with app.app_context():
+                    written = database.WindowFeature.query.count() + database.HRRecord.query.count() - seeded
+                    database.db.engine.dispose()
+            results[f"{profile}, {mode}"] = {"rows": written, "rows_per_s": round(written / elapsed, 1)}
+    return results
+
+
+def bench_shards(n_rows: int, devices: list[int], synchronous: str = 'NORMAL') -> dict:
+    """Streamed-row throughput with several devices (one user each) committing every row concurrently."""
+    rows = _stream_rows(n_rows)
+    pragmas = tuple(f"PRAGMA synchronous={synchronous}" if p.startswith("PRAGMA synchronous") else p
+                    for p in database.SQLITE_PRAGMAS)
+    results = {}
+    for mode in ("single data.db", "per-user shards"):
+        for n_devices in devices:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                shard_dir = os.path.join(tmp_dir, 'shards') if mode == "per-user shards" else None
+                app = _make_app(os.path.join(tmp_dir, 'bench.db'), pragmas, shard_dir)
+                with app.app_context():
+                    seed(n_devices, 0)
+                ready = threading.Barrier(n_devices + 1)
+
+                def device(uid: int) -> None:
+                    with app.app_context():
+                        ready.wait()
+                        for kind, data in rows:
+                            if kind == "hr":
+                                database.add_hr_record(uid, data)
+                            else:
+                                database.add_window_feature(uid, data)
+
+                threads = [threading.Thread(target=device, args=(uid,)) for uid in range(1, n_devices + 1)]
+                for t in threads:
+                    t.start()
+                ready.wait()
+                start = time.perf_counter()
+                for t in threads:
+                    t.join()
+                elapsed = time.perf_counter() - start
+                with app.app_context():
+                    written = 0
+                    for uid in range(1, n_devices + 1):
+                        with shards.use(uid):
+                            written += database.db.session.scalar(
+                                select(func.count()).select_from(database.WindowFeature)
+                                .where(database.WindowFeature.user_id == uid))
+                    database.db.session.commit()
+                    database.db.engine.dispose()
+                    shards.dispose_all()
+            results[f"{mode}, {n_devices} devices"] = {"windows": written, "rows_per_s": round(len(rows) * n_devices / elapsed, 1)}
+    return results
+
+
+# ORM read path (full objects, Python-side filtering) kept as the baseline for bench_reads
+
+def _orm_health_data(user_id: int) -> dict:
+    user = database.User.query.get(user_id)
+    records = user.health_records.order_by(database.HealthRecord.timestamp.desc()).all()
+    return {"health_data": [{"resting_bp": r.resting_bp, "cholesterol": r.cholesterol, "fasting_bs": r.fasting_bs,
+                             "timestamp": r.timestamp.isoformat()} for r in records]}
+
+
+def _orm_chart_bp(user_id: int, points: int) -> dict:
+    HealthRecord = database.HealthRecord
+    records = HealthRecord.query.filter_by(user_id=user_id).order_by(HealthRecord.timestamp.desc()).limit(points).all()
+    earliest_time = (datetime.now() - timedelta(days=points)).timestamp()
+    while records and records[-1].timestamp.timestamp() < earliest_time:
+        records.pop()
+    records.reverse()
+    labels = [r.timestamp.strftime('%Y-%m-%d') for r in records]
+    values = [r.resting_bp for r in records]
+    for t in [(datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(points)][::-1]:
+        if t not in labels:
+            idx = bisect_left(labels, t)
+            labels.insert(idx, t)
+            values.insert(idx, None)
+    return {"labels": labels, "values": values}
+
+
+def _orm_chart_hr_24h(user_id: int, points: int = 1440) -> dict:
+    HRRecord = database.HRRecord
+    records = HRRecord.query.filter_by(user_id=user_id).order_by(HRRecord.timestamp.desc()).limit(points * 6).all()
+    earliest_time = (datetime.now() - timedelta(minutes=points)).timestamp()
+    while records and records[-1].timestamp.timestamp() < earliest_time:
+        records.pop()
+    records.reverse()
+    labels = [datetime.now() - timedelta(minutes=i) for i in range(0, points, 30)][::-1]
+    new_values = [[] for _ in range(len(labels))]
+    for r in records:
+        new_values[min(bisect_left(labels, r.timestamp), len(labels) - 1)].append(r.heart_rate)
+    return {"labels": [t.strftime('%m-%d %H:%M') for t in labels],
+            "values": [sum(v) / len(v) if v else None for v in new_values]}
+
+
+def _orm_window_features(user_id: int) -> pd.DataFrame:
+    WindowFeature = database.WindowFeature
+    records = WindowFeature.query.filter_by(user_id=user_id).order_by(WindowFeature.timestamp.desc()).all()
+    return pd.DataFrame([{"file": r.file, "fs_hz": r.fs_hz, "max_hr": r.max_hr, "avg_hr": r.avg_hr,
+                          "st_label": r.st_label, "oldpeak": r.oldpeak, "resting_ecg": r.resting_ecg,
+                          "calc_time": r.calc_time, "timestamp": r.timestamp.isoformat()} for r in records])
+
+
+def _orm_model_user_info(user_id: int) -> dict:
+    profile = database.UserProfile.query.filter_by(user_id=user_id).first()
+    latest_health = database.HealthRecord.query.filter_by(user_id=user_id)\
+        .order_by(database.HealthRecord.timestamp.desc()).first()
+    return database._model_user_info(profile, latest_health)
+
+
+def _orm_health_summary(user_id: int) -> dict:
+    database.User.query.get(user_id)
+    latest_health = database.HealthRecord.query.filter_by(user_id=user_id)\
+        .order_by(database.HealthRecord.timestamp.desc()).first()
+    hr_records = database.HRRecord.query.filter_by(user_id=user_id)\
+        .order_by(database.HRRecord.timestamp.desc()).limit(100).all()
+    avg_hr = sum(r.heart_rate for r in hr_records) // len(hr_records) if hr_records else 0
+    info = result_data.get_model_input(user_id, _orm_model_user_info(user_id))
+    for record in database.HRRecord.query.filter_by(user_id=-1).all():
+        record.user_id = user_id
+    database.db.session.commit()
+    return {"resting_bp": latest_health.resting_bp if latest_health else 0, "avg_hr": avg_hr, "max_hr": info["MaxHR"]}
+
+
+def _uncached(fn):
+    # Time the query path itself, not the user/downsample caches in front of it
+    def call():
+        user_cache.clear()
+        downsample.clear()
+        return fn()
+    return call
+
+
+def _read_queries(user_id: int) -> dict:
+    """name -> (ORM baseline, current implementation)"""
+    return {
+        "get_health_data": (lambda: _orm_health_data(user_id), lambda: database.get_health_data(user_id)),
+        "get_chart_data bp 30d": (lambda: _orm_chart_bp(user_id, 30), lambda: database.get_chart_data(user_id, 30, 'bp')),
+        "get_chart_data hr 24h": (lambda: _orm_chart_hr_24h(user_id), lambda: database.get_chart_data(user_id, 1440, 'hr')),
+        "get_window_features": (lambda: _orm_window_features(user_id), lambda: database.get_window_features(user_id)),
+        "get_model_user_info": (lambda: _orm_model_user_info(user_id), lambda: database.get_model_user_info(user_id)),
+        "get_health_summary": (lambda: _orm_health_summary(user_id), lambda: database.get_health_summary(user_id)),
+    }
+
+
+def bench_reads(rows: int, n_users: int = 100, repeat: int = 20) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = _make_app(os.path.join(tmp_dir, 'bench.db'))
+        with app.app_context():
+            seed(n_users, rows)
+            database.rebuild_window_aggregates()
+            user_id = n_users // 2
+            result = {}
+            for name, (before, after) in _read_queries(user_id).items():
+                result[name] = {"before": _time_ms(_uncached(before), repeat), "after": _time_ms(_uncached(after), repeat)}
+            database.db.engine.dispose()
+    return result
+
+
+def check_chart_widths(widths: tuple = (3, 50, 100, 400)) -> list[str]:
+    """Every HR period at every width must return at most `width` labels; returns the violations."""
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(os.path.join(tmp, 'charts.db'))
+        with app.app_context():
+            seed(1, 50000)  # one row a minute for about 35 days
+            for period, minutes in (('1h', 60), ('6h', 360), ('24h', 1440), ('7d', 10080), ('30d', 43200)):
+                for width in widths:
+                    for algorithm in downsample.ALGORITHMS:
+                        n = len(database.get_chart_data(1, minutes, 'hr', max_points=width, algorithm=algorithm)["labels"])
+                        if n > width:
+                            failures.append(f"hr {period} width={width} algo={algorithm}: {n} labels")
+            database.db.engine.dispose()
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Storage benchmarks')
+    parser.add_argument('command', choices=['indexes', 'writer', 'reads', 'shards', 'charts'])
+    parser.add_argument('--rows', type=int, default=None,
+                        help='Rows per table (indexes, reads) or streamed windows (writer, shards: per device)')
+    parser.add_argument('--devices', default='1,2,4,8', help='Concurrent device counts to compare (shards)')
+    parser.add_argument('--synchronous', default='NORMAL', help='SQLite synchronous mode (shards)')
+    parser.add_argument('--users', type=int, default=None, help='Users the seeded rows are spread over (default 1000, reads: 100)')
+    args = parser.parse_args()
+
+    if args.command == 'indexes':
+        result = bench_indexes(args.rows or 1000000, args.users or 1000)
+        for name, timing in result.pop("median_ms").items():
+            print(f"{name:<32} {timing['before']:>10.3f} ms -> {timing['after']:>8.3f} ms")
+        print(result)
+    elif args.command == 'writer':
+        for name, result in bench_writer(args.rows or 5000).items():
+            print(f"{name:<34} {result['rows']:>7} rows {result['rows_per_s']:>10.1f} rows/s")
+    elif args.command == 'reads':
+        for name, timing in bench_reads(args.rows or 1000000, args.users or 100).items():
+            speedup = timing['before'] / timing['after'] if timing['after'] else float('inf')
+            print(f"{name:<26} {timing['before']:>10.3f} ms -> {timing['after']:>8.3f} ms  ({speedup:.1f}x)")
+    elif args.command == 'shards':
+        devices = [int(d) for d in args.devices.split(',')]
+        for name, result in bench_shards(args.rows or 2000, devices, args.synchronous).items():
+            print(f"{name:<30} {result['windows']:>7} windows {result['rows_per_s']:>10.1f} rows/s")
+    elif args.command == 'charts':
+        failures = check_chart_widths()
+        print("\n".join(failures) or "All HR chart responses fit their width")
+        sys.exit(1 if failures else 0)
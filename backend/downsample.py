@@ -0,0 +1,144 @@
+"""Chart downsampling on NumPy arrays: LTTB, min-max envelope and M4.
+
+Every algorithm takes sorted x (timestamps) with matching y and returns the indices
+of the points to keep in ascending order, so callers can pick labels or other columns
+with the same index. At most `n` points are kept.
+
+- lttb:   Largest-Triangle-Three-Buckets, keeps the visual shape of smooth series
+- minmax: min and max of each of n/2 equal time spans (an envelope, keeps spikes)
+- m4:     first, last, min and max of each of n/4 equal time spans (pixel-exact lines)
+
+Results are cached with cached(), keyed by what identifies the source data
+(user, series, range, resolution, last record id) plus the algorithm and width.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+CACHE_SIZE = 512  # downsampled responses kept in memory
+
+_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+
+_hit = metrics.counter("downsample_cache_requests_total", "Downsample cache lookups", {"result": "hit"})
+_miss = metrics.counter("downsample_cache_requests_total", "Downsample cache lookups", {"result": "miss"})
+
+
+# ==================== Algorithms ====================
+
+def lttb(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    length = len(x)
+    if n >= length:
+        return np.arange(length)
+    if n < 3:
+        return np.array([0, length - 1][:max(n, 0)], dtype=np.int64)
+    # n - 2 equal-count buckets between the fixed first and last points
+    edges = np.linspace(1, length - 1, n - 1).astype(np.int64)
+    counts = np.diff(np.append(edges, length))
+    avg_x = np.add.reduceat(x, edges) / counts
+    avg_y = np.add.reduceat(y, edges) / counts
+    avg_x[-1], avg_y[-1] = x[-1], y[-1]  # the bucket after the last one is the last point
+
+    indices = np.empty(n, dtype=np.int64)
+    indices[0], indices[-1] = 0, length - 1
+    a = 0
+    # Each pick depends on the previous one, so only the per-bucket work is vectorized
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        bx, by = x[start:end], y[start:end]
+        area = np.abs((x[a] - avg_x[i + 1]) * (by - y[a]) - (x[a] - bx) * (avg_y[i + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def _time_buckets(x: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Start index of every non-empty bucket when [x[0], x[-1]] is cut into equal time spans."""
+    edges = np.linspace(x[0], x[-1], n_buckets + 1)[:-1]
+    return np.unique(np.searchsorted(x, edges, side='left'))
+
+
+def _extremes(y: np.ndarray, starts: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Last index, argmin and argmax of y in every bucket."""
+    ends = np.append(starts[1:], len(y)) - 1
+    sizes = ends - starts + 1
+    bucket = np.repeat(np.arange(len(starts)), sizes)
+
+    def first_match(reduced: np.ndarray) -> np.ndarray:
+        # First index in each bucket whose value equals the bucket's reduced value
+        hits = np.flatnonzero(y == np.repeat(reduced, sizes))
+        return hits[np.unique(bucket[hits], return_index=True)[1]]
+
+    return ends, first_match(np.minimum.reduceat(y, starts)), first_match(np.maximum.reduceat(y, starts))
+
+
+def minmax(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    if n >= len(x):
+        return np.arange(len(x))
+    if n < 2:
+        return lttb(x, y, n)  # one span would still keep two points
+    starts = _time_buckets(x, n // 2)
+    _, lo, hi = _extremes(y, starts)
+    return np.unique(np.concatenate([lo, hi]))
+
+
+def m4(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    if n >= len(x):
+        return np.arange(len(x))
+    if n < 4:
+        return minmax(x, y, n)  # one span would still keep up to four points
+    starts = _time_buckets(x, n // 4)
+    ends, lo, hi = _extremes(y, starts)
+    return np.unique(np.concatenate([starts, ends, lo, hi]))
+
+
+ALGORITHMS = {"lttb": lttb, "minmax": minmax, "m4": m4}
+
+_seconds = {name: metrics.histogram("downsample_seconds", "Time to downsample one series", {"algorithm": name})
+            for name in ALGORITHMS}
+
+
+def downsample(x, y, n: int, algorithm: str = "lttb") -> np.ndarray:
+    """Indices of at most n points of (x, y) chosen by `algorithm`."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown downsampling algorithm '{algorithm}' (expected one of {', '.join(ALGORITHMS)})")
+    start = time.perf_counter()
+    indices = ALGORITHMS[algorithm](np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), n)
+    _seconds[algorithm].observe(time.perf_counter() - start)
+    return indices
+
+
+# ==================== Result Cache ====================
+
+def cached(key: tuple, compute):
+    """Return the cached value for key, computing and storing it on a miss.
+
+    key[0] must be the user id so forget() can drop a user's entries.
+    """
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _hit.inc()
+            return _cache[key]
+    _miss.inc()
+    value = compute()
+    with _cache_lock:
+        _cache[key] = value
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
+
+
+def forget(user_id: int) -> None:
+    with _cache_lock:
+        for key in [k for k in _cache if k[0] == user_id]:
+            del _cache[key]
+
+
+def clear() -> None:
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,174 @@
+"""Publish/subscribe fan-out of live ECG frames to WebSocket viewers.
+
+ecg_wifi publishes every centered chunk once; publish() serializes it once per
+wire format in use (ecg_frames.FORMATS) and appends that same frame to each
+subscriber's queue, so extra viewers cost a queue append each, not another
+encode or another read of the sample buffer. Formats that only carry the status
+when it changed (bin) get it again after a viewer joins or loses frames. Every subscriber has its own bounded queue: when a viewer falls
+MAX_QUEUE_FRAMES behind, its oldest frames are dropped (live ECG is only worth
+showing while it is recent) and counted in ws_frames_dropped_total.
+
+Delivery is event-driven: publish() wakes every waiting subscriber, so a frame
+leaves as soon as ingest closes it (at most ecg_wifi.FRAME_SECONDS after its first
+sample) and nothing is sent while nothing is published.
+
+    python ecg_broker.py bench --viewers 1,10,100   # latency and CPU: event wake-up vs 160 ms polling
+"""
+import argparse
+import statistics
+import threading
+import time
+from collections import deque
+
+import ecg_frames
+import metrics
+
+MAX_QUEUE_FRAMES = 32  # about 3 s of frames at the default 10 frames/s
+
+_published = metrics.counter("ws_frames_published_total", "ECG frames serialized for WebSocket viewers")
+_dropped = metrics.counter("ws_frames_dropped_total", "ECG frames dropped for viewers that fell behind")
+_subscribers = metrics.gauge("ws_subscribers", "ECG broker subscribers")
+
+
+class Subscription:
+    def __init__(self, max_frames: int = MAX_QUEUE_FRAMES, fmt: str = "json"):
+        self.format = fmt
+        self._frames = deque()  # (frame, epoch time of its oldest sample or None, carries status)
+        self._max_frames = max_frames
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.dropped = 0
+        self.needs_status = True  # the next frame must carry the status
+
+    def put(self, frame, sampled_at: float | None = None, has_status: bool = True) -> None:
+        with self._lock:
+            if len(self._frames) >= self._max_frames:
+                _, _, dropped_status = self._frames.popleft()
+                self.dropped += 1
+                _dropped.inc()
+                if dropped_status:
+                    self.needs_status = True
+            self._frames.append((frame, sampled_at, has_status))
+            self._ready.set()
+
+    def drain(self) -> list[tuple]:
+        """All queued (frame, sampled_at) pairs, oldest first."""
+        with self._lock:
+            frames = [(frame, sampled_at) for frame, sampled_at, _ in self._frames]
+            self._frames.clear()
+            self._ready.clear()
+        return frames
+
+    def wait(self, timeout: float | None = None) -> list[tuple]:
+        """Block until something is published (or timeout), then drain."""
+        self._ready.wait(timeout)
+        return self.drain()
+
+
+class Broker:
+    def __init__(self, max_frames: int = MAX_QUEUE_FRAMES):
+        self.max_frames = max_frames
+        self._subscriptions: set[Subscription] = set()
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._status = None  # status fields of the last published message
+
+    def subscribe(self, fmt: str = "json") -> Subscription:
+        if fmt not in ecg_frames.FORMATS:
+            raise ValueError(f"Unknown ECG frame format '{fmt}' (expected one of {', '.join(ecg_frames.FORMATS)})")
+        sub = Subscription(self.max_frames, fmt)
+        with self._lock:
+            self._subscriptions.add(sub)
+            _subscribers.set(len(self._subscriptions))
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(sub)
+            _subscribers.set(len(self._subscriptions))
+
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def publish(self, message: dict, sampled_at: float | None = None) -> None:
+        """Send message to every subscriber; sampled_at is when its oldest sample arrived."""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            self._seq += 1
+            seq = self._seq
+            status = ecg_frames.status_of(message)
+            status_changed = status != self._status
+            self._status = status
+        if not subscriptions:
+            return
+        # At most two encodings per format: the shared frame, and one with the status for
+        # viewers that have not seen the current status yet
+        frames = {}
+        for sub in subscriptions:
+            encode, status_on_change = ecg_frames.FORMATS[sub.format]
+            with_status = not status_on_change or status_changed or sub.needs_status
+            key = (sub.format, with_status)
+            if key not in frames:
+                frames[key] = encode(message, seq, with_status)
+                _published.inc()
+            sub.needs_status = False
+            sub.put(frames[key], sampled_at, with_status)
+
+
+broker = Broker()
+
+
+# ==================== Benchmark ====================
+
+def benchmark(viewers: int, mode: str, seconds: float = 3.0, frame_seconds: float = 0.1,
+              poll_seconds: float = 0.16) -> dict:
+    """Publish 160 Hz ECG frames to `viewers` subscriber threads that wait for them ('event')
+    or wake every poll_seconds ('poll'); reports sample-to-consumer latency and CPU per viewer."""
+    bench_broker = Broker()
+    latencies = []
+    stop = threading.Event()
+
+    def viewer(sub: Subscription) -> None:
+        while not stop.is_set():
+            if mode == "event":
+                frames = sub.wait(0.5)
+            else:
+                time.sleep(poll_seconds)
+                frames = sub.drain()
+            now = time.time()
+            latencies.extend(now - sampled_at for _, sampled_at in frames)
+
+    threads = [threading.Thread(target=viewer, args=(bench_broker.subscribe(),)) for _ in range(viewers)]
+    for t in threads:
+        t.start()
+    samples_per_frame = max(int(160 * frame_seconds), 1)
+    cpu_start = time.process_time()
+    end = time.time() + seconds
+    while time.time() < end:
+        first = time.time()
+        time.sleep(frame_seconds)
+        bench_broker.publish({"times": [first] * samples_per_frame, "points": [0.0] * samples_per_frame}, first)
+    stop.set()
+    for t in threads:
+        t.join()
+    cpu = time.process_time() - cpu_start
+    latencies.sort()
+    return {
+        "frames": len(latencies),
+        # latency after the frame closed (the frame span itself is the same in both modes)
+        "latency_ms_median": round((statistics.median(latencies) - frame_seconds) * 1000, 2),
+        "latency_ms_p95": round((latencies[int(len(latencies) * 0.95)] - frame_seconds) * 1000, 2),
+        "cpu_ms_per_viewer_s": round(cpu / seconds / viewers * 1000, 3),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ECG WebSocket broker')
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--viewers', default='1,10,100', help='Subscriber counts to compare')
+    parser.add_argument('--seconds', type=float, default=3.0, help='Duration of each run')
+    args = parser.parse_args()
+
+    for n in [int(v) for v in args.viewers.split(',')]:
+        for mode in ("poll", "event"):
+            print(f"{n:>4} viewers {mode:<6} {benchmark(n, mode, args.seconds)}")
@@ -0,0 +1,166 @@
+"""Wire formats of the live ECG WebSocket frames.
+
+json (default): one JSON object per frame with float lists "times" and "points" and
+    the status fields "heart_rate", "mode" and "af" in every frame.
+
+bin (/ws/ecg/stream?format=bin): one binary message per frame, little-endian:
+
+    offset  type     field
+    0       uint8    version (1)
+    1       uint8    flags: 1 = samples are float32, 2 = status follows the samples
+    2       uint16   sample count n
+    4       uint32   sequence number (per published frame, wraps)
+    8       float64  base time: time of the first sample (same clock as the JSON "times")
+    16      float32  sample period in seconds, times[i] = base + i * period
+    20      int32    first sample in SAMPLE_SCALE units (unused for float32 samples)
+    24      ...      n - 1 int16 deltas between consecutive samples in SAMPLE_SCALE units,
+                     or n float32 samples if a delta does not fit in an int16
+    ...     uint16   if flags & 2: length of the status JSON that follows (UTF-8)
+
+Samples are rounded to SAMPLE_SCALE (0.1 mV, below the ESP32 ADC step) and the
+per-sample times to a uniform grid; status is only included when it changed (and
+in the first frame a viewer gets). frontend/js/ecg.js has the matching decoder.
+Browsers negotiate permessage-deflate, which simple_websocket accepts, so both
+formats are also deflated on the wire.
+
+    python ecg_frames.py bench    # bytes/s and encode time of json vs bin
+"""
+import argparse
+import json
+import struct
+import time
+import zlib
+
+VERSION = 1
+FLAG_FLOAT32 = 1
+FLAG_STATUS = 2
+SAMPLE_SCALE = 1e-4  # volts per int16 step
+HEADER = struct.Struct('<BBHIdfi')
+
+STATUS_FIELDS = ("heart_rate", "mode", "af")
+
+
+def status_of(message: dict) -> dict:
+    return {k: message[k] for k in STATUS_FIELDS if k in message}
+
+
+def encode_json(message: dict, seq: int, with_status: bool) -> str:
+    # Always carries the status, as it always has
+    return json.dumps(message)
+
+
+def encode_binary(message: dict, seq: int, with_status: bool) -> bytes:
+    times, points = message["times"], message["points"]
+    n = len(points)
+    flags = 0
+    first = 0
+    body = b''
+    if n:
+        quantized = [round(v / SAMPLE_SCALE) for v in points]
+        deltas = [b - a for a, b in zip(quantized, quantized[1:])]
+        if -2**31 <= quantized[0] < 2**31 and all(-32768 <= d <= 32767 for d in deltas):
+            first = quantized[0]
+            body = struct.pack(f'<{n - 1}h', *deltas)
+        else:
+            # A jump of more than 3.2 V between samples (or a huge offset): send the floats
+            flags |= FLAG_FLOAT32
+            body = struct.pack(f'<{n}f', *points)
+    if with_status:
+        flags |= FLAG_STATUS
+        status = json.dumps(status_of(message)).encode()
+        body += struct.pack('<H', len(status)) + status
+    base = times[0] if n else 0.0
+    period = (times[-1] - times[0]) / (n - 1) if n > 1 else 0.0
+    return HEADER.pack(VERSION, flags, n, seq & 0xFFFFFFFF, base, period, first) + body
+
+
+def decode_binary(frame: bytes) -> dict:
+    """Inverse of encode_binary (the Python twin of ecg.js decodeEcgFrame)."""
+    version, flags, n, seq, base, period, first = HEADER.unpack_from(frame)
+    if version != VERSION:
+        raise ValueError(f"Unsupported ECG frame version {version}")
+    offset = HEADER.size
+    if flags & FLAG_FLOAT32:
+        points = list(struct.unpack_from(f'<{n}f', frame, offset))
+        offset += 4 * n
+    elif n:
+        q = first
+        points = [q * SAMPLE_SCALE]
+        for delta in struct.unpack_from(f'<{n - 1}h', frame, offset):
+            q += delta
+            points.append(q * SAMPLE_SCALE)
+        offset += 2 * (n - 1)
+    else:
+        points = []
+    message = {"seq": seq, "times": [base + i * period for i in range(n)], "points": points}
+    if flags & FLAG_STATUS:
+        (length,) = struct.unpack_from('<H', frame, offset)
+        message.update(json.loads(frame[offset + 2 : offset + 2 + length]))
+    return message
+
+
+# Every format also says whether it needs status on every frame (json) or only on change (bin)
+FORMATS = {
+    "json": (encode_json, False),
+    "bin": (encode_binary, True),
+}
+
+
+# ==================== Benchmark ====================
+
+def benchmark(seconds: int = 60, fps: float = 10.0) -> dict:
+    """Encode `seconds` of synthetic 160 Hz ECG at `fps` frames per second in each format."""
+    import math
+    import random
+
+    import pseudo_data
+
+    rng = random.Random(0)
+    beat = pseudo_data.ONE_HEARTBEAT
+    mean = sum(beat) / len(beat)
+    per_frame = int(160 / fps)
+    frames = []
+    af = {"af_detected": False, "probability": 0.07, "beats_used": 128, "model": "nec"}
+    for f in range(int(seconds * fps)):
+        i0 = f * per_frame
+        frames.append({
+            "times": [(i0 + i) / 160 + rng.uniform(0, 0.0005) for i in range(per_frame)],
+            "points": [beat[(i0 + i) % len(beat)] - mean + rng.uniform(-0.05, 0.05) for i in range(per_frame)],
+            "heart_rate": 72.0 + math.floor(f / 100),  # a new HR every 10 s
+            "mode": "rest",
+            "af": af,
+        })
+
+    result = {}
+    for name, (encode, on_change) in FORMATS.items():
+        # One deflate stream with context takeover, as permessage-deflate keeps per connection
+        deflate = zlib.compressobj(wbits=-15)
+        raw = deflated = 0
+        last_status = None
+        start = time.perf_counter()
+        encoded = []
+        for seq, message in enumerate(frames):
+            status = status_of(message)
+            encoded.append(encode(message, seq, not on_change or status != last_status))
+            last_status = status
+        encode_s = time.perf_counter() - start
+        for frame in encoded:
+            data = frame.encode() if isinstance(frame, str) else frame
+            raw += len(data)
+            deflated += len(deflate.compress(data) + deflate.flush(zlib.Z_SYNC_FLUSH)) - 4  # minus the 00 00 ff ff tail
+        result[name] = {
+            "bytes_per_s": round(raw / seconds),
+            "deflated_bytes_per_s": round(deflated / seconds),
+            "encode_us_per_frame": round(encode_s / len(frames) * 1e6, 2),
+        }
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ECG WebSocket frame formats')
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--fps', type=float, default=10.0, help='Frames per second')
+    args = parser.parse_args()
+
+    for name, stats in benchmark(fps=args.fps).items():
+        print(f"{name:<5} {stats}")
@@ -1,21 +1,25 @@
 import csv
 import math
-from collections import deque
-import lttbc
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 import socket
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
 from matplotlib.animation import FuncAnimation
 
 import database
+import ecg_broker
+import metrics
 import pan_tompkins_plus_plus.address_features as af
-from AF_detection import AFRdRDetector
+import stream_checkpoint
+from AF_detection import AFEnsembleDetector
 
 # --- Flask App Reference (set by backend_main.py) ---
 flask_app = None
+# batch_writer.BatchWriter set by backend_main; without it rows are committed one by one
+db_writer = None
 
 # --- Configuration ---
 ESP32_IP = '192.168.56.1'
@@ -27,6 +31,10 @@ RECONNECT_DELAY = 2  # seconds to wait before reconnecting
 MAX_RECONNECT_ATTEMPTS = 10  # 0 for infinite attempts
 CONNECTION_TIMEOUT = 5  # socket connection timeout
 # CSV_PATH = "pan_tompkins_plus_plus/results_csv/window_features.csv"
+# Warm-start settings
+CHECKPOINT_INTERVAL = 30  # seconds between streaming state checkpoints
+CHECKPOINT_MAX_AGE = 600  # older checkpoints (or longer disconnects) start cold
+CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', f'stream_state_{ESP32_IP}.npz')
 
 # Data storage
 all_times = []
@@ -49,23 +57,79 @@ now_ecg_data = {
 }
 mode = "rest_ecg_data_"
 exec = ThreadPoolExecutor()
-af_detector = AFRdRDetector(fs_hz=160, window_beats=128, nec_threshold=65, min_new_rr_for_update=10)
-last_af_result = {
-    "af_detected": False,
-    "nec": None,
-    "beats_used": 0,
-    "threshold": 65,
-}
+# NEC keeps deciding af_detected; the other plugins run on the same RR buffer for comparison
+af_detector = AFEnsembleDetector(fs_hz=160, window_beats=128, nec_threshold=65, min_new_rr_for_update=10, decision="nec")
+last_af_result = af_detector.last_result
+
+# Metrics
+_samples_total = metrics.counter("ecg_ingest_samples_total", "ECG samples received from the device")
+_lead_off_total = metrics.counter("ecg_ingest_lead_off_total", "Lead-off (NaN) samples skipped")
+_chunks_total = metrics.counter("ecg_chunks_total", "ECG chunks submitted for analysis")
+_skipped_windows_total = metrics.counter("ecg_windows_skipped_total", "Windows dropped because features were NaN")
+_detection_seconds = metrics.histogram("ecg_rpeak_detection_seconds", "R-peak detection time per chunk (AF path)")
+_af_seconds = metrics.histogram("af_update_seconds", "AF detector update time per chunk, including R-peak detection")
+_features_seconds = metrics.histogram("ecg_features_seconds", "calc_features time per window")
 
 # Connection state
 client_socket = None
 socket_file = None
 connection_lost = False
 reconnect_attempts = 0
-
-# Thread-safe queue for WebSocket display (update() pushes, get_points_chunk() pops)
-_ecg_ws_deque = deque()
+last_sample_ts = 0.0
+last_checkpoint_ts = 0.0
+# update_now_ecg runs in executor threads; it holds this while it changes now_ecg_data,
+# now_ecg_ts_min and ecg_data_cache, and save_stream_state while it reads them
+_window_state_lock = threading.Lock()
+
+# Live frames for WebSocket viewers (see ecg_broker.py): update() centers each sample with a
+# running mean and publishes the pending samples once they span FRAME_SECONDS, so viewers get
+# at most ECG_WS_MAX_FPS frames per second and a sample waits at most one frame before it leaves
+FRAME_SECONDS = 1.0 / float(os.environ.get('ECG_WS_MAX_FPS', '10'))
+_frame_times = []
+_frame_values = []
+_frame_started = 0.0
 _ecg_running_mean = None
+_published_status = None  # (heart_rate, af_detected) last sent to viewers
+# publish_frame (ingest loop) and publish_status (executor callback) both publish; one at a time,
+# so the status compare-and-set is atomic and viewers never get an older status after a newer one
+_publish_lock = threading.Lock()
+
+
+class SampleRing:
+    """Fixed-size history of (epoch seconds, volts) samples for range reads."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.count = 0  # samples ever appended; doubles as the id of the last sample
+        self._lock = threading.Lock()
+
+    def append(self, t: float, value: float) -> None:
+        with self._lock:
+            i = self.count % self.capacity
+            self.times[i] = t
+            self.values[i] = value
+            self.count += 1
+
+    def since(self, t0: float) -> tuple[np.ndarray, np.ndarray, int]:
+        """Copies of the samples at or after t0, oldest first, and the last sample id."""
+        with self._lock:
+            count = self.count
+            if count <= self.capacity:
+                times, values = self.times[:count].copy(), self.values[:count].copy()
+            else:
+                split = count % self.capacity
+                times = np.concatenate([self.times[split:], self.times[:split]])
+                values = np.concatenate([self.values[split:], self.values[:split]])
+        start = np.searchsorted(times, t0, side='left')
+        return times[start:], values[start:], count
+
+
+# Raw samples for /api/v1/ecg/range
+ECG_HISTORY_SECONDS = 600
+ECG_FS_HZ = 160
+_ecg_history = SampleRing(ECG_HISTORY_SECONDS * ECG_FS_HZ)
 
 def init():
     ax.set_xlim(0, WINDOW_SECONDS)
@@ -74,6 +138,7 @@ def init():
 
 def connect_to_esp32():
     global client_socket, socket_file, connection_lost, reconnect_attempts
+    was_lost = connection_lost
     
     print(f"Connecting to {ESP32_IP}:{PORT}...")
     
@@ -92,6 +157,9 @@ def connect_to_esp32():
         connection_lost = False
         reconnect_attempts = 0
         print("Connection successful!")
+        if was_lost and last_sample_ts and time.time() - last_sample_ts > CHECKPOINT_MAX_AGE:
+            print("Disconnected for too long, discarding streaming state")
+            reset_stream_state()
         return True
         
     except Exception as e:
@@ -107,6 +175,88 @@ def reconnect():
     
     return connect_to_esp32()
 
+# --- Warm-start Checkpointing ---
+def save_stream_state() -> None:
+    """Call from the ingest loop (update() or main()), which owns the AF detector and frame state."""
+    global last_checkpoint_ts
+    af_state = af_detector.get_state()
+    with _window_state_lock:
+        cache = np.asarray(ecg_data_cache, dtype=np.float32)
+        ts_min = now_ecg_ts_min
+        ecg_data = dict(now_ecg_data)
+    stream_checkpoint.save_checkpoint(
+        CHECKPOINT_PATH,
+        {
+            "rr_samples": af_state["rr_samples"],
+            "ecg_data_cache": cache,
+        },
+        {
+            "fs_hz": af_detector.fs_hz,
+            "new_rr_since_eval": af_state["new_rr_since_eval"],
+            "last_af_result": last_af_result,
+            "ecg_running_mean": _ecg_running_mean,
+            "now_ecg_ts_min": ts_min,
+            "now_ecg_data": ecg_data,
+            "mode": mode,
+        },
+    )
+    last_checkpoint_ts = time.time()
+
+def restore_stream_state() -> bool:
+    global last_af_result, _ecg_running_mean, now_ecg_ts_min, now_ecg_data, ecg_data_cache, mode
+    loaded = stream_checkpoint.load_checkpoint(CHECKPOINT_PATH, CHECKPOINT_MAX_AGE)
+    if loaded is None:
+        return False
+    arrays, meta = loaded
+    if int(meta["fs_hz"]) != af_detector.fs_hz:
+        print("Ignoring checkpoint recorded at a different sampling rate")
+        return False
+
+    af_detector.load_state({
+        "rr_samples": arrays["rr_samples"],
+        "new_rr_since_eval": meta["new_rr_since_eval"],
+        "last_result": meta["last_af_result"],
+    })
+    last_af_result = af_detector.last_result
+    _ecg_running_mean = meta["ecg_running_mean"]
+    mode = meta["mode"]
+    with _window_state_lock:
+        now_ecg_data = meta["now_ecg_data"]
+        # The HR cache only belongs to the minute it was collected in
+        if meta["now_ecg_ts_min"] == time.time() // 60:
+            now_ecg_ts_min = meta["now_ecg_ts_min"]
+            ecg_data_cache = arrays["ecg_data_cache"].astype(float).tolist()
+    print(f"Restored streaming state: {len(arrays['rr_samples'])} RR intervals, "
+          f"AF result {'ready' if last_af_result['beats_used'] else 'pending'}")
+    return True
+
+def reset_stream_state() -> None:
+    global last_af_result, _ecg_running_mean, now_ecg_ts_min
+    af_detector.reset()
+    last_af_result = af_detector.last_result
+    _ecg_running_mean = None
+    with _window_state_lock:
+        now_ecg_ts_min = 0
+        ecg_data_cache.clear()
+
+def _collect_af_metrics() -> None:
+    for name, stats in af_detector.stats()["plugins"].items():
+        labels = {"plugin": name}
+        metrics.gauge("af_plugin_evaluations", "AF plugin evaluations", labels).set(stats["evaluations"])
+        metrics.gauge("af_plugin_time_seconds_total", "Cumulative AF plugin compute time", labels).set(stats["total_time_ms"] / 1000.0)
+        if stats["agreement_rate"] is not None:
+            metrics.gauge("af_plugin_agreement_ratio", "Share of evaluations agreeing with the ensemble", labels).set(stats["agreement_rate"])
+
+metrics.REGISTRY.add_collector(_collect_af_metrics)
+
+def _update_af(ecg: np.ndarray) -> dict:
+    start = time.perf_counter()
+    result = af_detector.update(ecg)
+    _af_seconds.observe(time.perf_counter() - start)
+    _detection_seconds.observe(af_detector.last_detection_s)
+    _chunks_total.inc()
+    return result
+
 def _has_nan(d: dict) -> bool:
     for v in d.values():
         if isinstance(v, float) and math.isnan(v):
@@ -116,36 +266,48 @@ def _has_nan(d: dict) -> bool:
 def update_now_ecg(data: dict) -> None:
     global now_ecg_data, now_ecg_ts_min, ecg_data_cache, flask_app
     result = data.result()
+    _features_seconds.observe(result.get("calc_time", 0.0))
 
     # Skip if calc_features returned NaN (too few R-peaks)
     if _has_nan(result):
+        _skipped_windows_total.inc()
         print(f"Skipping window with NaN values (insufficient R-peaks): "
               f"max_hr={result.get('max_hr')}, avg_hr={result.get('avg_hr')}")
         return
 
-    now_ecg_data = result
-
-    now_ts = time.time() // 60
-    if now_ecg_ts_min != now_ts:
-        if now_ecg_ts_min != 0 and flask_app is not None:
-            with flask_app.app_context():
-                try:
-                    database.add_hr_record(heart_rate = sum(ecg_data_cache) / len(ecg_data_cache))
-                except Exception as e:
-                    print(f"Error saving HR record: {e}")
-        now_ecg_ts_min = now_ts
-        ecg_data_cache.clear()
-    ecg_data_cache.append(now_ecg_data["avg_hr"])
+    # The minute's average HR, if this window starts a new minute
+    minute_hr = None
+    with _window_state_lock:
+        now_ecg_data = result
+        now_ts = time.time() // 60
+        if now_ecg_ts_min != now_ts:
+            if now_ecg_ts_min != 0:
+                minute_hr = sum(ecg_data_cache) / len(ecg_data_cache)
+            now_ecg_ts_min = now_ts
+            ecg_data_cache.clear()
+        ecg_data_cache.append(result["avg_hr"])
+    publish_status()
+
+    if minute_hr is not None and db_writer is not None:
+        db_writer.add_hr_record(database.now_user_id, minute_hr)
+    elif minute_hr is not None and flask_app is not None:
+        with flask_app.app_context():
+            try:
+                database.add_hr_record(heart_rate = minute_hr)
+            except Exception as e:
+                print(f"Error saving HR record: {e}")
 
-    if flask_app is not None:
+    if db_writer is not None:
+        db_writer.add_window_feature(database.now_user_id, result)
+    elif flask_app is not None:
         with flask_app.app_context():
             try:
-                database.add_window_feature(database.now_user_id, now_ecg_data)
+                database.add_window_feature(database.now_user_id, result)
             except Exception as e:
                 print(f"Error saving window feature: {e}")
 
 def update(frame):
-    global last_ts, last_ecg_chunk, last_temp_chunk, mode, connection_lost, last_af_result
+    global last_ts, last_ecg_chunk, last_temp_chunk, mode, connection_lost, last_af_result, last_sample_ts
     
     if connection_lost:
         if not reconnect():
@@ -192,7 +354,7 @@ def update(frame):
                     ts = np.asarray(temp_times, dtype=float)
                     ecg = np.asarray(temp_values, dtype=float)
                     exec.submit(af.calc_features, ts, ecg, base=mode).add_done_callback(update_now_ecg)
-                    last_af_result = af_detector.update(ecg)
+                    last_af_result = _update_af(ecg)
                 else:
                     print(f"Mode switched: {mode} -> {new_mode}, discarding {len(temp_values)} samples (too few)")
                 temp_times.clear()
@@ -202,13 +364,19 @@ def update(frame):
             
             # Skip lead-off samples
             if voltage_str == "NaN":
+                _lead_off_total.inc()
+                # Do not hold back the samples before the lead came off
+                if _frame_times and time.time() - _frame_started >= FRAME_SECONDS:
+                    publish_frame()
                 return line,
             
             val = float(voltage_str)
+            _samples_total.inc()
             
             # Use ESP32 timestamp for precise relative time (seconds)
             now_timestamp = time.time()
             now = now_timestamp - start_timestamp
+            last_sample_ts = now_timestamp
 
             if now_timestamp - last_ts >= WINDOW_SECONDS:
                 last_ecg_chunk = temp_values.copy()
@@ -216,7 +384,7 @@ def update(frame):
                 ts = np.asarray(temp_times, dtype=float)
                 ecg = np.asarray(temp_values, dtype=float)
                 exec.submit(af.calc_features, ts, ecg, base=mode).add_done_callback(update_now_ecg)
-                last_af_result = af_detector.update(ecg)
+                last_af_result = _update_af(ecg)
 
                 temp_times.clear()
                 temp_values.clear()
@@ -225,7 +393,16 @@ def update(frame):
             
             temp_times.append(now)
             temp_values.append(val)
-            _ecg_ws_deque.append((now, val))
+            _ecg_history.append(now_timestamp, val)
+            _add_live_sample(now, now_timestamp, val)
+
+            # Checkpoint here rather than in update_now_ecg: the AF detector and running mean
+            # are only changed by this loop, so the snapshot is consistent
+            if now_timestamp - last_checkpoint_ts >= CHECKPOINT_INTERVAL:
+                try:
+                    save_stream_state()
+                except Exception as e:
+                    print(f"Error saving streaming checkpoint: {e}")
             
             if SAVE_DATA:
                 # Save to permanent lists
@@ -248,27 +425,48 @@ def update(frame):
         print(f"Error updating data: {e}")
     return line,
 
-def get_points_chunk() -> dict:
-    global _ecg_running_mean
-    # Drain the thread-safe deque — only new points since last call
-    points = []
-    while _ecg_ws_deque:
-        try:
-            points.append(_ecg_ws_deque.popleft())
-        except IndexError:
-            break
-    if not points:
-        return {"times": [], "values": []}
-    times = [p[0] for p in points]
-    values = [p[1] for p in points]
-    # Running mean for stable centering across batches
-    for v in values:
-        if _ecg_running_mean is None:
-            _ecg_running_mean = v
-        else:
-            _ecg_running_mean += (v - _ecg_running_mean) * 0.001
-    centered = [v - _ecg_running_mean for v in values]
-    return {"times": times, "values": centered}
+def _add_live_sample(t: float, now_timestamp: float, value: float) -> None:
+    global _ecg_running_mean, _frame_started
+    # Running mean for stable centering across frames
+    if _ecg_running_mean is None:
+        _ecg_running_mean = value
+    else:
+        _ecg_running_mean += (value - _ecg_running_mean) * 0.001
+    if not _frame_times:
+        _frame_started = now_timestamp
+    _frame_times.append(t)
+    _frame_values.append(value - _ecg_running_mean)
+    if now_timestamp - _frame_started >= FRAME_SECONDS:
+        publish_frame()
+
+def _status() -> dict:
+    return {"heart_rate": get_heart_rate(), "mode": get_mode(), "af": get_af_result()}
+
+def publish_frame() -> None:
+    """Publish the pending samples with the current HR, mode and AF result to every viewer."""
+    global _published_status
+    with _publish_lock:
+        status = _status()
+        _published_status = (status["heart_rate"], status["af"].get("af_detected"))
+        ecg_broker.broker.publish({"times": _frame_times.copy(), "points": _frame_values.copy(), **status},
+                                  _frame_started)
+    _frame_times.clear()
+    _frame_values.clear()
+
+def publish_status() -> None:
+    """Push a new HR/AF result to viewers right away, without samples; skipped if nothing changed."""
+    global _published_status
+    with _publish_lock:
+        status = _status()
+        key = (status["heart_rate"], status["af"].get("af_detected"))
+        if key == _published_status:
+            return
+        _published_status = key
+        ecg_broker.broker.publish({"times": [], "points": [], **status})
+
+def get_ecg_range(seconds: float) -> tuple[np.ndarray, np.ndarray, int]:
+    """Raw samples of the last `seconds` (epoch times, volts) and the id of the newest sample."""
+    return _ecg_history.since(time.time() - seconds)
 
 def get_heart_rate() -> float:
     global now_ecg_data
@@ -282,6 +480,10 @@ def get_mode() -> str:
 def get_af_result() -> dict:
     return last_af_result
 
+
+def get_af_stats() -> dict:
+    return af_detector.stats()
+
 # --- Run ---
 def main() -> None:
     global fig, ax, line, start_timestamp, last_ts
@@ -294,6 +496,9 @@ def main() -> None:
     ax.set_ylabel("Voltage (V)")
     ax.grid(True)
 
+    # --- Warm Start ---
+    restore_stream_state()
+
     # --- Socket Connection ---
     while not connect_to_esp32():
         print(f"Connection refused, retrying...")
@@ -321,6 +526,11 @@ def main() -> None:
     except KeyboardInterrupt:
         print("\nInterrupt received. Stopping...")
     finally:
+        try:
+            save_stream_state()
+        except Exception as e:
+            print(f"Error saving streaming checkpoint: {e}")
+
         # --- Save  ---
         out_dir = "ECG_DATA/"
         os.makedirs(out_dir, exist_ok=True)
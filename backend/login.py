@@ -4,6 +4,7 @@ from google.auth.transport import requests as google_requests
 import secrets
 
 import database
+import user_cache
 
 # Google OAuth Client ID (must match frontend)
 GOOGLE_CLIENT_ID = "693422158799-3b30id9m2eo0l4463m4njruokbalk5bd.apps.googleusercontent.com"
@@ -44,23 +45,33 @@ def check_auth(req: request) -> dict:
     except ValueError:
         return {"error": (401, 'Invalid Authorization Header')}
     
-    user = database.get_user_by_token(token)
+    user = user_by_token(token)
     if not user:
         return {"error": (401, 'Invalid Token')}
-    
+    return dict(user)
+
+
+def user_by_token(token: str) -> dict | None:
+    user = user_cache.tokens.get(token)
+    if user is not None:
+        return user
+    row = database.get_user_by_token(token)
+    if not row:
+        return None
     # Return user data in compatible format
-    return {
-        "id": user.id,
-        "token": user.api_token,
-        "name": user.name,
-        "email": user.email,
-        "profile_completed": user.profile_completed
+    user = {
+        "id": row.id,
+        "token": row.api_token,
+        "name": row.name,
+        "email": row.email,
+        "profile_completed": row.profile_completed
     }
+    user_cache.tokens.put(token, user)
+    return user
 
 
 def check_auth_ws(token: str) -> bool:
-    user = database.get_user_by_token(token)
-    return user is not None
+    return user_by_token(token) is not None
 
 
 def login(google_token: str) -> dict:
@@ -0,0 +1,202 @@
+import functools
+import platform
+import threading
+import time
+from bisect import bisect_left
+
+# Latency buckets in seconds, shared by every histogram unless overridden
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _label_key(labels: dict | None) -> tuple:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, key: tuple) -> list[str]:
+        return [f"{name}{_format_labels(key)} {_format_value(self.value)}"]
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def samples(self, name: str, key: tuple) -> list[str]:
+        return [f"{name}{_format_labels(key)} {_format_value(self.value)}"]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self.bounds = tuple(sorted(buckets))
+        # One slot per bound plus the +Inf overflow slot; cumulated only when rendering
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name: str, key: tuple) -> list[str]:
+        with self._lock:
+            counts = list(self.counts)
+            total_sum = self.sum
+            total = self.count
+        lines = []
+        running = 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            running += count
+            lines.append(f"{name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {running}")
+        lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total_sum)}")
+        lines.append(f"{name}_count{_format_labels(key)} {total}")
+        return lines
+
+
+class MetricsRegistry:
+    _TYPES = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families: dict[str, dict] = {}
+        self._collectors = []
+
+    def _get(self, cls, name: str, help_text: str, labels: dict | None, **kwargs):
+        key = _label_key(labels)
+        family = self._families.get(name)
+        if family is not None:
+            metric = family["children"].get(key)
+            if metric is not None:
+                return metric
+        with self._lock:
+            family = self._families.setdefault(name, {"type": cls, "help": help_text, "children": {}})
+            if family["type"] is not cls:
+                raise ValueError(f"metric {name} already registered as {self._TYPES[family['type']]}")
+            return family["children"].setdefault(key, cls(**kwargs))
+
+    def counter(self, name: str, help_text: str = "", labels: dict | None = None) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str = "", labels: dict | None = None) -> Gauge:
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str = "", labels: dict | None = None, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def add_collector(self, fn) -> None:
+        """Register a callback that refreshes gauges right before rendering."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+
+        lines = []
+        for name, family in sorted(self._families.items()):
+            if family["help"]:
+                lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {self._TYPES[family['type']]}")
+            for key, metric in list(family["children"].items()):
+                lines.extend(metric.samples(name, key))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+class timed:
+    """Observe elapsed wall time into a histogram, as a context manager or decorator."""
+
+    def __init__(self, name: str, help_text: str = "", **labels):
+        self._hist = REGISTRY.histogram(name, help_text, labels or None)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._hist.observe(time.perf_counter() - self._start)
+        return False
+
+    def __call__(self, fn):
+        hist = self._hist
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - start)
+        return wrapper
+
+
+@functools.lru_cache(maxsize=1)
+def host_fingerprint() -> dict:
+    """CPU description for labelling timings; probed once because cpuinfo is slow on ARM."""
+    try:
+        import cpuinfo
+
+        info = cpuinfo.get_cpu_info()
+        return {
+            "cpu": info.get("brand_raw", "unknown"),
+            "arch": info.get("arch", platform.machine()),
+            "hz": info.get("hz_advertised_friendly", "unknown"),
+        }
+    except Exception:
+        return {"cpu": platform.processor() or "unknown", "arch": platform.machine(), "hz": "unknown"}
+
+
+def _collect_host_info() -> None:
+    REGISTRY.gauge("host_info", "Host CPU fingerprint (constant 1)", host_fingerprint()).set(1)
+
+
+REGISTRY.add_collector(_collect_host_info)
+REGISTRY.gauge("process_start_time_seconds", "Unix time the backend process started").set(time.time())
+
+
+def render() -> str:
+    return REGISTRY.render()
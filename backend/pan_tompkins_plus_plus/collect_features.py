@@ -54,10 +54,140 @@ def collect_exercise(df: pd.DataFrame) -> dict:
         "n_ex_windows": int(total),
     }
 
+class WindowAggregate:
+    """Running version of collect_rest/collect_exercise, updated one window at a time.
+
+    Keeps max HR, oldpeak sum/count and label counts for rest and exercise windows,
+    plus the sequence number each label was last seen at, so majority votes break
+    ties towards the most recent label without keeping the windows themselves.
+    Pure data: safe to use from concurrent requests, unlike base_patient_info.
+    """
+
+    def __init__(self):
+        self.seq = 0
+        self.total = 0  # every window added and not removed, including other prefixes
+        self.rest = self._empty_side()
+        self.ex = self._empty_side()
+
+    @staticmethod
+    def _empty_side() -> dict:
+        # labels: value -> [count, last_seq]
+        return {"n": 0, "max_hr": None, "oldpeak_sum": 0.0, "oldpeak_n": 0, "labels": {}}
+
+    def _side(self, file: str, resting_ecg, st_label) -> tuple[dict | None, object]:
+        file = str(file)
+        if file.startswith("rest_"):
+            return self.rest, resting_ecg
+        if file.startswith("exercise_"):
+            return self.ex, st_label
+        return None, None
+
+    def add(self, file: str, max_hr: float, oldpeak: float, resting_ecg, st_label) -> None:
+        self.total += 1
+        side, label = self._side(file, resting_ecg, st_label)
+        if side is None:
+            return
+        self.seq += 1
+        side["n"] += 1
+        # NaN values are skipped like pandas max()/mean() do
+        if max_hr is not None and max_hr == max_hr:
+            side["max_hr"] = max_hr if side["max_hr"] is None else max(side["max_hr"], max_hr)
+        if oldpeak is not None and oldpeak == oldpeak:
+            side["oldpeak_sum"] += oldpeak
+            side["oldpeak_n"] += 1
+        if label is not None:
+            count = side["labels"].setdefault(label, [0, 0])
+            count[0] += 1
+            count[1] = self.seq
+
+    def remove(self, file: str, max_hr: float, oldpeak: float, resting_ecg, st_label) -> str | None:
+        """Take back the oldest window (retention).
+
+        Returns the file prefix whose max HR has to be recomputed ("rest_" or
+        "exercise_") when the removed window held the maximum, else None.
+        """
+        self.total -= 1
+        side, label = self._side(file, resting_ecg, st_label)
+        if side is None:
+            return None
+        side["n"] -= 1
+        if oldpeak is not None and oldpeak == oldpeak:
+            side["oldpeak_sum"] -= oldpeak
+            side["oldpeak_n"] -= 1
+        if label is not None and label in side["labels"]:
+            # The oldest occurrence never carries last_seq unless it was the only one
+            side["labels"][label][0] -= 1
+            if side["labels"][label][0] <= 0:
+                del side["labels"][label]
+        if side["n"] == 0:
+            side.update(self._empty_side())
+            return None
+        if max_hr is not None and side["max_hr"] is not None and max_hr >= side["max_hr"]:
+            return "rest_" if side is self.rest else "exercise_"
+        return None
+
+    def set_max_hr(self, prefix: str, max_hr: float | None) -> None:
+        (self.rest if prefix == "rest_" else self.ex)["max_hr"] = max_hr
+
+    def to_dict(self) -> dict:
+        return {"seq": self.seq, "total": self.total, "rest": self.rest, "ex": self.ex}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "WindowAggregate":
+        agg = cls()
+        agg.seq = state["seq"]
+        agg.total = state["total"]
+        agg.rest = state["rest"]
+        agg.ex = state["ex"]
+        return agg
+
+    @staticmethod
+    def _major(labels: dict):
+        if not labels:
+            return None
+        return max(labels, key=lambda label: (labels[label][0], labels[label][1]))
+
+    @staticmethod
+    def _summary(side: dict) -> tuple[float, float]:
+        max_hr = side["max_hr"] if side["max_hr"] is not None else float("nan")
+        mean_oldpeak = side["oldpeak_sum"] / side["oldpeak_n"] if side["oldpeak_n"] else float("nan")
+        return max_hr, mean_oldpeak
+
+    def model_input(self, patient_info: dict) -> dict:
+        """collect_features() over every window added so far, except for tied majority votes.
+
+        On a tie this picks the most recently seen label, as majority_vote's comment intends.
+        collect_features() reads the windows newest first, so on a tie it returns the label
+        seen first (e.g. Up, Down, Up, Down gives "Up" there and "Down" here). First-seen
+        order cannot be kept once retention removes the oldest windows.
+        """
+        has_rest, has_ex = self.rest["n"] > 0, self.ex["n"] > 0
+        rest_max_hr, rest_mean_oldpeak = self._summary(self.rest)
+        ex_max_hr, ex_mean_oldpeak = self._summary(self.ex)
+        if has_rest and has_ex:
+            delta_oldpeak = ex_mean_oldpeak - rest_mean_oldpeak
+            ex_st_slope = self._major(self.ex["labels"])
+        else:
+            delta_oldpeak = 0.0
+            ex_st_slope = "Flat"
+
+        model_input = patient_info.copy()
+        model_input["MaxHR"] = float(ex_max_hr if has_ex else rest_max_hr if has_rest else 0)
+        model_input["ST_Slope"] = ex_st_slope
+        model_input["Oldpeak"] = float(delta_oldpeak)
+        if patient_info["RestingECG"]:
+            model_input["RestingECG"] = "LVH"
+        else:
+            model_input["RestingECG"] = self._major(self.rest["labels"]) if has_rest else "Normal"
+        return model_input
+
 # TODO: check how to use window features and implement this.
 # Also, I should process the rest/exercise issue.
-def collect_features(df: pd.DataFrame, debug: bool = False, model_input_path: str = "../results_csv/model_input_features.csv", collectd_path: str = "../results_csv/collectd_features.csv") -> dict:
+# patient_info overrides the module-level base_patient_info (needed when scoring many users at once)
+def collect_features(df: pd.DataFrame, debug: bool = False, model_input_path: str = "../results_csv/model_input_features.csv", collectd_path: str = "../results_csv/collectd_features.csv", patient_info: dict | None = None) -> dict:
     global base_patient_info
+    if patient_info is None:
+        patient_info = base_patient_info
     rest_feat = {}
     ex_feat = {}
     
@@ -92,11 +222,11 @@ def collect_features(df: pd.DataFrame, debug: bool = False, model_input_path: st
         pd.DataFrame([collectd]).to_csv(collectd_path, index=False, encoding="utf-8-sig")
 
     # Export Final model input 
-    model_input = base_patient_info.copy()
+    model_input = patient_info.copy()
     model_input["MaxHR"] = float(ex_feat.get("ex_max_hr", rest_feat.get("rest_max_hr", 0)))
     model_input["ST_Slope"] = ex_st_slope
     model_input["Oldpeak"] = float(delta_oldpeak)
-    model_input["RestingECG"] = "LVH" if base_patient_info["RestingECG"] else rest_feat.get("rest_resting_ecg_major", "Normal")
+    model_input["RestingECG"] = "LVH" if patient_info["RestingECG"] else rest_feat.get("rest_resting_ecg_major", "Normal")
 
     if debug:
         print("[DONE] Aggregation finished")
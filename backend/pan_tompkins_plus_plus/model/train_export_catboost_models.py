@@ -1,4 +1,5 @@
 import json
+import sys
 from pathlib import Path
 
 import pandas as pd
@@ -8,6 +9,9 @@ from sklearn.impute import SimpleImputer
 from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, roc_auc_score
 from sklearn.model_selection import train_test_split
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from oblivious_trees import export_from_cbm
+
 
 RANDOM_STATE = 42
 TARGET = "HeartDisease"
@@ -133,6 +137,7 @@ def train_and_export(config_name: str, config: dict, df: pd.DataFrame, out_dir:
 
     model_path = out_dir / f"{config_name}.cbm"
     final_model.save_model(str(model_path))
+    export_from_cbm(model_path)
 
     return {
         "model_name": config_name,
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Versioned, hot-reloadable model sets.
+
+A ModelSet is an immutable snapshot of every bundle listed in one
+exported_models.json. The registry polls the export directory, loads a
+changed export in its watcher thread and then swaps the active snapshot
+with a single reference assignment, so requests that already hold a
+snapshot finish on the version they started with. An export is only
+loaded once its files have stopped changing for one poll interval, since
+train_export_catboost_models.py writes the .cbm/.trees.npz files first and
+exported_models.json last.
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+import hashlib
+import json
+import threading
+import time
+
+
+@dataclass(frozen=True)
+class ModelSet:
+    version: str
+    bundles: dict
+    exports_path: Path
+    loaded_at: float = field(default_factory=time.time)
+
+
+def _referenced_files(exports_path: Path) -> list[Path]:
+    metadata = json.loads(exports_path.read_text(encoding="utf-8"))
+    files = []
+    for entry in metadata["exports"]:
+        model_path = exports_path.parent / entry["model_path"]
+        files.append(model_path)
+        files.append(model_path.with_name(model_path.stem + ".trees.npz"))
+    return files
+
+
+def _stat_signature(exports_path: Path) -> tuple:
+    paths = [exports_path]
+    try:
+        paths += _referenced_files(exports_path)
+    except (OSError, ValueError, KeyError):
+        pass
+    signature = []
+    for path in paths:
+        try:
+            stat = path.stat()
+            signature.append((str(path), stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((str(path), None, None))
+    return tuple(signature)
+
+
+def fingerprint(exports_path: Path) -> str:
+    digest = hashlib.sha1(exports_path.read_bytes())
+    for path in _referenced_files(exports_path):
+        if path.exists():
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+class ModelRegistry:
+    def __init__(self, exports_path: Path, loader, shadow_exports_path: Path | None = None,
+                 poll_interval: float = 10.0):
+        self.exports_path = Path(exports_path)
+        self.shadow_exports_path = Path(shadow_exports_path) if shadow_exports_path else None
+        self.poll_interval = float(poll_interval)
+        self._loader = loader
+        self._signatures: dict[Path, tuple] = {}
+        self._pending: dict[Path, tuple] = {}
+        self._watcher: threading.Thread | None = None
+        self._reload_lock = threading.Lock()
+        self.active: ModelSet = self._load(self.exports_path)
+        self.shadow: ModelSet | None = None
+        if self.shadow_exports_path is not None and self.shadow_exports_path.exists():
+            self.shadow = self._load(self.shadow_exports_path)
+
+    def _load(self, exports_path: Path) -> ModelSet:
+        signature = _stat_signature(exports_path)
+        model_set = ModelSet(fingerprint(exports_path), self._loader(exports_path), exports_path)
+        self._signatures[exports_path] = signature
+        return model_set
+
+    def _reload_one(self, exports_path: Path, current: ModelSet | None, wait_for_stable: bool) -> ModelSet | None:
+        if not exports_path.exists():
+            return None
+        signature = _stat_signature(exports_path)
+        if current is not None and signature == self._signatures.get(exports_path):
+            return current
+        if wait_for_stable and self._pending.get(exports_path) != signature:
+            # Still being written (or first sighting): wait until it is stable for one poll
+            self._pending[exports_path] = signature
+            return current
+        self._pending.pop(exports_path, None)
+        if current is not None and fingerprint(exports_path) == current.version:
+            self._signatures[exports_path] = signature
+            return current
+        return self._load(exports_path)
+
+    def reload_if_changed(self, wait_for_stable: bool = True) -> bool:
+        """Load changed exports and swap them in; returns True if anything changed."""
+        with self._reload_lock:
+            changed = False
+            try:
+                new_active = self._reload_one(self.exports_path, self.active, wait_for_stable)
+                if new_active is not None and new_active is not self.active:
+                    print(f"[INFO] model set {self.active.version} -> {new_active.version}")
+                    self.active = new_active
+                    changed = True
+            except Exception as e:
+                # A deploy may be half-written; keep serving the old version and retry later
+                print(f"[WARN] keeping model set {self.active.version}, reload failed: {e}")
+
+            if self.shadow_exports_path is not None:
+                try:
+                    new_shadow = self._reload_one(self.shadow_exports_path, self.shadow, wait_for_stable)
+                    if new_shadow is not self.shadow:
+                        print(f"[INFO] shadow model set -> {new_shadow.version if new_shadow else None}")
+                        self.shadow = new_shadow
+                        changed = True
+                except Exception as e:
+                    print(f"[WARN] shadow model reload failed: {e}")
+            return changed
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            self.reload_if_changed()
+
+    def start_watching(self) -> None:
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, daemon=True)
+            self._watcher.start()
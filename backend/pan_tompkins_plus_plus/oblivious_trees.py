@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""NumPy evaluator for CatBoost oblivious-tree binary classifiers.
+
+Every tree of depth D applies the same D (feature, border) splits to all
+rows, so the leaf index is just the D comparison bits packed into an int.
+The model is stored as flat arrays (split features, float32 borders, leaf
+values) in a small .npz next to the .cbm, and inference only needs numpy.
+
+    python oblivious_trees.py export   # .cbm -> .trees.npz (needs catboost)
+    python oblivious_trees.py verify   # compare with CatBoostClassifier.predict_proba
+"""
+from pathlib import Path
+import json
+import sys
+import tempfile
+
+import numpy as np
+
+BASE_DIR = Path(__file__).resolve().parent
+MODEL_DIR = BASE_DIR / "model"
+EXPORTS_PATH = MODEL_DIR / "exported_models.json"
+TREES_SUFFIX = ".trees.npz"
+BATCH_ROWS = 4096
+
+
+def trees_path_for(model_path: Path) -> Path:
+    return model_path.with_name(model_path.stem + TREES_SUFFIX)
+
+
+class ObliviousTreeModel:
+    def __init__(self, split_features: np.ndarray, split_borders: np.ndarray, leaf_values: np.ndarray,
+                 scale: float = 1.0, bias: float = 0.0):
+        # split_features/split_borders: (n_trees, depth); leaf_values: (n_trees, 2 ** depth)
+        self.split_features = np.asarray(split_features, dtype=np.int32)
+        self.split_borders = np.asarray(split_borders, dtype=np.float32)
+        self.leaf_values = np.asarray(leaf_values, dtype=np.float64)
+        self.scale = float(scale)
+        self.bias = float(bias)
+        self.depth = self.split_features.shape[1]
+        self._bit_weights = (1 << np.arange(self.depth, dtype=np.int64))
+        self._tree_index = np.arange(self.split_features.shape[0])[None, :]
+
+    @property
+    def tree_count(self) -> int:
+        return int(self.split_features.shape[0])
+
+    @classmethod
+    def from_catboost_json(cls, path: Path) -> "ObliviousTreeModel":
+        model = json.loads(Path(path).read_text(encoding="utf-8"))
+        float_features = model["features_info"]["float_features"]
+        flat_index = [int(feature["flat_feature_index"]) for feature in float_features]
+        trees = model["oblivious_trees"]
+        depth = max(len(tree["splits"]) for tree in trees)
+
+        split_features = np.zeros((len(trees), depth), dtype=np.int32)
+        # Padding splits compare against +inf so they always produce bit 0
+        split_borders = np.full((len(trees), depth), np.inf, dtype=np.float32)
+        leaf_values = np.zeros((len(trees), 1 << depth), dtype=np.float64)
+        for t, tree in enumerate(trees):
+            for d, split in enumerate(tree["splits"]):
+                if split["split_type"] != "FloatFeature":
+                    raise ValueError(f"unsupported split type: {split['split_type']}")
+                split_features[t, d] = flat_index[split["float_feature_index"]]
+                split_borders[t, d] = split["border"]
+            values = np.asarray(tree["leaf_values"], dtype=np.float64)
+            if values.size != 1 << len(tree["splits"]):
+                raise ValueError("only single-dimension (binary) models are supported")
+            leaf_values[t, : values.size] = values
+
+        scale, bias = model.get("scale_and_bias", [1.0, [0.0]])
+        bias = bias[0] if isinstance(bias, list) else bias
+        return cls(split_features, split_borders, leaf_values, scale, bias)
+
+    @classmethod
+    def load(cls, path: Path) -> "ObliviousTreeModel":
+        with np.load(path) as data:
+            return cls(
+                data["split_features"],
+                data["split_borders"],
+                data["leaf_values"],
+                float(data["scale"]),
+                float(data["bias"]),
+            )
+
+    def save(self, path: Path) -> None:
+        np.savez_compressed(
+            path,
+            split_features=self.split_features.astype(np.int16),
+            split_borders=self.split_borders,
+            leaf_values=self.leaf_values,
+            scale=np.float64(self.scale),
+            bias=np.float64(self.bias),
+        )
+
+    def _raw_batch(self, X: np.ndarray) -> np.ndarray:
+        # CatBoost quantizes float32 inputs against float32 borders
+        values = X[:, self.split_features]                       # (rows, trees, depth)
+        bits = values > self.split_borders[None, :, :]
+        leaf_index = bits.astype(np.int64) @ self._bit_weights   # (rows, trees)
+        leaves = self.leaf_values[self._tree_index, leaf_index]
+        return leaves.sum(axis=1) * self.scale + self.bias
+
+    def predict_raw(self, X) -> np.ndarray:
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[0] <= BATCH_ROWS:
+            return self._raw_batch(X)
+        return np.concatenate([self._raw_batch(X[i : i + BATCH_ROWS]) for i in range(0, X.shape[0], BATCH_ROWS)])
+
+    def predict_proba(self, X) -> np.ndarray:
+        prob = 1.0 / (1.0 + np.exp(-self.predict_raw(X)))
+        return np.column_stack((1.0 - prob, prob))
+
+
+# ==================== Export / Verification ====================
+
+def _export_entries() -> list[dict]:
+    metadata = json.loads(EXPORTS_PATH.read_text(encoding="utf-8"))
+    return metadata["exports"]
+
+
+def export_from_cbm(model_path: Path) -> Path:
+    from catboost import CatBoostClassifier
+
+    model = CatBoostClassifier()
+    model.load_model(str(model_path))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = Path(tmp_dir) / "model.json"
+        model.save_model(str(json_path), format="json")
+        trees = ObliviousTreeModel.from_catboost_json(json_path)
+    out_path = trees_path_for(model_path)
+    trees.save(out_path)
+    return out_path
+
+
+def verify_against_catboost(model_path: Path, n_rows: int = 5000, seed: int = 0) -> float:
+    from catboost import CatBoostClassifier
+
+    model = CatBoostClassifier()
+    model.load_model(str(model_path))
+    trees = ObliviousTreeModel.load(trees_path_for(model_path))
+
+    # Random rows spanning every border, plus values sitting exactly on borders
+    rng = np.random.default_rng(seed)
+    n_features = int(trees.split_features.max()) + 1
+    X = np.empty((n_rows, n_features), dtype=np.float64)
+    for f in range(n_features):
+        borders = trees.split_borders[trees.split_features == f]
+        borders = borders[np.isfinite(borders)]
+        low, high = (borders.min() - 1.0, borders.max() + 1.0) if borders.size else (0.0, 1.0)
+        X[:, f] = rng.uniform(low, high, n_rows)
+        if borders.size:
+            on_border = rng.random(n_rows) < 0.1
+            X[on_border, f] = rng.choice(borders, on_border.sum())
+
+    expected = model.predict_proba(X)
+    actual = trees.predict_proba(X)
+    return float(np.max(np.abs(expected - actual)))
+
+
+def main() -> None:
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    for entry in _export_entries():
+        model_path = MODEL_DIR / entry["model_path"]
+        if command == "export":
+            print(f"saved: {export_from_cbm(model_path)}")
+        elif command == "verify":
+            max_diff = verify_against_catboost(model_path)
+            print(f"{entry['model_name']}: max |predict_proba difference| = {max_diff:.3e}")
+        else:
+            raise SystemExit(f"unknown command: {command} (expected export or verify)")
+
+
+if __name__ == "__main__":
+    main()
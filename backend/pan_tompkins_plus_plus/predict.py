@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
 from pathlib import Path
-import cpuinfo
 import json
+import os
 import pandas as pd
 import numpy as np
+import sys
 import time
 
-from catboost import CatBoostClassifier
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import metrics
+
+try:
+    from .model_registry import ModelRegistry, ModelSet
+    from .oblivious_trees import ObliviousTreeModel, trees_path_for
+except ImportError:
+    from model_registry import ModelRegistry, ModelSet
+    from oblivious_trees import ObliviousTreeModel, trees_path_for
 
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -15,29 +24,116 @@ OUT_DIR = BASE_DIR / "results_csv"
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 EXPORTS_PATH = MODEL_DIR / "exported_models.json"
+# A candidate export placed here is scored next to the active models but never served
+SHADOW_EXPORTS_PATH = Path(os.environ.get("SHADOW_EXPORTS_PATH", MODEL_DIR / "shadow" / "exported_models.json"))
+MODEL_POLL_INTERVAL = float(os.environ.get("MODEL_POLL_INTERVAL", "10"))
+
+
+def load_model(model_path: Path):
+    # The NumPy tree export is preferred so production never has to import catboost
+    trees_path = trees_path_for(model_path)
+    if trees_path.exists():
+        return ObliviousTreeModel.load(trees_path)
 
+    from catboost import CatBoostClassifier
 
-def load_model_bundles() -> dict[str, dict]:
-    if not EXPORTS_PATH.exists():
-        raise FileNotFoundError(f"missing metadata: {EXPORTS_PATH}")
+    print(f"[WARN] {trees_path.name} not found, falling back to catboost for {model_path.name}")
+    model = CatBoostClassifier()
+    model.load_model(str(model_path))
+    return model
 
-    metadata = json.loads(EXPORTS_PATH.read_text(encoding="utf-8"))
+
+def load_model_bundles(exports_path: Path = EXPORTS_PATH) -> dict[str, dict]:
+    if not exports_path.exists():
+        raise FileNotFoundError(f"missing metadata: {exports_path}")
+
+    metadata = json.loads(exports_path.read_text(encoding="utf-8"))
     bundles = {}
     for export_entry in metadata["exports"]:
-        model_path = MODEL_DIR / export_entry["model_path"]
+        model_path = exports_path.parent / export_entry["model_path"]
         if not model_path.exists():
             raise FileNotFoundError(f"missing model: {model_path}")
 
-        model = CatBoostClassifier()
-        model.load_model(str(model_path))
+        model = load_model(model_path)
         bundles[export_entry["model_name"]] = {
             "model": model,
             "config": export_entry,
+            "encoder": FeatureEncoder(export_entry),
         }
     return bundles
 
 
-MODEL_BUNDLES = load_model_bundles()
+def _to_float(value) -> float:
+    # Same coercion as pd.to_numeric(errors="coerce") for scalar inputs
+    if value is None:
+        return np.nan
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class FeatureEncoder:
+    """Precompiled version of preprocess_input for dict rows.
+
+    Category maps and imputer means are flattened into per-column lookups so a
+    feature dict becomes a contiguous float64 row without building DataFrames.
+    """
+
+    def __init__(self, model_config: dict):
+        self.features = list(model_config["features"])
+        category_maps = model_config["category_maps"]
+        imputer_stats = model_config["numeric_imputer_stats"]
+        self.category_maps = {
+            col: {key: float(code) for key, code in mapping.items()}
+            for col, mapping in category_maps.items()
+        }
+        self.fill_values = np.array(
+            [float(imputer_stats.get(feature, np.nan)) for feature in self.features], dtype=np.float64
+        )
+        self.numeric_index = [i for i, feature in enumerate(self.features) if feature in imputer_stats]
+        self.category_index = [i for i, feature in enumerate(self.features) if feature in self.category_maps]
+
+    def _fill_row(self, out: np.ndarray, row: dict) -> None:
+        for feature in self.features:
+            if feature not in row:
+                raise KeyError(f"missing feature: {feature}")
+        for i in self.category_index:
+            col = self.features[i]
+            # preprocess_input compares astype(str) values, so str() keeps 1 vs "1" vs 1.0 semantics
+            key = str(row[col])
+            code = self.category_maps[col].get(key)
+            if code is None:
+                raise ValueError(f"unknown category in {col}: {[key]}")
+            out[i] = code
+        for i in self.numeric_index:
+            value = _to_float(row[self.features[i]])
+            out[i] = self.fill_values[i] if np.isnan(value) else value
+
+    def encode(self, row: dict) -> np.ndarray:
+        out = np.empty((1, len(self.features)), dtype=np.float64)
+        self._fill_row(out[0], row)
+        return out
+
+    def encode_rows(self, rows: list[dict]) -> np.ndarray:
+        out = np.empty((len(rows), len(self.features)), dtype=np.float64)
+        for index, row in enumerate(rows):
+            self._fill_row(out[index], row)
+        return out
+
+
+# Callers take one snapshot (REGISTRY.active) per request so a hot reload never mixes versions
+REGISTRY = ModelRegistry(EXPORTS_PATH, load_model_bundles, SHADOW_EXPORTS_PATH, MODEL_POLL_INTERVAL)
+
+
+def models_version() -> str:
+    """Version of the active model set; cached risk results are only reused for the same version."""
+    return REGISTRY.active.version
 
 
 def to_py(obj):
@@ -63,6 +159,13 @@ def choose_model_name(raw_df: pd.DataFrame) -> str:
     return "catboost_8f"
 
 
+def choose_model_name_for(features: dict) -> str:
+    if "Cholesterol" in features and "FastingBS" in features:
+        if not np.isnan(_to_float(features["Cholesterol"])) and not np.isnan(_to_float(features["FastingBS"])):
+            return "catboost_10f"
+    return "catboost_8f"
+
+
 def preprocess_input(raw_df: pd.DataFrame, model_config: dict) -> pd.DataFrame:
     features = model_config["features"]
     prepared = pd.DataFrame(index=raw_df.index)
@@ -90,9 +193,10 @@ def risk_text_from_prob(prob: float, threshold: float) -> str:
 
 
 def predict(raw_df: pd.DataFrame, debug: bool = False) -> dict:
-    calc_start = time.time()
+    calc_start = time.perf_counter()
     model_name = choose_model_name(raw_df)
-    bundle = MODEL_BUNDLES[model_name]
+    models = REGISTRY.active
+    bundle = models.bundles[model_name]
     model_config = bundle["config"]
     model = bundle["model"]
     X_ready = preprocess_input(raw_df.copy(), model_config)
@@ -116,22 +220,183 @@ def predict(raw_df: pd.DataFrame, debug: bool = False) -> dict:
         },
     }
 
-    calc_time = time.time() - calc_start
-    calc_time_csv = OUT_DIR / "prediction_time.csv"
-    info = cpuinfo.get_cpu_info()
-    if not calc_time_csv.exists():
-        with open(calc_time_csv, "w", encoding="utf-8") as f:
-            f.write("cpu,calc_time_seconds,date\n")
-    with open(calc_time_csv, "a", encoding="utf-8") as f:
-        f.write(
-            f"{info['brand_raw']} {info['arch']} {info['hz_advertised_friendly']},"
-            f"{calc_time},{time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-        )
+    _observe_latency("risk_predict_seconds", "Risk model inference latency", model_name, models, calc_start)
+
+    return out_dict
+
+
+def _observe_latency(name: str, help_text: str, model_name: str, models: ModelSet, calc_start: float) -> None:
+    metrics.histogram(
+        name, help_text, {"model": model_name, "version": models.version}
+    ).observe(time.perf_counter() - calc_start)
+
+
+def _shadow_compare(model_name: str, rows: list[dict], probs: np.ndarray, models: ModelSet) -> None:
+    """Score the same rows with the shadow model set and record how far it lands from the active one."""
+    shadow = REGISTRY.shadow
+    if shadow is None or shadow.version == models.version or model_name not in shadow.bundles:
+        return
+    labels = {"model": model_name, "active": models.version, "shadow": shadow.version}
+    try:
+        calc_start = time.perf_counter()
+        bundle = shadow.bundles[model_name]
+        shadow_probs = np.asarray(bundle["model"].predict_proba(bundle["encoder"].encode_rows(rows)))[:, 1]
+        _observe_latency("risk_shadow_predict_seconds", "Shadow model inference latency", model_name, shadow, calc_start)
+    except Exception as e:
+        metrics.counter("risk_shadow_errors_total", "Shadow scoring failures", labels).inc()
+        print(f"[WARN] shadow scoring failed for {model_name}: {e}")
+        return
+
+    threshold = float(models.bundles[model_name]["config"]["threshold"])
+    shadow_threshold = float(bundle["config"]["threshold"])
+    diff_hist = metrics.histogram(
+        "risk_shadow_score_diff", "Absolute probability difference, shadow vs active model", labels,
+        buckets=(0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0),
+    )
+    for diff in np.abs(shadow_probs - probs).tolist():
+        diff_hist.observe(diff)
+    disagreements = int(np.count_nonzero((probs >= threshold) != (shadow_probs >= shadow_threshold)))
+    metrics.counter("risk_shadow_rows_total", "Rows scored by the shadow model", labels).inc(len(rows))
+    metrics.counter("risk_shadow_disagreements_total", "Rows where shadow and active risk labels differ", labels).inc(disagreements)
+
+
+def encode_features(features: dict, models: ModelSet | None = None) -> tuple[str, np.ndarray]:
+    """Pick the model for a feature dict and build its final input row."""
+    models = models or REGISTRY.active
+    model_name = choose_model_name_for(features)
+    return model_name, models.bundles[model_name]["encoder"].encode(features)
+
+
+def predict_features(features: dict, debug: bool = False, encoded: tuple[str, np.ndarray] | None = None,
+                     models: ModelSet | None = None) -> dict:
+    """Single-row fast path: same output as predict(pd.DataFrame([features])) without pandas.
+
+    `encoded` must come from encode_features() with the same `models` snapshot.
+    """
+    calc_start = time.perf_counter()
+    models = models or REGISTRY.active
+    model_name, X_ready = encoded if encoded is not None else encode_features(features, models)
+    bundle = models.bundles[model_name]
+    model_config = bundle["config"]
+    prob_pos = float(bundle["model"].predict_proba(X_ready)[0][1])
+    final_prob = round(prob_pos, 4)
+    threshold = float(model_config["threshold"])
+
+    if debug:
+        features_used_values = {feature: features.get(feature) for feature in model_config["features"]}
+    else:
+        features_used_values = None
+
+    out_dict = {
+        "features_used_values": to_py(features_used_values),
+        "ensemble": {
+            "final_prob": final_prob,
+            "risk_text": risk_text_from_prob(final_prob, threshold),
+            "model_name": model_name,
+            "threshold": threshold,
+        },
+    }
+
+    _observe_latency("risk_predict_seconds", "Risk model inference latency", model_name, models, calc_start)
+    _shadow_compare(model_name, [features], np.array([prob_pos]), models)
 
     return out_dict
 
 
+def predict_batch(rows: list[dict], models: ModelSet | None = None) -> list[dict]:
+    """Score many feature dicts with one predict_proba call per model.
+
+    Returns one `ensemble` dict per input row, in input order. When a shadow
+    model set is deployed, the same rows are scored with it for comparison.
+    """
+    models = models or REGISTRY.active
+    groups: dict[str, list[int]] = {}
+    for index, row in enumerate(rows):
+        groups.setdefault(choose_model_name_for(row), []).append(index)
+
+    results: list[dict | None] = [None] * len(rows)
+    for model_name, indices in groups.items():
+        calc_start = time.perf_counter()
+        bundle = models.bundles[model_name]
+        threshold = float(bundle["config"]["threshold"])
+        group_rows = [rows[i] for i in indices]
+        X_ready = bundle["encoder"].encode_rows(group_rows)
+        probs = np.asarray(bundle["model"].predict_proba(X_ready))[:, 1]
+        for index, prob in zip(indices, probs.tolist()):
+            final_prob = round(prob, 4)
+            results[index] = {
+                "final_prob": final_prob,
+                "risk_text": risk_text_from_prob(final_prob, threshold),
+                "model_name": model_name,
+                "threshold": threshold,
+            }
+        _observe_latency("risk_predict_batch_seconds", "Batch risk inference latency per model group",
+                         model_name, models, calc_start)
+        metrics.counter(
+            "risk_predict_batch_rows_total", "Rows scored by batch inference", {"model": model_name, "version": models.version}
+        ).inc(len(indices))
+        _shadow_compare(model_name, group_rows, probs, models)
+    return results
+
+
+def _random_feature_rows(n_rows: int, seed: int = 0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    config = REGISTRY.active.bundles["catboost_10f"]["config"]
+    maps = config["category_maps"]
+    rows = []
+    for _ in range(n_rows):
+        row = {
+            "Age": int(rng.integers(20, 90)),
+            "Sex": str(rng.choice(list(maps["Sex"]))),
+            "ChestPainType": str(rng.choice(list(maps["ChestPainType"]))),
+            "ExerciseAngina": str(rng.choice(list(maps["ExerciseAngina"]))),
+            "RestingECG": str(rng.choice(list(maps["RestingECG"]))),
+            "ST_Slope": str(rng.choice(list(maps["ST_Slope"]))),
+            "MaxHR": float(rng.uniform(60, 202)),
+            "Oldpeak": float(rng.uniform(-2.5, 6.0)),
+            "RestingBP": int(rng.integers(90, 180)),
+            "Cholesterol": int(rng.integers(100, 400)),
+            "FastingBS": int(rng.integers(0, 2)),
+        }
+        # Exercise the 8-feature fallback and imputation paths
+        if rng.random() < 0.3:
+            row["Cholesterol"] = None
+            row["FastingBS"] = None
+        if rng.random() < 0.1:
+            row["MaxHR"] = None
+        rows.append(row)
+    return rows
+
+
+def benchmark_fast_path(n_rows: int = 1000) -> dict:
+    """Check predict_features() against the pandas path and time both."""
+    rows = _random_feature_rows(n_rows)
+    mismatches = 0
+    pandas_s = 0.0
+    fast_s = 0.0
+    for row in rows:
+        start = time.perf_counter()
+        slow = predict(pd.DataFrame([row]))
+        pandas_s += time.perf_counter() - start
+        start = time.perf_counter()
+        fast = predict_features(row)
+        fast_s += time.perf_counter() - start
+        if slow["ensemble"] != fast["ensemble"]:
+            mismatches += 1
+    return {
+        "rows": n_rows,
+        "mismatches": mismatches,
+        "pandas_ms_per_call": pandas_s * 1000.0 / n_rows,
+        "fast_ms_per_call": fast_s * 1000.0 / n_rows,
+        "speedup": pandas_s / fast_s if fast_s else None,
+    }
+
+
 def main():
+    if "--bench" in sys.argv:
+        print(json.dumps(benchmark_fast_path(), indent=2))
+        return
+
     input_csv = OUT_DIR / "model_input_features.csv"
     out_json = OUT_DIR / "prediction_ensemble.json"
 
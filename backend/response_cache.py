@@ -0,0 +1,112 @@
+"""Conditional GET and an in-process response cache for the dashboard reads.
+
+Every write path in database.py calls touch(user_id, table) for the kinds of data
+it changed ("hr", "windows", "health", "profile"). An endpoint's data version is
+the tuple of its tables' counters plus the current TIME_BUCKET_SECONDS bucket
+(chart axes and the summary move with the clock even without writes), so a
+version is known without a query:
+
+- ETag is a hash of (user, endpoint, params, version); a matching If-None-Match
+  (or an If-Modified-Since at or after the last touch) gets a bodyless 304.
+- The serialized JSON body is kept in a TTLCache keyed the same way, so repeat
+  requests from other tabs or after a 304-less reload skip SQLAlchemy as well.
+
+Entries are never invalidated in place: a touch moves the version on and the old
+keys age out of the LRU. Counters live in this process only; the boot time is part
+of every ETag so validators from before a restart never match.
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, jsonify, request
+
+import metrics
+import user_cache
+
+TIME_BUCKET_SECONDS = 60
+CACHE_SIZE = 2048
+
+TABLES = ("hr", "windows", "health", "profile")
+
+_boot = f"{time.time():.6f}"
+_epoch = 0  # bumped by touch_all
+_versions: dict[tuple[int, str], tuple[int, float]] = {}  # (user id, table) -> (counter, last touched)
+_lock = threading.Lock()
+
+responses = user_cache.TTLCache("response", TIME_BUCKET_SECONDS, CACHE_SIZE)
+_not_modified = metrics.counter("http_not_modified_total", "Dashboard reads answered with 304 Not Modified")
+
+
+def touch(user_id: int, *tables: str) -> None:
+    """Record that user_id's data in `tables` changed."""
+    now = time.time()
+    with _lock:
+        for table in tables:
+            counter, _ = _versions.get((user_id, table), (0, 0.0))
+            _versions[(user_id, table)] = (counter + 1, now)
+
+
+def touch_user(user_id: int) -> None:
+    touch(user_id, *TABLES)
+
+
+def touch_all() -> None:
+    """Bulk deletes (database debug tools): every cached response is stale."""
+    global _epoch
+    with _lock:
+        _epoch += 1
+        _versions.clear()
+    responses.clear()
+
+
+def version(user_id: int, tables: tuple) -> tuple[tuple, float]:
+    """(counters, last touched) of user_id's tables; last touched is 0 if never since boot."""
+    with _lock:
+        entries = [_versions.get((user_id, t), (0, 0.0)) for t in tables]
+    return (_epoch, *(c for c, _ in entries)), max((t for _, t in entries), default=0.0)
+
+
+def _is_not_modified(etag: str, last_modified: float) -> bool:
+    # If-None-Match takes precedence; If-Modified-Since only has second resolution
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return since is not None and last_modified <= since.timestamp()
+
+
+def respond(user_id: int, endpoint: str, params: tuple, tables: tuple, compute, use_cache: bool = True):
+    """JSON response for compute(), served from cache or as a 304 when the data version matches.
+
+    With use_cache=False compute() always runs (for reads with side effects), but the
+    response still carries validators and may still be a 304.
+    """
+    # Read the version before computing, so a write that lands meanwhile keeps the entry unreachable
+    counters, touched = version(user_id, tables)
+    bucket = int(time.time() // TIME_BUCKET_SECONDS)
+    last_modified = max(touched, float(_boot), bucket * TIME_BUCKET_SECONDS)
+    key = (user_id, endpoint, params, counters, bucket)
+    etag = hashlib.sha1(repr((_boot, key)).encode()).hexdigest()[:20]
+
+    if use_cache and _is_not_modified(etag, last_modified):
+        _not_modified.inc()
+        return _with_validators(current_app.response_class(status=304), etag, last_modified)
+
+    body = responses.get(key) if use_cache else None
+    if body is None:
+        body = jsonify(compute()).get_data()
+        responses.put(key, body)
+        if not use_cache and _is_not_modified(etag, last_modified):
+            _not_modified.inc()
+            return _with_validators(current_app.response_class(status=304), etag, last_modified)
+    return _with_validators(current_app.response_class(body, mimetype='application/json'), etag, last_modified)
+
+
+def _with_validators(response, etag: str, last_modified: float):
+    response.set_etag(etag, weak=True)
+    response.last_modified = datetime.fromtimestamp(int(last_modified), timezone.utc)
+    # Browsers keep the body but revalidate every time, so a period switch costs a 304
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -1,26 +1,35 @@
-import pandas as pd
-
+import database
 import pan_tompkins_plus_plus.collect_features as cf
 import pan_tompkins_plus_plus.predict as predict
+import risk_cache
+
+def get_model_input(user_id: int, user_info: dict | None = None) -> dict:
+    # Built from the persisted window aggregate into a local dict, so concurrent requests never share state
+    patient_info = cf.DEFAULT_PATIENT_INFO.copy()
+    patient_info.update(user_info if user_info is not None else database.get_model_user_info(user_id))
+    return database.get_window_aggregate(user_id).model_input(patient_info)
+
+def get_cached_health_risk(user_id: int) -> dict | None:
+    return risk_cache.get_fresh(user_id, predict.models_version())
+
+def get_health_risk(user_id: int, seen_generation: int = 0) -> dict:
+    data = get_model_input(user_id)
+    # One snapshot for the whole request, even if the registry swaps models meanwhile
+    models = predict.REGISTRY.active
+    encoded = predict.encode_features(data, models)
 
-def parse_user_info(user_info: dict, df: pd.DataFrame) -> dict:
-    cf.base_patient_info = cf.DEFAULT_PATIENT_INFO.copy()
-    cf.base_patient_info.update(user_info)
-    model_input_feature = cf.collect_features(df)
-    print(model_input_feature)
-    return model_input_feature
+    key = risk_cache.input_key(encoded[0], models.version, encoded[1])
+    cached = risk_cache.lookup(user_id, key, seen_generation)
+    if cached is not None:
+        return cached
 
-def get_health_risk(df: pd.DataFrame, user_info: dict | None = None) -> dict:
-    cf.base_patient_info = cf.DEFAULT_PATIENT_INFO.copy()
-    if user_info:
-        cf.base_patient_info.update(user_info)
-    data = cf.collect_features(df)
-    print(data)
-    result = predict.predict(pd.DataFrame([data]))
-    return {
+    result = predict.predict_features(data, encoded=encoded, models=models)
+    response = {
         "risk_score": result.get("ensemble", {}).get("final_prob", 0) * 100,
         "level": result.get("ensemble", {}).get("risk_text", "未知風險")
     }
+    risk_cache.store(user_id, key, models.version, response, seen_generation)
+    return response
 
 if __name__ == '__main__':
     result = get_health_risk()
@@ -0,0 +1,238 @@
+"""Retention for the time-series tables, run as a periodic background job.
+
+Inserts only append; this job trims each table to its policy (maximum age and/or
+maximum rows per user). Deletes are set-based, per user so they use the
+(user_id, timestamp) indexes, and bounded to BATCH_ROWS rows per transaction so
+the stream writer and request reads are never blocked for long.
+
+HR records are folded into hr_rollups as they are written, so raw rows can be
+deleted after a week while the 30-minute and daily rollups (ROLLUP_MAX_AGE) keep
+the long-range charts.
+
+In shard mode (shards.py) the per-user loops run inside each user's shard, and
+the incremental vacuum runs on every shard file as well as on data.db.
+
+Freed pages stay in the file unless incremental auto-vacuum is enabled. New
+databases get it from database.SQLITE_PRAGMAS; existing files need a one-time
+rewrite with `python retention.py enable-incremental-vacuum`. After that every
+run returns up to VACUUM_PAGES free pages to the filesystem.
+
+    python retention.py run                          # apply every policy once
+    python retention.py enable-incremental-vacuum    # one-time VACUUM into incremental mode
+"""
+import argparse
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import delete, func, select, text
+
+import database
+import metrics
+import response_cache
+import risk_cache
+import shards
+import user_cache
+
+RETENTION_INTERVAL = 300  # seconds between runs
+BATCH_ROWS = 2000
+VACUUM_PAGES = int(os.environ.get('RETENTION_VACUUM_PAGES', '1000'))
+
+_run_seconds = metrics.histogram("retention_run_seconds", "Duration of a retention run", buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60))
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    model: type
+    max_age: timedelta | None = None
+    max_rows_per_user: int | None = None
+
+
+POLICIES = (
+    RetentionPolicy(database.HRRecord, max_age=timedelta(days=7)),
+    RetentionPolicy(database.HealthRecord, max_age=timedelta(days=30)),
+    RetentionPolicy(database.WindowFeature, max_rows_per_user=8192),
+)
+
+
+# How long each hr_rollups resolution is kept (seconds -> age)
+ROLLUP_MAX_AGE = {
+    60: timedelta(days=7),
+    1800: timedelta(days=90),
+    86400: timedelta(days=730),
+}
+
+
+def _deleted_counter(table: str):
+    return metrics.counter("retention_deleted_rows_total", "Rows removed by retention", {"table": table})
+
+
+def _user_ids(model) -> list[int]:
+    if shards.enabled() and model.__tablename__ in shards.SHARDED_TABLES:
+        return shards.user_ids()
+    # DISTINCT over the leading index column is an index-only scan
+    return [row[0] for row in database.db.session.execute(select(model.user_id).distinct()).all()]
+
+
+# Dashboard data kind (response_cache.touch) of each table delete_older_than trims
+_RESPONSE_TABLES = {'hr_records': 'hr', 'health_records': 'health'}
+
+
+def delete_older_than(model, cutoff: datetime, batch_rows: int = BATCH_ROWS) -> int:
+    session = database.db.session
+    deleted = 0
+    changed = set()
+    for uid in _user_ids(model):
+        with shards.use(uid):
+            while True:
+                ids = select(model.id).where(model.user_id == uid, model.timestamp < cutoff).limit(batch_rows)
+                n = session.execute(delete(model).where(model.id.in_(ids.scalar_subquery()))).rowcount
+                session.commit()
+                deleted += n
+                if n > 0:
+                    changed.add(uid)
+                if n < batch_rows:
+                    break
+    # Risk scores and cached profiles may have been built from the deleted rows
+    for uid in changed:
+        risk_cache.invalidate(uid)
+        user_cache.forget_user(uid)
+        if model.__tablename__ in _RESPONSE_TABLES:
+            response_cache.touch(uid, _RESPONSE_TABLES[model.__tablename__])
+    return deleted
+
+
+def _users_over(model, max_rows: int) -> list[int]:
+    over_limit = select(model.user_id).group_by(model.user_id).having(func.count() > max_rows)
+    if shards.enabled() and model.__tablename__ in shards.SHARDED_TABLES:
+        over = []
+        for uid in shards.user_ids():
+            with shards.use(uid):
+                over += [row[0] for row in database.db.session.execute(over_limit).all()]
+        return over
+    return [row[0] for row in database.db.session.execute(over_limit).all()]
+
+
+def trim_rows_per_user(model, max_rows: int, batch_rows: int = BATCH_ROWS) -> int:
+    deleted = 0
+    for uid in _users_over(model, max_rows):
+        if model is database.WindowFeature:
+            # Window deletes also have to be subtracted from the user's persisted aggregate
+            while (n := database.prune_window_features(uid, max_rows, batch_rows)) > 0:
+                deleted += n
+        else:
+            with shards.use(uid):
+                while True:
+                    keep = select(model.id).where(model.user_id == uid)\
+                        .order_by(model.timestamp.desc(), model.id.desc()).limit(max_rows)
+                    ids = select(model.id).where(model.user_id == uid, model.id.not_in(keep.scalar_subquery()))\
+                        .limit(batch_rows)
+                    n = database.db.session.execute(delete(model).where(model.id.in_(ids.scalar_subquery()))).rowcount
+                    database.db.session.commit()
+                    deleted += n
+                    if n < batch_rows:
+                        break
+    return deleted
+
+
+def delete_old_rollups(max_age: dict = ROLLUP_MAX_AGE) -> int:
+    HRRollup = database.HRRollup
+    session = database.db.session
+    now = datetime.now()
+    deleted = 0
+    for uid in _user_ids(HRRollup):
+        with shards.use(uid):
+            for resolution, age in max_age.items():
+                # A primary-key range per user and resolution; one run's worth is a handful of rows
+                cutoff = database.hr_bucket(now - age, resolution)
+                deleted += session.execute(delete(HRRollup).where(
+                    HRRollup.user_id == uid, HRRollup.resolution == resolution, HRRollup.bucket < cutoff
+                )).rowcount
+            session.commit()
+    return deleted
+
+
+def incremental_vacuum(pages: int = VACUUM_PAGES, engine=None) -> int:
+    """Release up to `pages` free pages; returns pages released (0 unless auto_vacuum=INCREMENTAL)."""
+    engine = engine or database.db.engine
+    if pages <= 0:
+        return 0
+    raw = engine.raw_connection()
+    try:
+        conn = raw.driver_connection
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        # The pragma frees one page per step and sqlite3's execute() only steps once;
+        # executescript() runs it to completion
+        conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+        return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    finally:
+        raw.close()
+
+
+def run_once(policies: tuple = POLICIES, vacuum_pages: int = VACUUM_PAGES) -> dict:
+    start = time.perf_counter()
+    result = {}
+    # Raw HR rows must be in the rollups before they are deleted (only does work on an upgraded database)
+    database.ensure_hr_rollups()
+    for policy in policies:
+        table = policy.model.__tablename__
+        deleted = 0
+        if policy.max_age is not None:
+            deleted += delete_older_than(policy.model, datetime.now() - policy.max_age)
+        if policy.max_rows_per_user is not None:
+            deleted += trim_rows_per_user(policy.model, policy.max_rows_per_user)
+        _deleted_counter(table).inc(deleted)
+        result[table] = deleted
+    deleted = delete_old_rollups()
+    _deleted_counter(database.HRRollup.__tablename__).inc(deleted)
+    result[database.HRRollup.__tablename__] = deleted
+    result["vacuumed_pages"] = incremental_vacuum(vacuum_pages)
+    for uid in shards.user_ids():
+        result["vacuumed_pages"] += incremental_vacuum(vacuum_pages, shards.engine_for(uid))
+    elapsed = time.perf_counter() - start
+    _run_seconds.observe(elapsed)
+    result["seconds"] = round(elapsed, 3)
+    return result
+
+
+def retention_loop(app: Flask, interval: int = RETENTION_INTERVAL) -> None:
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                run_once()
+            except Exception as e:
+                database.db.session.rollback()
+                print(f"Retention run failed: {e}")
+
+
+def enable_incremental_vacuum() -> None:
+    session = database.db.session
+    session.execute(text('PRAGMA auto_vacuum=INCREMENTAL'))
+    session.commit()
+    # VACUUM cannot run inside a transaction
+    with database.db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text('VACUUM'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time-series retention')
+    parser.add_argument('command', choices=['run', 'enable-incremental-vacuum'])
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(data_dir, "data.db")}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLITE_SHARD_DIR'] = os.environ.get('SQLITE_SHARD_DIR')
+    database.init_db(app)
+    with app.app_context():
+        if args.command == 'run':
+            print(run_once())
+        else:
+            enable_incremental_vacuum()
+            print("auto_vacuum=INCREMENTAL enabled")
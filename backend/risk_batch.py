@@ -0,0 +1,149 @@
+"""Batch risk scoring for every user.
+
+Inputs are loaded per batch of users with three bulk queries (profiles, latest
+health record, persisted window aggregates). Rows are grouped by model inside
+predict.predict_batch, so each batch costs one predict_proba call per model.
+Results are appended to the risk_history table.
+
+    python risk_batch.py run            # score every user in data/data.db
+    python risk_batch.py bench 10000    # throughput on N synthetic users (in-memory DB)
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import insert
+
+import database
+import metrics
+import pan_tompkins_plus_plus.collect_features as cf
+import pan_tompkins_plus_plus.predict as predict
+
+BATCH_USERS = 500
+NIGHTLY_HOUR = 3  # local time
+
+_users_scored = metrics.counter("risk_batch_users_total", "Users scored by the batch risk job")
+_batch_seconds = metrics.histogram("risk_batch_seconds", "Duration of a full batch risk run", buckets=(1, 5, 15, 60, 300, 900, 3600))
+
+
+def build_model_inputs(user_ids: list[int]) -> list[dict]:
+    user_infos = database.get_model_user_infos(user_ids)
+    aggregates = database.get_window_aggregates(user_ids)
+    rows = []
+    for uid in user_ids:
+        patient_info = cf.DEFAULT_PATIENT_INFO.copy()
+        patient_info.update(user_infos[uid])
+        rows.append(aggregates[uid].model_input(patient_info))
+    return rows
+
+
+def score_users(user_ids: list[int], source: str = "batch") -> list[dict]:
+    results = predict.predict_batch(build_model_inputs(user_ids))
+    now = datetime.now()
+    history = [{
+        "user_id": uid,
+        "risk_score": result["final_prob"] * 100,
+        "level": result["risk_text"],
+        "model_name": result["model_name"],
+        "source": source,
+        "timestamp": now,
+    } for uid, result in zip(user_ids, results)]
+    database.add_risk_history(history)
+    _users_scored.inc(len(history))
+    return history
+
+
+def score_all_users(batch_size: int = BATCH_USERS, source: str = "batch") -> dict:
+    start = time.perf_counter()
+    user_ids = database.get_all_user_ids()
+    for i in range(0, len(user_ids), batch_size):
+        score_users(user_ids[i : i + batch_size], source)
+    elapsed = time.perf_counter() - start
+    _batch_seconds.observe(elapsed)
+    return {
+        "users": len(user_ids),
+        "seconds": round(elapsed, 3),
+        "users_per_s": round(len(user_ids) / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def _seconds_until(hour: int) -> float:
+    now = datetime.now()
+    next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+def nightly_loop(app: Flask, hour: int = NIGHTLY_HOUR) -> None:
+    while True:
+        time.sleep(_seconds_until(hour))
+        with app.app_context():
+            try:
+                print(f"Nightly risk batch finished: {score_all_users()}")
+            except Exception as e:
+                print(f"Nightly risk batch failed: {e}")
+
+
+# ==================== Benchmark ====================
+
+def _seed_synthetic_users(n_users: int, windows_per_user: int) -> None:
+    rng = random.Random(0)
+    now = datetime.now()
+    users, profiles, health, windows = [], [], [], []
+    for uid in range(1, n_users + 1):
+        users.append({"id": uid, "google_id": f"g{uid}", "email": f"u{uid}@example.com",
+                      "name": f"user {uid}", "api_token": f"token-{uid}", "profile_completed": True})
+        profiles.append({"user_id": uid, "sex": rng.choice("MF"), "age": rng.randint(20, 85),
+                         "chest_pain_type": rng.choice(["ASY", "ATA", "NAP", "TA"]),
+                         "exercise_angina": rng.random() < 0.3, "resting_ecg": rng.random() < 0.1})
+        if rng.random() < 0.7:
+            health.append({"user_id": uid, "resting_bp": rng.randint(100, 170),
+                           "cholesterol": rng.randint(150, 320), "fasting_bs": rng.random() < 0.2, "timestamp": now})
+        for w in range(windows_per_user):
+            mode = "exercise_ecg_data_" if w % 3 == 0 else "rest_ecg_data_"
+            windows.append({"user_id": uid, "file": mode, "fs_hz": 160.0,
+                            "max_hr": rng.uniform(60, 190), "avg_hr": rng.uniform(55, 150),
+                            "st_label": rng.choice(["Up", "Flat", "Down"]), "oldpeak": rng.uniform(-0.5, 2.5),
+                            "resting_ecg": rng.choice(["Normal", "ST"]), "calc_time": 0.01,
+                            "timestamp": now - timedelta(seconds=10 * w)})
+    session = database.db.session
+    session.execute(insert(database.User), users)
+    session.execute(insert(database.UserProfile), profiles)
+    session.execute(insert(database.HealthRecord), health)
+    session.execute(insert(database.WindowFeature), windows)
+    session.commit()
+    # Bulk-inserted windows bypass add_window_feature, so fold them into aggregates once
+    database.rebuild_window_aggregates()
+
+
+def benchmark(n_users: int, windows_per_user: int = 30) -> dict:
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    database.init_db(app)
+    with app.app_context():
+        _seed_synthetic_users(n_users, windows_per_user)
+        return score_all_users()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch risk scoring')
+    parser.add_argument('command', choices=['run', 'bench'])
+    parser.add_argument('n_users', type=int, nargs='?', default=10000, help='Synthetic users for bench')
+    parser.add_argument('--windows', type=int, default=30, help='Window features per synthetic user')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        print(benchmark(args.n_users, args.windows))
+    else:
+        app = Flask(__name__)
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(data_dir, "data.db")}'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        database.init_db(app)
+        with app.app_context():
+            print(score_all_users(source='manual'))
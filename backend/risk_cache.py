@@ -0,0 +1,80 @@
+import hashlib
+import threading
+
+import numpy as np
+
+import metrics
+
+# user_id -> {"key": input hash, "version": model set version, "result": response, "valid": bool}
+# Writes that change a user's model inputs only mark the entry stale; if the recomputed
+# input vector hashes to the same key the stored result is reused without running the model.
+_entries: dict[int, dict] = {}
+# Bumped on every invalidation so a result computed from pre-write data is never marked fresh
+_generations: dict[int, int] = {}
+_lock = threading.Lock()
+
+_hit = metrics.counter("risk_cache_requests_total", "Risk cache lookups", {"result": "hit"})
+_revalidated = metrics.counter("risk_cache_requests_total", "Risk cache lookups", {"result": "revalidated"})
+_miss = metrics.counter("risk_cache_requests_total", "Risk cache lookups", {"result": "miss"})
+_invalidations = metrics.counter("risk_cache_invalidations_total", "Risk cache invalidations caused by writes")
+
+
+def input_key(model_name: str, model_version: str, model_input: np.ndarray) -> str:
+    digest = hashlib.sha1(f"{model_name}|{model_version}|".encode("utf-8"))
+    digest.update(np.ascontiguousarray(model_input, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def generation(user_id: int) -> int:
+    return _generations.get(user_id, 0)
+
+
+def get_fresh(user_id: int, model_version: str) -> dict | None:
+    entry = _entries.get(user_id)
+    if entry is not None and entry["valid"] and entry["version"] == model_version:
+        _hit.inc()
+        return entry["result"]
+    return None
+
+
+def lookup(user_id: int, key: str, seen_generation: int) -> dict | None:
+    entry = _entries.get(user_id)
+    if entry is not None and entry["key"] == key:
+        _revalidated.inc()
+        with _lock:
+            entry["valid"] = seen_generation == generation(user_id)
+        return entry["result"]
+    _miss.inc()
+    return None
+
+
+def store(user_id: int, key: str, model_version: str, result: dict, seen_generation: int) -> None:
+    with _lock:
+        _entries[user_id] = {
+            "key": key,
+            "version": model_version,
+            "result": result,
+            "valid": seen_generation == generation(user_id),
+        }
+
+
+def invalidate(user_id: int) -> None:
+    with _lock:
+        _generations[user_id] = generation(user_id) + 1
+        entry = _entries.get(user_id)
+        if entry is not None:
+            entry["valid"] = False
+    _invalidations.inc()
+
+
+def remove(user_id: int) -> None:
+    with _lock:
+        _entries.pop(user_id, None)
+        _generations[user_id] = generation(user_id) + 1
+
+
+def clear() -> None:
+    with _lock:
+        _entries.clear()
+        for user_id in _generations:
+            _generations[user_id] += 1
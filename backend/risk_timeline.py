@@ -0,0 +1,182 @@
+"""Per-user risk timeline.
+
+Each user's rest/exercise aggregates are kept up to date by
+database.add_window_feature, which also marks the user through on_window. At
+every TIMELINE_INTERVAL boundary the marked users' aggregates are read in one
+query, scored together with predict.predict_batch and one point per user is
+upserted into the risk_timeline table. backfill() builds points for already stored windows by
+replaying them once in time order and snapshotting at each interval boundary,
+instead of re-running collect_features over all windows for every point.
+
+    python risk_timeline.py backfill [--user_id N]   # rebuild points from data/data.db
+    python risk_timeline.py bench                    # replay vs collect_features per point
+"""
+import argparse
+import os
+import threading
+import time
+
+import pandas as pd
+from flask import Flask
+
+import database
+import pan_tompkins_plus_plus.collect_features as cf
+import pan_tompkins_plus_plus.predict as predict
+
+TIMELINE_INTERVAL = 300  # seconds between points
+BACKFILL_USERS = 200     # users replayed per predict_batch call
+
+# Users that received windows since the last scoring pass
+_dirty: set[int] = set()
+_lock = threading.Lock()
+
+
+def on_window(user_id: int) -> None:
+    if user_id < 0:
+        return
+    with _lock:
+        _dirty.add(user_id)
+
+
+def forget(user_id: int) -> None:
+    with _lock:
+        _dirty.discard(user_id)
+
+
+def clear() -> None:
+    with _lock:
+        _dirty.clear()
+
+
+def _patient_infos(user_ids: list[int]) -> dict[int, dict]:
+    infos = {}
+    for uid, info in database.get_model_user_infos(user_ids).items():
+        patient_info = cf.DEFAULT_PATIENT_INFO.copy()
+        patient_info.update(info)
+        infos[uid] = patient_info
+    return infos
+
+
+def _points(user_ids: list[int], timestamps: list[int], inputs: list[dict]) -> list[dict]:
+    results = predict.predict_batch(inputs)
+    return [{"user_id": uid, "ts": ts, "score": int(round(result["final_prob"] * 10000))}
+            for uid, ts, result in zip(user_ids, timestamps, results)]
+
+
+def score_pending(ts: int | None = None) -> int:
+    """Score every user that received windows since the last call; returns points written."""
+    if ts is None:
+        ts = int(time.time()) // TIMELINE_INTERVAL * TIMELINE_INTERVAL
+    with _lock:
+        user_ids = sorted(_dirty)
+        _dirty.clear()
+    if not user_ids:
+        return 0
+    patient_infos = _patient_infos(user_ids)
+    aggregates = database.get_window_aggregates(user_ids)
+    inputs = [aggregates[uid].model_input(patient_infos[uid]) for uid in user_ids]
+    points = _points(user_ids, [ts] * len(user_ids), inputs)
+    database.add_risk_points(points)
+    return len(points)
+
+
+def _replay_points(user_id: int, patient_info: dict, interval: int) -> tuple[list[int], list[dict]]:
+    """Replay a user's windows oldest first; one model input per interval that has windows."""
+    agg = cf.WindowAggregate()
+    timestamps, inputs = [], []
+    boundary = None
+    for r in database.get_window_features_since(user_id):
+        window_boundary = (int(r.timestamp.timestamp()) // interval + 1) * interval
+        if boundary is not None and window_boundary != boundary:
+            timestamps.append(boundary)
+            inputs.append(agg.model_input(patient_info))
+        boundary = window_boundary
+        agg.add(r.file, r.max_hr, r.oldpeak, r.resting_ecg, r.st_label)
+    if boundary is not None:
+        timestamps.append(boundary)
+        inputs.append(agg.model_input(patient_info))
+    return timestamps, inputs
+
+
+def backfill(user_ids: list[int] | None = None, interval: int = TIMELINE_INTERVAL) -> dict:
+    """Rebuild timeline points from stored windows (current profile for every point)."""
+    start = time.perf_counter()
+    if user_ids is None:
+        user_ids = database.get_all_user_ids()
+    n_points = 0
+    for i in range(0, len(user_ids), BACKFILL_USERS):
+        batch = user_ids[i : i + BACKFILL_USERS]
+        patient_infos = _patient_infos(batch)
+        point_users, timestamps, inputs = [], [], []
+        for uid in batch:
+            user_ts, user_inputs = _replay_points(uid, patient_infos[uid], interval)
+            point_users += [uid] * len(user_ts)
+            timestamps += user_ts
+            inputs += user_inputs
+        points = _points(point_users, timestamps, inputs)
+        database.add_risk_points(points)
+        n_points += len(points)
+    return {"users": len(user_ids), "points": n_points, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def timeline_loop(app: Flask, interval: int = TIMELINE_INTERVAL) -> None:
+    while True:
+        boundary = (int(time.time()) // interval + 1) * interval
+        time.sleep(max(boundary - time.time(), 0))
+        with app.app_context():
+            try:
+                score_pending(boundary)
+            except Exception as e:
+                print(f"Risk timeline scoring failed: {e}")
+
+
+# ==================== Benchmark ====================
+
+def benchmark(windows: int = 8192, interval: int = TIMELINE_INTERVAL) -> dict:
+    """One user with `windows` 10 s windows: replay backfill vs collect_features per point."""
+    import risk_batch
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    database.init_db(app)
+    with app.app_context():
+        risk_batch._seed_synthetic_users(1, windows)
+        result = backfill([1], interval)
+
+        start = time.perf_counter()
+        patient_info = _patient_infos([1])[1]
+        rows = database.get_window_features_since(1)
+        df = pd.DataFrame(rows, columns=['file', 'max_hr', 'oldpeak', 'resting_ecg', 'st_label', 'timestamp', 'id'])
+        boundaries = df['timestamp'].map(lambda t: (int(t.timestamp()) // interval + 1) * interval)
+        for boundary in boundaries.unique():
+            # What a per-point recompute costs: aggregate every window up to the point, newest first
+            window_df = df[boundaries <= boundary].iloc[::-1].reset_index(drop=True)
+            predict.predict_features(cf.collect_features(window_df, patient_info=patient_info))
+        naive_s = time.perf_counter() - start
+    return {
+        "windows": windows,
+        "points": result["points"],
+        "backfill_s": result["seconds"],
+        "collect_features_per_point_s": round(naive_s, 3),
+        "speedup": round(naive_s / result["seconds"], 1) if result["seconds"] else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Risk timeline')
+    parser.add_argument('command', choices=['backfill', 'bench'])
+    parser.add_argument('--user_id', type=int, help='Only backfill this user')
+    parser.add_argument('--windows', type=int, default=8192, help='Window features for bench')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        print(benchmark(args.windows))
+    else:
+        app = Flask(__name__)
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(data_dir, "data.db")}'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        database.init_db(app)
+        with app.app_context():
+            print(backfill([args.user_id] if args.user_id is not None else None))
@@ -0,0 +1,264 @@
+"""Optional per-user SQLite shards for the streamed time-series tables.
+
+With SQLITE_SHARD_DIR set, every user's hr_records, hr_rollups, window_features
+and window_aggregates rows live in <dir>/user_<id>.db instead of data.db; users,
+profiles, health records and the risk tables stay in the main database. Each
+shard file has its own write lock, so devices streaming for different users
+commit in parallel instead of queueing behind one writer.
+
+Routing is per statement: database.ShardedSession sends a statement on a sharded
+table to the engine of the user selected with `with shards.use(user_id):`, and
+everything else to the main database. Every shard gets its own small connection
+pool; at most MAX_OPEN_SHARDS engines stay open, least recently used first out.
+
+    python shards.py list           # rows and file size per shard
+    python shards.py migrate        # create missing tables and indexes in every shard
+    python shards.py import-main    # move time-series rows from data.db into the shards
+    python shards.py rebuild        # rebuild HR rollups and window aggregates in every shard
+    python shards.py vacuum         # VACUUM every shard
+"""
+import argparse
+import contextvars
+import glob
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import Flask
+from sqlalchemy import create_engine, delete, func, inspect, select, text
+from sqlalchemy.sql.util import find_tables
+
+SHARDED_TABLES = frozenset({'hr_records', 'hr_rollups', 'window_features', 'window_aggregates'})
+MAX_OPEN_SHARDS = int(os.environ.get('SQLITE_MAX_OPEN_SHARDS', '256'))
+POOL_SIZE = 2      # connections kept open per shard
+MAX_OVERFLOW = 8   # extra connections a shard may open under load
+
+shard_dir = None   # None: sharding off, set by configure()
+_pragmas = ()
+_engines: OrderedDict = OrderedDict()  # user id -> Engine, least recently used first
+_engines_lock = threading.Lock()
+_current_user = contextvars.ContextVar('shard_user', default=None)
+
+_FILE_RE = re.compile(r'^user_(-?\d+)\.db$')
+
+
+def configure(directory: str | None, pragmas: tuple = ()) -> None:
+    """Turn shard mode on (directory) or off (None); called by database.init_db."""
+    global shard_dir, _pragmas
+    dispose_all()
+    shard_dir = directory
+    _pragmas = pragmas
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def enabled() -> bool:
+    return shard_dir is not None
+
+
+@contextmanager
+def use(user_id: int):
+    """Route statements on the sharded tables to user_id's shard inside the block."""
+    token = _current_user.set(user_id)
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
+def current_user() -> int | None:
+    return _current_user.get()
+
+
+def is_sharded(mapper=None, clause=None) -> bool:
+    """True if the mapper or statement reads or writes a sharded table."""
+    if mapper is not None:
+        return inspect(mapper).local_table.name in SHARDED_TABLES
+    if clause is not None:
+        return any(t.name in SHARDED_TABLES for t in find_tables(clause, include_crud=True, include_aliases=True))
+    return False
+
+
+# ==================== Shard Files ====================
+
+def shard_path(user_id: int) -> str:
+    return os.path.join(shard_dir, f'user_{user_id}.db')
+
+
+def exists(user_id: int) -> bool:
+    return enabled() and os.path.exists(shard_path(user_id))
+
+
+def user_ids() -> list[int]:
+    """Users that have a shard file (empty when sharding is off)."""
+    if not enabled():
+        return []
+    matches = (_FILE_RE.match(os.path.basename(p)) for p in glob.glob(os.path.join(shard_dir, 'user_*.db')))
+    return sorted(int(m.group(1)) for m in matches if m)
+
+
+def _open(user_id: int):
+    import database
+
+    engine = create_engine(f'sqlite:///{shard_path(user_id)}', pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+    database.apply_sqlite_pragmas(engine, _pragmas)
+    # Creates the file on first use; the users foreign keys are not enforced by SQLite
+    database.db.metadata.create_all(engine, tables=[database.db.metadata.tables[n] for n in SHARDED_TABLES])
+    return engine
+
+
+def engine_for(user_id: int):
+    with _engines_lock:
+        engine = _engines.get(user_id)
+        if engine is not None:
+            _engines.move_to_end(user_id)
+            return engine
+        engine = _engines[user_id] = _open(user_id)
+        while len(_engines) > MAX_OPEN_SHARDS:
+            # Connections still checked out by a session are closed when it returns them
+            _engines.popitem(last=False)[1].dispose()
+        return engine
+
+
+def dispose_all() -> None:
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def drop(user_id: int) -> None:
+    """Delete a user's shard file (with its WAL files)."""
+    if not enabled():
+        return
+    with _engines_lock:
+        engine = _engines.pop(user_id, None)
+        if engine is not None:
+            engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        path = shard_path(user_id) + suffix
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def drop_all() -> None:
+    for uid in user_ids():
+        drop(uid)
+
+
+# ==================== Cross-Shard Admin ====================
+
+def shard_stats() -> list[dict]:
+    import database
+
+    stats = []
+    for uid in user_ids():
+        with use(uid):
+            stats.append({
+                "user_id": uid,
+                "hr_records": database.db.session.scalar(select(func.count()).select_from(database.HRRecord)),
+                "window_features": database.db.session.scalar(select(func.count()).select_from(database.WindowFeature)),
+                "size_mb": round(sum(os.path.getsize(p) for p in (shard_path(uid), shard_path(uid) + '-wal')
+                                    if os.path.exists(p)) / 1e6, 2),
+            })
+    database.db.session.commit()
+    return stats
+
+
+def migrate_all() -> int:
+    """Create tables and indexes missing from any shard; returns indexes created."""
+    import database
+
+    created = 0
+    for uid in user_ids():
+        engine = engine_for(uid)  # creates missing tables
+        inspector = inspect(engine)
+        for name in SHARDED_TABLES:
+            existing = {ix['name'] for ix in inspector.get_indexes(name)}
+            for index in database.db.metadata.tables[name].indexes:
+                if index.name not in existing:
+                    index.create(bind=engine)
+                    created += 1
+    return created
+
+
+def import_main(page_rows: int = 50000) -> dict:
+    """Move every user's time-series rows from the main database into their shards.
+
+    Rows go through database.write_stream_batch, so the shard rollups and window
+    aggregates are rebuilt as they are copied; the main rows of a user are deleted
+    once all of them are in the shard.
+    """
+    import database
+
+    HRRecord, WindowFeature = database.HRRecord, database.WindowFeature
+    session = database.db.session
+    moved = {"hr_records": 0, "window_features": 0}
+    uids = sorted({r[0] for r in session.execute(select(HRRecord.user_id).distinct())}
+                  | {r[0] for r in session.execute(select(WindowFeature.user_id).distinct())})
+    for uid in uids:
+        for model, key in ((HRRecord, "hr_rows"), (WindowFeature, "window_rows")):
+            columns = [c for c in model.__table__.columns if c.key != 'id']
+            # A separate connection, since every write_stream_batch commits the session
+            with database.db.engine.connect() as conn:
+                result = conn.execution_options(yield_per=page_rows).execute(
+                    select(*columns).where(model.user_id == uid).order_by(model.timestamp, model.id)
+                )
+                for page in result.partitions():
+                    database.write_stream_batch(**{key: [dict(r._mapping) for r in page]})
+                    moved[model.__tablename__] += len(page)
+        for model in (HRRecord, database.HRRollup, WindowFeature, database.WindowAggregateState):
+            session.execute(delete(model).where(model.user_id == uid))
+        session.commit()
+    return moved
+
+
+def rebuild_all() -> dict:
+    import database
+
+    rollups = aggregates = 0
+    for uid in user_ids():
+        with use(uid):
+            rollups += database.rebuild_hr_rollups()
+            aggregates += database.rebuild_window_aggregates()
+    return {"hr_rollups": rollups, "window_aggregates": aggregates}
+
+
+def vacuum_all() -> int:
+    for uid in user_ids():
+        # VACUUM cannot run inside a transaction
+        with engine_for(uid).connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text('VACUUM'))
+    return len(user_ids())
+
+
+if __name__ == '__main__':
+    import database
+
+    parser = argparse.ArgumentParser(description='Per-user SQLite shards')
+    parser.add_argument('command', choices=['list', 'migrate', 'import-main', 'rebuild', 'vacuum'])
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(data_dir, "data.db")}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLITE_SHARD_DIR'] = os.environ.get('SQLITE_SHARD_DIR') or os.path.join(data_dir, 'shards')
+    database.init_db(app)
+    with app.app_context():
+        if args.command == 'list':
+            stats = shard_stats()
+            for s in stats:
+                print(f"user {s['user_id']:<6} {s['hr_records']:>10} hr {s['window_features']:>10} windows "
+                      f"{s['size_mb']:>10.2f} MB")
+            print(f"{len(stats)} shards in {shard_dir}")
+        elif args.command == 'migrate':
+            print(f"Created {migrate_all()} indexes in {len(user_ids())} shards")
+        elif args.command == 'import-main':
+            print(import_main())
+        elif args.command == 'rebuild':
+            print(rebuild_all())
+        elif args.command == 'vacuum':
+            print(f"Vacuumed {vacuum_all()} shards")
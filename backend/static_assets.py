@@ -0,0 +1,146 @@
+"""Fingerprinted, precompressed frontend files, built once at startup.
+
+build() reads every file under frontend/ into memory and keeps, next to the raw
+bytes, a gzip (and, if the brotli package is installed, a brotli) variant when it
+is smaller. Each file is also published under a fingerprinted name
+(js/app.js -> js/app.<hash>.js) and index.html's local src/href references are
+rewritten to those names, so:
+
+- fingerprinted files are cached by the browser for a year (immutable) and a
+  repeat visit only revalidates index.html;
+- index.html and the plain names get a strong ETag per encoding and no-cache,
+  so revalidation is a bodyless 304.
+
+Edits to frontend/ are picked up on the next restart.
+
+    python static_assets.py list    # names and raw / gzip / brotli sizes
+"""
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import current_app, request
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+INDEX = 'index.html'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+MIN_COMPRESS_BYTES = 256  # below this the headers outweigh the saving
+
+_REFERENCE_RE = re.compile(r'((?:src|href)=")/?([^":?#]+)(")')
+
+_sent = {enc: metrics.counter("static_bytes_sent_total", "Frontend bytes sent", {"encoding": enc})
+         for enc in ("br", "gzip", "identity")}
+
+
+class Asset:
+    def __init__(self, data: bytes, mimetype: str, immutable: bool):
+        self.digest = hashlib.sha1(data).hexdigest()[:10]
+        self.mimetype = mimetype
+        self.cache_control = IMMUTABLE if immutable else REVALIDATE
+        self.variants = {'identity': data}  # encoding -> body
+        if len(data) >= MIN_COMPRESS_BYTES:
+            for encoding, compress in (('br', brotli and (lambda d: brotli.compress(d, quality=11))),
+                                       ('gzip', lambda d: gzip.compress(d, 9, mtime=0))):
+                if compress:
+                    body = compress(data)
+                    if len(body) < len(data):
+                        self.variants[encoding] = body
+
+
+assets: dict[str, Asset] = {}  # URL path without the leading slash -> asset
+
+
+def fingerprinted(name: str, digest: str) -> str:
+    root, ext = os.path.splitext(name)
+    return f'{root}.{digest}{ext}'
+
+
+def build(frontend_dir: str) -> dict[str, Asset]:
+    """Load frontend_dir into `assets`; returns it (empty if the directory is missing)."""
+    files = {}
+    for dirpath, _, filenames in os.walk(frontend_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            files[os.path.relpath(path, frontend_dir).replace(os.sep, '/')] = path
+
+    built = {}
+    names = {}  # plain name -> fingerprinted name
+    for name, path in files.items():
+        if name == INDEX:
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        built[name] = Asset(data, mimetype, immutable=False)
+        names[name] = fingerprinted(name, built[name].digest)
+        built[names[name]] = Asset(data, mimetype, immutable=True)
+
+    if INDEX in files:
+        with open(files[INDEX], encoding='utf-8') as f:
+            html = f.read()
+        # Only local files that exist are rewritten; /_sdk/, CDN and absolute URLs stay as they are
+        html = _REFERENCE_RE.sub(lambda m: m.group(1) + '/' + names[m.group(2)] + m.group(3)
+                                 if m.group(2) in names else m.group(0), html)
+        built[INDEX] = Asset(html.encode('utf-8'), 'text/html', immutable=False)
+
+    assets.clear()
+    assets.update(built)
+    return assets
+
+
+def _encoding(asset: Asset) -> str:
+    for encoding in ('br', 'gzip'):
+        if encoding in asset.variants and request.accept_encodings[encoding]:
+            return encoding
+    return 'identity'
+
+
+def serve(name: str):
+    """Response for the asset at URL path `name`, or None if there is none."""
+    asset = assets.get(name)
+    if asset is None:
+        return None
+    encoding = _encoding(asset)
+    body = asset.variants[encoding]
+    response = current_app.response_class(body, mimetype=asset.mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = asset.cache_control
+    # One strong validator per encoding, since the bytes differ
+    response.set_etag(f'{asset.digest}-{encoding}')
+    response = response.make_conditional(request)
+    if response.status_code == 200:
+        _sent[encoding].inc(len(body))
+    return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fingerprinted, precompressed frontend files')
+    parser.add_argument('command', choices=['list'])
+    parser.add_argument('--frontend', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend'))
+    args = parser.parse_args()
+
+    total = {'identity': 0, 'gzip': 0, 'br': 0}
+    for name, asset in sorted(build(args.frontend).items()):
+        if asset.cache_control == REVALIDATE and name != INDEX:
+            continue  # the plain name of a fingerprinted file
+        # What a client accepting each encoding (and the ones before it) is sent
+        sizes = {'identity': len(asset.variants['identity'])}
+        sizes['gzip'] = len(asset.variants.get('gzip', asset.variants['identity']))
+        sizes['br'] = len(asset.variants['br']) if 'br' in asset.variants else sizes['gzip']
+        for enc in total:
+            total[enc] += sizes[enc]
+        print(f"{name:<32} {sizes['identity']:>8} raw {sizes['gzip']:>8} gzip {sizes['br']:>8} br")
+    print(f"{'total':<32} {total['identity']:>8} raw {total['gzip']:>8} gzip {total['br']:>8} br"
+          + ("" if brotli else "  (brotli not installed)"))
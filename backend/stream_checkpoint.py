@@ -0,0 +1,40 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# Checkpoints are a single .npz: numeric buffers as typed arrays, everything else as
+# one JSON blob stored in a uint8 array. Writes go to a temp file and are renamed so a
+# crash mid-write never leaves a truncated checkpoint behind.
+_META_KEY = "__meta__"
+
+
+def save_checkpoint(path: str, arrays: dict[str, np.ndarray], meta: dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    meta = dict(meta, saved_at=time.time())
+    payload = {key: np.asarray(value) for key, value in arrays.items()}
+    payload[_META_KEY] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **payload)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str, max_age_s: float) -> tuple[dict[str, np.ndarray], dict] | None:
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            meta = json.loads(bytes(data[_META_KEY]).decode("utf-8"))
+            arrays = {key: data[key] for key in data.files if key != _META_KEY}
+    except Exception as e:
+        print(f"Ignoring unreadable checkpoint {path}: {e}")
+        return None
+
+    age = time.time() - float(meta.get("saved_at", 0))
+    if age > max_age_s:
+        print(f"Ignoring stale checkpoint {path} ({age:.0f}s old)")
+        return None
+    return arrays, meta
@@ -0,0 +1,75 @@
+"""In-process LRU + TTL caches for per-request user lookups.
+
+- tokens:   API token -> the user dict login.check_auth returns
+- profiles: user id   -> database.get_model_user_info() (profile + latest health record)
+
+Entries hold plain dicts, never ORM objects, so they are safe to share between
+requests. Writes that change a user (update_userdata, add_health_record,
+delete_user_by_id) call forget_user(); the TTL bounds staleness for anything else
+(e.g. retention removing an old health record).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+CACHE_SIZE = 1024
+TOKEN_TTL = 300    # seconds
+PROFILE_TTL = 300  # seconds
+
+
+class TTLCache:
+    def __init__(self, name: str, ttl: float, max_entries: int = CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._hit = metrics.counter("user_cache_requests_total", "User cache lookups", {"cache": name, "result": "hit"})
+        self._miss = metrics.counter("user_cache_requests_total", "User cache lookups", {"cache": name, "result": "miss"})
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._hit.inc()
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+        self._miss.inc()
+        return None
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def remove(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def remove_where(self, predicate) -> None:
+        with self._lock:
+            for key in [k for k, (_, value) in self._entries.items() if predicate(value)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+tokens = TTLCache("token", TOKEN_TTL)
+profiles = TTLCache("profile", PROFILE_TTL)
+
+
+def forget_user(user_id: int) -> None:
+    tokens.remove_where(lambda user: user["id"] == user_id)
+    profiles.remove(user_id)
+
+
+def clear() -> None:
+    tokens.clear()
+    profiles.clear()
@@ -0,0 +1,263 @@
+"""Columnar export/import of one user's time series.
+
+An export is a zip readable with np.load (an .npz): every page of up to PAGE_ROWS
+rows of hr_records, window_features and health_records is stored as one .npy
+member per column ("<table>/<page>/<column>"), plus a meta.json member with the
+row counts. Rows are read through Core selects in pages and written straight
+into the zip, and imports insert page by page with executemany, so memory stays
+bounded by one page whatever the row count. Row ids are not exported; an import
+appends to the target user.
+
+    python user_export.py export --user_id 1 --out user1.npz
+    python user_export.py import --user_id 1 --file user1.npz
+    python user_export.py bench --rows 1000000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+
+import numpy as np
+from flask import Flask
+from sqlalchemy import Boolean, DateTime, Float, Integer, String, insert, select, type_coerce
+
+import database
+import response_cache
+import risk_cache
+import shards
+import user_cache
+
+FORMAT_VERSION = 1
+PAGE_ROWS = 50000
+META_MEMBER = "meta.json"
+
+# table -> exported columns (user_id and id are implied)
+TABLES = {
+    "hr_records": ("heart_rate", "timestamp"),
+    "window_features": ("file", "fs_hz", "max_hr", "avg_hr", "st_label", "oldpeak", "resting_ecg",
+                        "calc_time", "timestamp"),
+    "health_records": ("resting_bp", "cholesterol", "fasting_bs", "timestamp"),
+}
+
+
+def _model(table: str):
+    return {
+        "hr_records": database.HRRecord,
+        "window_features": database.WindowFeature,
+        "health_records": database.HealthRecord,
+    }[table]
+
+
+def _export_column(column):
+    # SQLite stores DateTime as ISO text; numpy parses that far faster than it converts datetime objects
+    if isinstance(column.type, DateTime):
+        return type_coerce(column, String).label(column.key)
+    return column
+
+
+def _to_array(column, values: list) -> tuple[np.ndarray, np.ndarray | None]:
+    """Column values -> (typed array, null mask or None)."""
+    if isinstance(column.type, DateTime):
+        return np.array(values, dtype="datetime64[us]"), None
+    if isinstance(column.type, Boolean):
+        return np.array(values, dtype=np.bool_), None
+    if isinstance(column.type, Float):
+        return np.array(values, dtype=np.float64), None
+    if isinstance(column.type, Integer):
+        return np.array(values, dtype=np.int64), None
+    nulls = np.array([v is None for v in values], dtype=np.bool_)
+    array = np.array(["" if v is None else v for v in values], dtype=np.str_)
+    return array, nulls if nulls.any() else None
+
+
+def _write_member(zf: zipfile.ZipFile, name: str, array: np.ndarray) -> None:
+    with zf.open(f"{name}.npy", "w", force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+# ==================== Export ====================
+
+def iter_export(user_id: int, fileobj, page_rows: int = PAGE_ROWS):
+    """Write the export of user_id to fileobj, yielding after every page.
+
+    fileobj only needs write() and tell(); the zip is written with data descriptors
+    when it cannot seek, so the export can be streamed to an HTTP response.
+    """
+    meta = {"version": FORMAT_VERSION, "user_id": user_id, "exported_at": datetime.now().isoformat(),
+            "tables": {}}
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for table, columns in TABLES.items():
+            model = _model(table)
+            stmt = select(*[_export_column(getattr(model, c)) for c in columns])\
+                .where(model.user_id == user_id)\
+                .order_by(model.timestamp, model.id)\
+                .execution_options(yield_per=page_rows)
+            n_rows = n_pages = 0
+            # Core rows straight from the connection, no ORM loading
+            with shards.use(user_id):
+                result = database.db.session.connection(bind_arguments={"clause": stmt}).execute(stmt)
+            for page in result.partitions():
+                for column, values in zip(columns, zip(*page)):
+                    array, nulls = _to_array(getattr(model, column), list(values))
+                    _write_member(zf, f"{table}/{n_pages:06d}/{column}", array)
+                    if nulls is not None:
+                        _write_member(zf, f"{table}/{n_pages:06d}/{column}.null", nulls)
+                n_rows += len(page)
+                n_pages += 1
+                yield
+            meta["tables"][table] = {"rows": n_rows, "pages": n_pages, "columns": list(columns)}
+        zf.writestr(META_MEMBER, json.dumps(meta))
+    database.db.session.commit()  # end the read transaction
+    yield
+
+
+def export_user(user_id: int, path: str) -> dict:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for _ in iter_export(user_id, f):
+            pass
+    os.replace(tmp_path, path)
+    return read_meta(path)
+
+
+class _ChunkStream:
+    """Write-only file object collecting bytes for a streamed HTTP response."""
+
+    def __init__(self):
+        self._chunks = []
+        self._written = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._written += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._written
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_export(user_id: int):
+    """Export as an iterator of bytes chunks (about one page each)."""
+    out = _ChunkStream()
+    for _ in iter_export(user_id, out):
+        data = out.drain()
+        if data:
+            yield data
+
+
+# ==================== Import ====================
+
+def read_meta(path: str) -> dict:
+    with zipfile.ZipFile(path) as zf:
+        meta = json.loads(zf.read(META_MEMBER))
+    if meta.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported export version {meta.get('version')}")
+    return meta
+
+
+def _page_rows(data, table: str, page: int, columns: list[str], user_id: int) -> list[dict]:
+    values = []
+    for column in columns:
+        array = data[f"{table}/{page:06d}/{column}"]
+        column_values = array.tolist()  # datetime64[us] -> datetime, str_ -> str
+        null_key = f"{table}/{page:06d}/{column}.null"
+        if null_key in data.files:
+            column_values = [None if null else v for v, null in zip(column_values, data[null_key])]
+        values.append(column_values)
+    return [dict(zip(columns, row), user_id=user_id) for row in zip(*values)]
+
+
+def import_user(path: str, user_id: int) -> dict:
+    """Append an export to user_id's data; returns rows imported per table."""
+    meta = read_meta(path)
+    imported = {}
+    with np.load(path, allow_pickle=False) as data:
+        for table, info in meta["tables"].items():
+            if table not in TABLES:
+                continue
+            columns = info["columns"]
+            for page in range(info["pages"]):
+                rows = _page_rows(data, table, page, columns, user_id)
+                # Streamed tables go through the same path as live rows so HR rollups and the
+                # window aggregate stay exact
+                if table == "hr_records":
+                    database.write_stream_batch(hr_rows=rows)
+                elif table == "window_features":
+                    database.write_stream_batch(window_rows=rows)
+                else:
+                    database.db.session.execute(insert(_model(table).__table__), rows)
+                    database.db.session.commit()
+                    response_cache.touch(user_id, "health")
+                imported[table] = imported.get(table, 0) + len(rows)
+    risk_cache.invalidate(user_id)
+    user_cache.forget_user(user_id)
+    return imported
+
+
+# ==================== Benchmark ====================
+
+def benchmark(rows: int) -> dict:
+    """Export and re-import one user with `rows` rows in each time-series table."""
+    import db_bench
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = db_bench._make_app(os.path.join(tmp_dir, "bench.db"))
+        path = os.path.join(tmp_dir, "export.npz")
+        with app.app_context():
+            db_bench.seed(1, rows)
+            start = time.perf_counter()
+            meta = export_user(1, path)
+            export_s = time.perf_counter() - start
+            total = sum(info["rows"] for info in meta["tables"].values())
+
+            database.create_user("g-import", "import@example.com", "import", "token-import")
+            target = database.get_user_by_google_id("g-import").id
+            start = time.perf_counter()
+            import_user(path, target)
+            import_s = time.perf_counter() - start
+        return {
+            "rows": total,
+            "file_mb": round(os.path.getsize(path) / 1e6, 1),
+            "export_s": round(export_s, 2),
+            "export_rows_per_s": round(total / export_s),
+            "import_s": round(import_s, 2),
+            "import_rows_per_s": round(total / import_s),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='User time-series export/import')
+    parser.add_argument('command', choices=['export', 'import', 'bench'])
+    parser.add_argument('--user_id', type=int, help='User to export, or to import into')
+    parser.add_argument('--out', help='Export file (export)')
+    parser.add_argument('--file', help='Export file (import)')
+    parser.add_argument('--rows', type=int, default=1000000, help='Rows per table (bench)')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        print(benchmark(args.rows))
+    else:
+        if args.user_id is None:
+            parser.error('--user_id is required')
+        app = Flask(__name__)
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(data_dir, "data.db")}'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        app.config['SQLITE_SHARD_DIR'] = os.environ.get('SQLITE_SHARD_DIR')
+        database.init_db(app)
+        with app.app_context():
+            if args.command == 'export':
+                print(export_user(args.user_id, args.out or f'user{args.user_id}.npz'))
+            else:
+                print(import_user(args.file, args.user_id))
@@ -9,6 +9,9 @@ const MAX_ECG_POINTS = 300;
 const ECG_UPDATE_MS = 40;
 const ECG_WINDOW_SECONDS = 10; // seconds of ECG to display
 const ECG_DOWNLOAD_SECONDS = 30; // seconds of ECG kept for download
+const ECG_BINARY_FRAMES = true;  // request compact binary frames (backend/ecg_frames.py)
+const ECG_FRAME_VERSION = 1;
+const ECG_SAMPLE_SCALE = 1e-4;   // volts per int16 delta step
 
 // ECG smooth-render state
 let ecgLastReceivedTime = -Infinity;  // highest data timestamp received (for dedup)
@@ -24,15 +27,55 @@ function updateAFStatus(afData) {
 
 // --- WebSocket ---
 
+// Binary frame: 24-byte little-endian header, int16 deltas (or float32 samples), optional status JSON.
+// Layout documented in backend/ecg_frames.py.
+function decodeEcgFrame(buffer) {
+    const view = new DataView(buffer);
+    if (view.getUint8(0) !== ECG_FRAME_VERSION) {
+        throw new Error(`Unsupported ECG frame version ${view.getUint8(0)}`);
+    }
+    const flags = view.getUint8(1);
+    const n = view.getUint16(2, true);
+    const base = view.getFloat64(8, true);
+    const period = view.getFloat32(16, true);
+    const times = new Array(n);
+    const points = new Array(n);
+    let offset = 24;
+    if (flags & 1) {
+        for (let i = 0; i < n; ++i, offset += 4) {
+            points[i] = view.getFloat32(offset, true);
+        }
+    } else if (n > 0) {
+        let q = view.getInt32(20, true);
+        points[0] = q * ECG_SAMPLE_SCALE;
+        for (let i = 1; i < n; ++i, offset += 2) {
+            q += view.getInt16(offset, true);
+            points[i] = q * ECG_SAMPLE_SCALE;
+        }
+    }
+    for (let i = 0; i < n; ++i) {
+        times[i] = base + i * period;
+    }
+    const frame = { seq: view.getUint32(4, true), times, points };
+    if (flags & 2) {
+        const length = view.getUint16(offset, true);
+        const status = new TextDecoder().decode(new Uint8Array(buffer, offset + 2, length));
+        Object.assign(frame, JSON.parse(status));
+    }
+    return frame;
+}
+
 function connectWebSocket() {
     if (ecgSocket || !apiToken) return;
 
     const wsHost = API_BASE_URL.replace(/^https?:\/\//, '');
     const proto = API_BASE_URL.startsWith('https:') ? 'wss' : 'ws';
 
-    const wsUrl = `${proto}://${wsHost}/ws/ecg/stream?token=${apiToken}`;
+    const format = ECG_BINARY_FRAMES ? '&format=bin' : '';
+    const wsUrl = `${proto}://${wsHost}/ws/ecg/stream?token=${apiToken}${format}`;
 
     ecgSocket = new WebSocket(wsUrl);
+    ecgSocket.binaryType = 'arraybuffer';
 
     ecgSocket.onopen = () => {
         console.log('ECG WebSocket Connected');
@@ -43,7 +86,7 @@ function connectWebSocket() {
 
     ecgSocket.onmessage = (event) => {
         try {
-            const data = JSON.parse(event.data);
+            const data = typeof event.data === 'string' ? JSON.parse(event.data) : decodeEcgFrame(event.data);
             if (data.points && Array.isArray(data.points)) {
                 const times = data.times || [];
                 for (let i = 0; i < data.points.length; ++i) {